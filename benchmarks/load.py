@@ -0,0 +1,418 @@
+"""
+End to end load test of the plugin stack
+
+Boots the TiddlyWeb WSGI app in this process, with the user_space
+extractor, the like and related filters and tiddlywebpages, against
+a text store generated in a temporary directory. The store has a
+templates bag (a wrapper, list and tiddler templates, and two
+sub-templates), a site recipe of system and content bags, and a
+space for each user, made by user_space on their first request.
+
+A number of client threads then send a mix of requests straight to
+the app, each as a logged in user:
+
+    page      GET the site recipe as an HTML page (list template)
+    tiddler   GET a single tiddler as an HTML page (tiddler template)
+    filtered  GET a filtered (select, sort, limit, like, related) JSON listing
+    put       PUT a tiddler into the user's public bag
+
+and throughput, latency percentiles for each kind of request, and a
+breakdown of the time spent in each stage (extracting the user, and
+the tiddlywebpages profile: queries, store reads, templates, Jinja
+rendering and the wrapper) are reported. Stages are inclusive, so
+a template includes the store reads made while rendering it.
+
+The exit status is 1 if --max-p95 (milliseconds, for any kind of
+request) or --max-errors is exceeded, so it can be used to check
+an upgrade doesn't make things slower.
+
+usage: python benchmarks/load.py [--threads=N] [--requests=N] [--tiddlers=N]
+    [--users=N] [--mix=page:4,tiddler:3,filtered:2,put:1] [--seed=N]
+    [--max-p95=<ms>] [--max-errors=N] [--json] [--keep]
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+import threading
+from StringIO import StringIO
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+for directory in ('tw_pages', 'filters', 'spaces', os.path.join('spaces', 'examples')):
+    sys.path.insert(0, os.path.join(ROOT, directory))
+
+import simplejson
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.recipe import Recipe
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import Store
+from tiddlyweb.util import sha
+from tiddlyweb.web.serve import load_app
+
+import user_space
+
+SECRET = 'load test secret'
+TAGS = ['news', 'blog', 'docs', 'release', 'howto', 'faq']
+WORDS = ('the quick brown fox jumps over a lazy dog while tiddlers and bags '
+    'and recipes are served from the store to everyone').split()
+DEFAULT_MIX = 'page:4,tiddler:3,filtered:2,put:1'
+FILTERED_QUERIES = [
+    'select=tag:news;sort=-modified;limit=20',
+    'select=tag:docs;sort=title',
+    'like=title,10:item 1',
+    'related=tags,title:item 7',
+]
+
+WRAPPER = u"""<html><head><title>{{ title }}</title>
+<link rel="stylesheet" href="{{ prefix }}/bags/system/tiddlers/site.css"></head>
+<body><div id="content">{{ content }}</div></body></html>"""
+
+LIST_TEMPLATE = u"""<div class="latest">{{ extra.latest }}</div>
+<div class="docs">{{ extra.docs }}</div>
+<ul>{% for tiddler in tiddlers[:50] %}
+<li><a href="{{ prefix }}/recipes/site/tiddlers/{{ tiddler.title }}">{{ tiddler.title }}</a>
+{{ tiddler.text|shorten(120, True, '...') }}</li>{% endfor %}
+</ul>"""
+
+SIDEBAR_TEMPLATE = u"""<ul>{% for tiddler in tiddlers %}
+<li><a href="{{ prefix }}/recipes/site/tiddlers/{{ tiddler.title }}">{{ tiddler.title }}</a>
+({{ tiddler.modified }})</li>{% endfor %}</ul>"""
+
+TIDDLER_TEMPLATE = u"""<div class="latest">{{ extra.latest }}</div>
+{% for tiddler in tiddlers %}<h1>{{ tiddler.title }}</h1>
+<div class="tags">{{ tiddler.tags|join(', ') }}</div>
+{{ tiddler.text|wikified(tiddler.recipe or 'site') }}{% endfor %}"""
+
+TW_PAGES_CONFIG = u"""container: site
+list_tiddlers: list
+single_tiddler: tiddler
+wrapper: Default"""
+
+
+def _text(rand, paragraphs):
+    lines = []
+    for i in range(paragraphs):
+        words = [rand.choice(WORDS) for j in range(rand.randint(20, 60))]
+        lines.append(u'!!Section %d\n%s [[item %d]] and \'\'more\'\'.' % (i,
+            u' '.join(words), rand.randint(0, 100)))
+    return u'\n\n'.join(lines)
+
+
+def _put_template(store, title, text, fields=None):
+    tiddler = Tiddler(title, 'templates')
+    tiddler.text = text
+    tiddler.fields = fields or {}
+    store.put(tiddler)
+
+
+def build_store(store_root, tiddlers, rand):
+    """
+    fill a text store at store_root with the site
+    """
+    store = Store('text', {'store_root': store_root},
+        {'tiddlyweb.config': config})
+    for bag_name in ('system', 'templates', 'twpconfig', 'content'):
+        store.put(Bag(bag_name))
+    recipe = Recipe('site')
+    recipe.set_recipe([['system', ''], ['content', '']])
+    store.put(recipe)
+
+    _put_template(store, 'Default', WRAPPER, {'mime_type': 'text/html'})
+    _put_template(store, 'list', LIST_TEMPLATE, {'mime_type': 'text/html',
+        'page_title': 'Site',
+        'latest': 'site?select=tag:news;sort=-modified;limit=5',
+        'docs': 'site?select=tag:docs;sort=title;limit=10'})
+    _put_template(store, 'tiddler', TIDDLER_TEMPLATE, {'mime_type': 'text/html',
+        'latest': 'site?select=tag:news;sort=-modified;limit=5'})
+    _put_template(store, 'latest', SIDEBAR_TEMPLATE)
+    _put_template(store, 'docs', SIDEBAR_TEMPLATE)
+
+    tiddler = Tiddler('config', 'twpconfig')
+    tiddler.text = TW_PAGES_CONFIG
+    store.put(tiddler)
+    tiddler = Tiddler('site.css', 'system')
+    tiddler.text = u'body { font-family: sans-serif; }'
+    tiddler.type = 'text/css'
+    store.put(tiddler)
+
+    for number in range(tiddlers):
+        tiddler = Tiddler(u'item %d' % number, 'content')
+        tiddler.text = _text(rand, rand.randint(1, 6))
+        tiddler.tags = rand.sample(TAGS, rand.randint(1, 3))
+        tiddler.modified = '2010%02d%02d%02d0000' % (rand.randint(1, 12),
+            rand.randint(1, 28), rand.randint(0, 23))
+        store.put(tiddler)
+
+
+def configure(store_root):
+    config['server_store'] = ['text', {'store_root': store_root}]
+    config['secret'] = SECRET
+    config['system_plugins'] = ['tiddlywebpages', 'like', 'related',
+        'user_space']
+    config['extractors'] = ['user_space']
+    config.setdefault('tw_pages', {}).update(TW_PAGES)
+
+
+#set again after the app is loaded, as plugins merge in their defaults
+TW_PAGES = {
+    'template_bag': 'templates',
+    'config': ['twpconfig', 'config'],
+    'profile': 'header',
+}
+
+
+def timed_extract():
+    """
+    record how long the user_space extractor takes in environ
+    """
+    extract = user_space.Extractor.extract
+    def extract_and_time(self, environ, start_response):
+        start = time.time()
+        try:
+            return extract(self, environ, start_response)
+        finally:
+            environ['load.extract'] = time.time() - start
+    user_space.Extractor.extract = extract_and_time
+
+
+def cookie(usersign):
+    return 'tiddlyweb_user="%s:%s"' % (usersign,
+        sha('%s%s' % (usersign, SECRET)).hexdigest())
+
+
+def make_request(kind, rand, usersign, tiddlers):
+    """
+    return (method, path, query string, body, content type)
+    for a request of kind
+    """
+    if kind == 'page':
+        return 'GET', '/recipes/site/tiddlers', '', '', None
+    if kind == 'tiddler':
+        title = 'item%%20%d' % rand.randint(0, tiddlers - 1)
+        return 'GET', '/recipes/site/tiddlers/%s' % title, '', '', None
+    if kind == 'filtered':
+        query = rand.choice(FILTERED_QUERIES).replace(' ', '%20')
+        return 'GET', '/recipes/site/tiddlers.json', query, '', None
+    body = simplejson.dumps({'text': _text(rand, 2), 'tags': [rand.choice(TAGS)]})
+    title = 'note%%20%d' % rand.randint(0, 50)
+    return ('PUT', '/bags/%s_public/tiddlers/%s' % (usersign, title), '',
+        body, 'application/json')
+
+
+def call(app, method, path, query, body, content_type, usersign):
+    """
+    send a request to app, returning (status, environ)
+    """
+    environ = {
+        'REQUEST_METHOD': method,
+        'SCRIPT_NAME': '',
+        'PATH_INFO': path,
+        'QUERY_STRING': query,
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '8080',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': 'localhost:8080',
+        'HTTP_ACCEPT': 'text/html',
+        'HTTP_COOKIE': cookie(usersign),
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': StringIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    if content_type:
+        environ['CONTENT_TYPE'] = content_type
+    status = []
+    def start_response(response_status, headers, exc_info=None):
+        status.append(response_status)
+    output = app(environ, start_response)
+    try:
+        for chunk in output:
+            pass
+    finally:
+        if hasattr(output, 'close'):
+            output.close()
+    return status and status[0] or '500 no response', environ
+
+
+def stage_times(environ):
+    """
+    return a dict of the time spent in each stage of a request
+    """
+    stages = {}
+    if 'load.extract' in environ:
+        stages['extract'] = environ['load.extract']
+    profile = environ.get('tw_pages.profile')
+    if profile is not None:
+        for timing in profile.walk():
+            if timing.elapsed is not None:
+                stages[timing.kind] = stages.get(timing.kind, 0) + timing.elapsed
+    return stages
+
+
+class Results(object):
+    """
+    latencies, errors and stage times for each kind of request
+    """
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, kind, latency, status, stages):
+        self._lock.acquire()
+        try:
+            self.latencies.setdefault(kind, []).append(latency)
+            if not status[0] in '23':
+                self.errors[kind] = self.errors.get(kind, 0) + 1
+            for stage, elapsed in stages.items():
+                self.stages.setdefault(stage, []).append(elapsed)
+        finally:
+            self._lock.release()
+
+
+def _percentile(ordered, percent):
+    return ordered[int(round(percent / 100.0 * (len(ordered) - 1)))]
+
+
+def client(app, results, mix, count, seed, users, tiddlers):
+    rand = random.Random(seed)
+    for i in range(count):
+        kind = rand.choice(mix)
+        usersign = 'user%d' % rand.randint(0, users - 1)
+        request = make_request(kind, rand, usersign, tiddlers)
+        start = time.time()
+        try:
+            status, environ = call(app, *(request + (usersign,)))
+        except Exception, exc:
+            status, environ = '500 %s' % exc, {}
+        results.add(kind, time.time() - start, status, stage_times(environ))
+
+
+def summarise(results, elapsed):
+    summary = {'requests': 0, 'elapsed': elapsed, 'kinds': {}, 'stages': {}}
+    for kind, latencies in sorted(results.latencies.items()):
+        latencies = sorted(latencies)
+        summary['requests'] += len(latencies)
+        summary['kinds'][kind] = {
+            'count': len(latencies),
+            'errors': results.errors.get(kind, 0),
+            'p50': _percentile(latencies, 50) * 1000,
+            'p90': _percentile(latencies, 90) * 1000,
+            'p95': _percentile(latencies, 95) * 1000,
+            'p99': _percentile(latencies, 99) * 1000,
+            'max': latencies[-1] * 1000,
+        }
+    for stage, times in sorted(results.stages.items()):
+        summary['stages'][stage] = {
+            'count': len(times),
+            'mean': sum(times) * 1000 / len(times),
+            'p95': _percentile(sorted(times), 95) * 1000,
+        }
+    summary['throughput'] = elapsed and summary['requests'] / elapsed or 0
+    return summary
+
+
+def report(summary):
+    print '%d requests in %.2f s, %.1f requests/s' % (summary['requests'],
+        summary['elapsed'], summary['throughput'])
+    print
+    print '%-10s %7s %7s %9s %9s %9s %9s %9s' % ('request', 'count', 'errors',
+        'p50 ms', 'p90 ms', 'p95 ms', 'p99 ms', 'max ms')
+    for kind, stats in sorted(summary['kinds'].items()):
+        print '%-10s %7d %7d %9.2f %9.2f %9.2f %9.2f %9.2f' % (kind,
+            stats['count'], stats['errors'], stats['p50'], stats['p90'],
+            stats['p95'], stats['p99'], stats['max'])
+    print
+    print '%-14s %7s %9s %9s' % ('stage', 'count', 'mean ms', 'p95 ms')
+    for stage, stats in sorted(summary['stages'].items()):
+        print '%-14s %7d %9.2f %9.2f' % (stage, stats['count'], stats['mean'],
+            stats['p95'])
+
+
+def _parse_args(args):
+    options = {'threads': 8, 'requests': 2000, 'tiddlers': 500, 'users': 20,
+        'mix': DEFAULT_MIX, 'seed': 1, 'max_p95': None, 'max_errors': None,
+        'json': False, 'keep': False}
+    for arg in args:
+        name, _, value = arg.lstrip('-').partition('=')
+        name = name.replace('-', '_')
+        if name not in options:
+            raise SystemExit(__doc__)
+        if name in ('json', 'keep'):
+            options[name] = True
+        elif name == 'mix':
+            options[name] = value
+        elif name == 'max_p95':
+            options[name] = float(value)
+        else:
+            options[name] = int(value)
+    mix = []
+    for part in options['mix'].split(','):
+        kind, weight = part.split(':')
+        if kind not in ('page', 'tiddler', 'filtered', 'put'):
+            raise SystemExit('unknown request kind %s' % kind)
+        mix.extend([kind] * int(weight))
+    options['mix'] = mix
+    return options
+
+
+def main(args):
+    options = _parse_args(args)
+    directory = tempfile.mkdtemp()
+    try:
+        store_root = os.path.join(directory, 'store')
+        configure(store_root)
+        build_store(store_root, options['tiddlers'], random.Random(options['seed']))
+        app = load_app()
+        config['tw_pages'].update(TW_PAGES)
+        timed_extract()
+
+        results = Results()
+        per_thread = options['requests'] / options['threads']
+        threads = []
+        start = time.time()
+        for number in range(options['threads']):
+            thread = threading.Thread(target=client, args=(app, results,
+                options['mix'], per_thread, options['seed'] + number,
+                options['users'], options['tiddlers']))
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        summary = summarise(results, time.time() - start)
+    finally:
+        if options['keep']:
+            print >> sys.stderr, 'store kept in %s' % directory
+        else:
+            shutil.rmtree(directory)
+
+    if options['json']:
+        print simplejson.dumps(summary, indent=2)
+    else:
+        report(summary)
+
+    failed = False
+    for kind, stats in summary['kinds'].items():
+        if options['max_p95'] is not None and stats['p95'] > options['max_p95']:
+            print >> sys.stderr, '%s p95 %.2f ms is over %.2f ms' % (kind,
+                stats['p95'], options['max_p95'])
+            failed = True
+    errors = sum(stats['errors'] for stats in summary['kinds'].values())
+    if options['max_errors'] is not None and errors > options['max_errors']:
+        print >> sys.stderr, '%d errors is over %d' % (errors,
+            options['max_errors'])
+        failed = True
+    return failed and 1 or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
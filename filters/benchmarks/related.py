@@ -0,0 +1,91 @@
+"""
+Benchmark the peak memory used by the related filter
+
+Runs related over a generator of <tiddlers> tiddlers (as a large
+recipe would give it), once with the single pass match_related_articles
+and once copying them all into a list first (as it used to). Each
+is run in a separate process so their peak memory can be compared.
+
+usage: python benchmarks/related.py [<tiddlers>]
+"""
+import os
+import sys
+import time
+import resource
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from related import match_related_articles, score
+
+from tiddlyweb.filters import parse_for_filters, recursive_filter
+from tiddlyweb.model.tiddler import Tiddler
+
+SOURCE = 'tiddler0'
+WORDS = ['alpha', 'beta', 'gamma', 'delta', 'epsilon', 'zeta', 'eta', 'theta']
+
+
+class SourceStore(object):
+    """
+    a store with just the tiddler being compared against in it
+    """
+    def get(self, tiddler):
+        return make_tiddler(0)
+
+
+def make_tiddler(number):
+    tiddler = Tiddler('tiddler%d' % number, 'bench')
+    tiddler.tags = [WORDS[number % 8], WORDS[number % 5]]
+    tiddler.text = u' '.join(WORDS[(number + i) % 8] for i in range(40))
+    return tiddler
+
+
+def make_tiddlers(count):
+    for number in xrange(count):
+        yield make_tiddler(number)
+
+
+def list_related(title, matches, tiddlers):
+    """
+    the related filter as it was, copying everything into a list
+    """
+    tiddlers = [tiddler for tiddler in tiddlers]
+    source_tiddler = recursive_filter(parse_for_filters('select=title:%s' %
+        title)[0], tiddlers).next()
+    sort_set = []
+    for tiddler in tiddlers:
+        count = score(source_tiddler, tiddler, matches)
+        if count > 0 and source_tiddler.title != tiddler.title:
+            sort_set.append([tiddler, count])
+    sort_set.sort(lambda a, b: cmp(b[1], a[1]))
+    return (tiddler_set[0] for tiddler_set in sort_set)
+
+
+def run(name, count):
+    environ = {'tiddlyweb.store': SourceStore(),
+        'wsgiorg.routing_args': ((), {'bag_name': 'bench'})}
+    #tiddlers tagged alpha (about 1 in 4) are related to tiddler0
+    start = time.time()
+    if name == 'single pass':
+        related = match_related_articles(SOURCE, ['tags'],
+            make_tiddlers(count), environ)
+    else:
+        related = list_related(SOURCE, ['tags'], make_tiddlers(count))
+    found = len(list(related))
+    elapsed = time.time() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print '%-12s %8.1f MB peak %8.2f s %d related' % (name, peak / 1024.0,
+        elapsed, found)
+
+
+def main(args):
+    count = args and int(args[0]) or 200000
+    for name in ('single pass', 'list'):
+        subprocess.call([sys.executable, __file__, '--run', name, str(count)])
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--run']:
+        run(sys.argv[2], int(sys.argv[3]))
+    else:
+        main(sys.argv[1:])
@@ -7,10 +7,15 @@ eg:
 
 will return all tiddlers where bar is contained somewhere within the title
 
+/bags/foo/tiddlers?like=title,10:bar
+
+will stop looking after the first 10 of them, however large the bag is.
+
 """
 
-from tiddlyweb.filters import FILTER_PARSERS
-from tiddlyweb.filters.select import select_parse
+from tiddlyweb.filters import FILTER_PARSERS, FilterError
+
+from itertools import islice
 
 
 
@@ -32,8 +37,8 @@ def compare_tags(source, test, negate=False):
 
 def compare_fields(source, test, attribute, negate=False):
     try:
-        if type(test[attribute]) == text:
-            return compare_text(source[attribute], test[attribute])
+        if isinstance(test[attribute], basestring):
+            return compare_text(source, test[attribute], negate)
     except KeyError:
         return False != negate
             
@@ -44,7 +49,19 @@ ATTRIBUTE_SELECTOR={
     }
 
 
-def like(attribute, args, tiddlers, negate=False):
+def like(attribute, args, tiddlers, negate=False, limit=None):
+    """
+    return the tiddlers where args is somewhere in attribute,
+    stopping after limit of them (if given) without looking
+    at the rest.
+    """
+    found = like_matches(attribute, args, tiddlers, negate)
+    if limit is not None:
+        found = islice(found, limit)
+    return found
+
+
+def like_matches(attribute, args, tiddlers, negate=False):
     for tiddler in tiddlers:
         try:
             test = getattr(tiddler, attribute)
@@ -59,16 +76,33 @@ def like(attribute, args, tiddlers, negate=False):
     return 
  
  
-def like_parse(command):
+def like_parse(command, limit=None):
+    """
+    return a filter for command (attribute:args, or
+    attribute,limit:args to stop after limit matches).
+
+    a limit that isn't a number raises FilterError when
+    the filter is run.
+    """
     attribute, args = command.split(':', 1)
+    error = None
+    if ',' in attribute:
+        attribute, limit = attribute.split(',', 1)
+        try:
+            limit = int(limit)
+        except ValueError:
+            #reported when the filter is run, as tiddlyweb's own filters do,
+            #so that it becomes a 400 rather than a 500
+            error = 'like: limit must be a number, not %s' % limit
     
-    if args.startswith('!'):
+    negate = args.startswith('!')
+    if negate:
         args = args.replace('!', '', 1)
-        def selector(tiddlers, indexable=False, environ=None):
-            return like(attribute, args, tiddlers, negate=True)
-    else:    
-        def selector(tiddlers, indexable=False, environ=None):
-            return like(attribute, args, tiddlers)
+    
+    def selector(tiddlers, indexable=False, environ=None):
+        if error:
+            raise FilterError(error)
+        return like(attribute, args, tiddlers, negate, limit)
             
     return selector
  
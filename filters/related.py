@@ -7,12 +7,18 @@ eg:
 /bags/foo/tiddlers?related=title,tags:bar
 
 will return all tiddlers related (by title and tags) to the tiddler "bar", ranked in most related first order
-"""
 
-from tiddlyweb.filters import FILTER_PARSERS, parse_for_filters, recursive_filter
+"bar" is read from the bag or recipe in the URL, and the tiddlers are compared with it in a single
+pass, so only the related tiddlers are kept in memory.
+"""
 
-import logging
+from tiddlyweb.filters import FILTER_PARSERS
+from tiddlyweb.model.recipe import Recipe
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import NoBagError, NoRecipeError, NoTiddlerError
+from tiddlyweb import control
 
+import urllib
 import re
 
 
@@ -36,7 +42,7 @@ def compare_tags(source, test):
 def compare_fields(source, test, match):
     count = 0
     try:
-        if type(source[match]) == text:
+        if isinstance(source[match], basestring):
             count = compare_text(source[match], test[match])
     except KeyError:
         pass
@@ -47,36 +53,91 @@ ATTRIBUTE_SELECTOR={
     'tags': compare_tags,
     }
 
-def match_related_articles(title, matches, tiddlers): 
-    def empty_generator(): return ;yield 'never'
-    tiddlers = [tiddler for tiddler in tiddlers]
+def route_value(environ, name):
+    """
+    return the named value from the URL, decoded, as the
+    tiddlyweb handlers do. raises KeyError if it isn't there.
+    """
+    value = environ['wsgiorg.routing_args'][1][name]
+    value = urllib.unquote(value)
+    return unicode(value, 'utf-8')
+
+def get_source_tiddler(title, environ):
+    """
+    get the tiddler to compare against straight from the bag or
+    recipe in the URL. returns None if there isn't one to look in.
+    """
+    if not environ or 'tiddlyweb.store' not in environ:
+        return None
+    store = environ['tiddlyweb.store']
+    tiddler = Tiddler(title)
     try:
-        source_tiddler = recursive_filter(parse_for_filters('select=title:%s' % title)[0], tiddlers).next()
-    except StopIteration:
-        #nothing to match on, so return an empty generator
-        return empty_generator()
-                         
+        try:
+            recipe = Recipe(route_value(environ, 'recipe_name'))
+            recipe = store.get(recipe)
+            tiddler.bag = control.determine_tiddler_bag_from_recipe(recipe, tiddler, environ).name
+        except KeyError:
+            tiddler.bag = route_value(environ, 'bag_name')
+    except KeyError:
+        return None
+    return store.get(tiddler)
+
+def score(source_tiddler, tiddler, matches):
+    """
+    return how closely tiddler is related to source_tiddler
+    """
+    count = 0
+    for match in matches:
+        try:
+            source = getattr(source_tiddler, match)
+            test = getattr(tiddler, match)
+            test_func = ATTRIBUTE_SELECTOR.get(match, compare_text)
+            count += test_func(source, test)
+        except AttributeError:
+            count += compare_fields(source_tiddler.fields, tiddler.fields, match)
+    return count
+
+def match_related_articles(title, matches, tiddlers, environ=None): 
+    """
+    score tiddlers against the tiddler called title as they go past, 
+    keeping only those that are related.
+
+    if the tiddler can't be got from the store, tiddlers are kept 
+    until it goes past instead.
+    """
+    try:
+        source_tiddler = get_source_tiddler(title, environ)
+    except (NoTiddlerError, NoBagError, NoRecipeError):
+        #nothing to match on
+        return iter([])
+    
+    waiting = []
     sort_set = []
-    for tiddler in tiddlers: 
-        count = 0
-        for match in matches:
-            try:
-                source = getattr(source_tiddler, match)
-                test = getattr(tiddler, match)
-                test_func = ATTRIBUTE_SELECTOR.get(match, compare_text)
-                count += test_func(source, test)
-            except AttributeError:
-                count += compare_fields(source_tiddler.fields, tiddler.fields, match)
-                            
-        if count > 0 and source_tiddler.title != tiddler.title:
-            sort_set.append([tiddler,count])
+    for tiddler in tiddlers:
+        if source_tiddler is None:
+            if tiddler.title != title:
+                waiting.append(tiddler)
+                continue
+            source_tiddler = tiddler
+            candidates = waiting
+            waiting = None
+        else:
+            candidates = [tiddler]
+        for candidate in candidates:
+            if candidate.title == source_tiddler.title:
+                continue
+            count = score(source_tiddler, candidate, matches)
+            if count > 0:
+                sort_set.append((count, candidate))
     
-    def sort_function(a,b): return cmp(b[1],a[1]) 
-    sort_set.sort(sort_function)
+    if source_tiddler is None:
+        #nothing to match on
+        return iter([])
     
-    result = (tiddler_set[0] for tiddler_set in sort_set)
+    #sort is stable, so equally related tiddlers stay in the order they came in
+    sort_set.sort(key=lambda tiddler_set: tiddler_set[0], reverse=True)
     
-    return result
+    return (tiddler_set[1] for tiddler_set in sort_set)
 
 
 
@@ -86,7 +147,7 @@ def related_parse(command):
     relate_fields = relate_fields.split(',')
     
     def relator(tiddlers, indexable=False, environ=None):
-        return match_related_articles(relate_tiddler, relate_fields, tiddlers)
+        return match_related_articles(relate_tiddler, relate_fields, tiddlers, environ)
     
     return relator
 
@@ -0,0 +1,48 @@
+"""
+test the like filter
+"""
+import sys
+sys.path.insert(0, '.')
+
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.filters import FilterError, parse_for_filters, \
+    recursive_filter
+
+from like import like_parse
+
+
+def _tiddlers(count=10):
+    for number in range(count):
+        tiddler = Tiddler('tiddler %d' % number, 'bag')
+        tiddler.tags = number % 2 and ['odd'] or ['even']
+        yield tiddler
+
+
+def _titles(tiddlers):
+    return [tiddler.title for tiddler in tiddlers]
+
+
+def test_like():
+    assert _titles(like_parse('title:r 1')(_tiddlers(12))) == \
+        ['tiddler 1', 'tiddler 10', 'tiddler 11']
+    assert len(_titles(like_parse('tags:!od')(_tiddlers()))) == 5
+
+
+def test_limit_stops_early():
+    seen = []
+    def tiddlers():
+        for tiddler in _tiddlers():
+            seen.append(tiddler)
+            yield tiddler
+    assert _titles(like_parse('tags,2:odd')(tiddlers())) == \
+        ['tiddler 1', 'tiddler 3']
+    assert len(seen) == 4
+
+
+def test_bad_limit_is_filter_error():
+    filters, leftovers = parse_for_filters('like=title,x:foo')
+    try:
+        list(recursive_filter(filters, _tiddlers()))
+        assert False, 'FilterError not raised'
+    except FilterError, exc:
+        assert 'limit' in str(exc)
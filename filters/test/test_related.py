@@ -0,0 +1,89 @@
+"""
+test the related filter
+"""
+import sys
+sys.path.insert(0, '.')
+
+import os
+import shutil
+import tempfile
+import urllib
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.recipe import Recipe
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import Store
+
+from related import related_parse, route_value
+
+STORE_DIR = os.path.join(tempfile.gettempdir(), 'filters_test_related')
+
+
+def setup_module(module):
+    if os.path.exists(STORE_DIR):
+        shutil.rmtree(STORE_DIR)
+    module.store = Store('text', {'store_root': STORE_DIR},
+        {'tiddlyweb.config': config})
+    store.put(Bag(u'my bag'))
+    recipe = Recipe('site')
+    recipe.set_recipe([[u'my bag', '']])
+    store.put(recipe)
+    for title, tags in [('source', ['a', 'b', 'c']), ('two', ['a', 'b']),
+            ('one', ['c']), ('none', ['d'])]:
+        tiddler = Tiddler(title, u'my bag')
+        tiddler.tags = tags
+        store.put(tiddler)
+
+
+def _tiddlers():
+    #without source, so it has to come from the store
+    return [Tiddler(title, u'my bag') for title in ('two', 'one', 'none')]
+
+
+def _environ(**routing_args):
+    return {'tiddlyweb.store': store, 'tiddlyweb.config': config,
+        'wsgiorg.routing_args': ((), routing_args)}
+
+
+def _titles(tiddlers):
+    return [tiddler.title for tiddler in tiddlers]
+
+
+def _related(tiddlers, environ):
+    tiddlers = list(tiddlers)
+    for tiddler in tiddlers:
+        store.get(tiddler)
+    return _titles(related_parse('tags:source')(tiddlers, environ=environ))
+
+
+def test_route_value():
+    environ = _environ(bag_name=urllib.quote('caf\xc3\xa9 bag'))
+    assert route_value(environ, 'bag_name') == u'caf\xe9 bag'
+    try:
+        route_value(environ, 'recipe_name')
+        assert False, 'KeyError not raised'
+    except KeyError:
+        pass
+
+
+def test_source_from_bag():
+    environ = _environ(bag_name=urllib.quote('my bag'))
+    assert _related(_tiddlers(), environ) == ['two', 'one']
+
+
+def test_source_from_recipe():
+    environ = _environ(recipe_name='site')
+    assert _related(_tiddlers(), environ) == ['two', 'one']
+
+
+def test_source_in_tiddlers_without_routing():
+    tiddlers = _tiddlers() + [Tiddler('source', u'my bag')]
+    environ = {'tiddlyweb.store': store}
+    assert _related(tiddlers, environ) == ['two', 'one']
+
+
+def test_missing_source():
+    environ = _environ(bag_name=urllib.quote('my bag'))
+    filter = related_parse('tags:missing')
+    assert list(filter(_tiddlers(), environ=environ)) == []
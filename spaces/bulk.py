@@ -0,0 +1,157 @@
+"""
+Apply an operation to a large number of spaces at once
+
+Spaces are streamed to a bounded pool of worker threads,
+each with its own Space (and so its own store), so that
+operations such as a policy rollout across thousands of
+spaces are not limited by waiting on the store one space
+at a time.
+
+The names of the spaces are read lazily from whatever
+iterable is passed in, so the full space index never
+needs to be held in memory.
+"""
+from tiddlyweb.store import NoBagError, NoRecipeError
+
+from Queue import Queue
+import threading
+import logging
+import time
+import sys
+
+DEFAULT_WORKERS = 8
+DEFAULT_REPORT_EVERY = 100
+
+
+def project_names(store):
+    """
+    yield the name of every project space in the store
+
+    a project space is a recipe with a matching _config bag
+    (see PROJECT in examples/project_space.py)
+    """
+    bag_names = set(bag.name for bag in store.list_bags())
+    for recipe in store.list_recipes():
+        #<project>_report recipes have no _config bag, so are left out
+        if '%s_config' % recipe.name in bag_names:
+            yield recipe.name
+
+
+def report_progress(done, failed, started, stream=sys.stderr):
+    """
+    write a progress line to stream
+    """
+    elapsed = time.time() - started
+    rate = elapsed and done / elapsed or 0
+    print >> stream, '%d spaces done, %d failed (%.1f/s)' % \
+        (done, failed, rate)
+
+
+class BulkRunner():
+    """
+    run action(space, name) for every name given, using a
+    bounded pool of worker threads.
+
+    space_factory is called once per worker and should return
+    a new Space, so that each thread has its own store. with
+    dry_run, what would be done is written to out instead.
+    """
+    def __init__(self, space_factory, workers=DEFAULT_WORKERS, \
+            dry_run=False, report=report_progress, \
+            report_every=DEFAULT_REPORT_EVERY, out=sys.stdout):
+        self.space_factory = space_factory
+        self.workers = max(1, workers)
+        self.dry_run = dry_run
+        self.out = out
+        self.report = report
+        self.report_every = report_every
+        self.done = 0
+        self.failed = []
+        self.started = None
+        self._lock = threading.Lock()
+
+    def run(self, action, names):
+        """
+        apply action to each name in names
+
+        returns a list of (name, error) for each failure.
+        """
+        self.started = time.time()
+        queue = Queue(self.workers * 2)
+        threads = []
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, args=(action, queue))
+            thread.setDaemon(True)
+            thread.start()
+            threads.append(thread)
+
+        for name in names:
+            queue.put(name)
+        for thread in threads:
+            queue.put(None)
+        for thread in threads:
+            thread.join()
+
+        if self.report:
+            self.report(self.done, len(self.failed), self.started)
+        return self.failed
+
+    def _work(self, action, queue):
+        """
+        take names off the queue until told to stop
+        """
+        space = None
+        space_error = None
+        if not self.dry_run:
+            try:
+                space = self.space_factory()
+            except Exception, exc:
+                #keep taking names, so that run doesn't block, but fail them
+                logging.exception('unable to create a space to apply %s', \
+                    action.__name__)
+                space_error = exc
+        while True:
+            name = queue.get()
+            try:
+                if name is None:
+                    return
+                self._apply(action, space, space_error, name)
+            finally:
+                queue.task_done()
+
+    def _apply(self, action, space, space_error, name):
+        """
+        apply action to name, recording the outcome
+        """
+        error = space_error
+        if self.dry_run:
+            self._lock.acquire()
+            try:
+                print >> self.out, 'dry run: would apply %s to %s' % \
+                    (action.__name__, name)
+            finally:
+                self._lock.release()
+        elif error is None:
+            try:
+                action(space, name)
+            except (NoBagError, NoRecipeError), exc:
+                error = exc
+            except Exception, exc:
+                logging.exception('failed to apply %s to %s', \
+                    action.__name__, name)
+                error = exc
+        self._finished(name, error)
+
+    def _finished(self, name, error):
+        """
+        record the outcome for name and report progress
+        """
+        self._lock.acquire()
+        try:
+            self.done += 1
+            if error is not None:
+                self.failed.append((name, error))
+            if self.report and self.done % self.report_every == 0:
+                self.report(self.done, len(self.failed), self.started)
+        finally:
+            self._lock.release()
@@ -12,11 +12,13 @@ structure directly inside addproject as a dict (as with
 user_space.py)
 """
 from space import Space
+from bulk import BulkRunner, project_names, DEFAULT_WORKERS
 
 from tiddlyweb.manage import make_command
 
 from tiddlywebplugins.utils import get_store
 import simplejson as json
+import sys
 
 PROJECT = """{
     "bags": {
@@ -96,14 +98,78 @@ def addproject(args):
     if len(args) != 1:
         print >> sys.stderr, ('usage: twanager addproject <project_name>')
     
-    #replace PROJECT_NAME with the actual name of the project
-    this_project = PROJECT.replace('PROJECT_NAME', args[0])
-    this_project = json.loads(this_project)
+    this_project = _project(args[0])
     
     #create the space
     project_space = Space({'tiddlyweb.store': get_store(config)})
     project_space.create_space(this_project)
 
+@make_command()
+def updateprojects(args):
+    """re-apply project policies and descriptions. [--dry-run] [--workers=N] [--template=<file>] [<project_name> ...]"""
+    options, names = _parse_bulk_args(args)
+    template = PROJECT
+    if options.get('template'):
+        template = open(options['template']).read()
+
+    def update_project(space, name):
+        space.update_space(_project(name, template))
+
+    if not names:
+        names = project_names(get_store(config))
+    _run_bulk(update_project, names, options)
+
+@make_command()
+def rmprojects(args):
+    """delete project spaces. [--dry-run] [--workers=N] <project_name|-> [...]"""
+    options, names = _parse_bulk_args(args)
+    if not names:
+        print >> sys.stderr, ('usage: twanager rmprojects [--dry-run] '
+            '[--workers=N] <project_name|-> [...]')
+        return
+    if names == ['-']:
+        #read the names from stdin, one per line
+        names = (line.strip() for line in sys.stdin if line.strip())
+
+    def delete_project(space, name):
+        space.delete_space(_project(name))
+
+    _run_bulk(delete_project, names, options)
+
+def _project(name, template=PROJECT):
+    """
+    replace PROJECT_NAME with the actual name of the project
+    and return the space definition
+    """
+    return json.loads(template.replace('PROJECT_NAME', name))
+
+def _parse_bulk_args(args):
+    """
+    split args into a dict of --options and a list of names
+    """
+    options = {'dry_run': False, 'workers': DEFAULT_WORKERS}
+    names = []
+    for arg in args:
+        if arg == '--dry-run':
+            options['dry_run'] = True
+        elif arg.startswith('--workers='):
+            options['workers'] = int(arg.split('=', 1)[1])
+        elif arg.startswith('--template='):
+            options['template'] = arg.split('=', 1)[1]
+        else:
+            names.append(arg)
+    return options, names
+
+def _run_bulk(action, names, options):
+    """
+    apply action to every project in names and report any failures
+    """
+    runner = BulkRunner(lambda: Space({'tiddlyweb.store': get_store(config)}),
+        workers=options['workers'], dry_run=options['dry_run'])
+    failed = runner.run(action, names)
+    for name, error in failed:
+        print >> sys.stderr, ('%s failed: %s' % (name, error))
+
 def init(config_in):
     global config
     config = config_in
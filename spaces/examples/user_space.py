@@ -2,9 +2,17 @@
 Defines an extractor that creates a public and private bag for the
 user who is logged in.
 
+The bags (and the user's recipe) are created in the background (see
+provision.py), so the user's first request isn't held up by it. To
+hold back requests for them until they exist, and to report on how
+provisioning is going at /spaces/provisioning, add user_space to
+system_plugins in tiddlywebconfig.py too.
+
 This extractor is based on the cookie extractor in TiddlyWeb core
 """
 from space import Space
+from provision import Provisioner, DEFAULT_WORKERS, DEFAULT_QUEUE_SIZE, \
+    DEFAULT_WAIT
  
 from tiddlyweb.model.user import User
 from tiddlyweb.model.bag import Bag
@@ -15,9 +23,113 @@ from tiddlyweb.web.extractors import ExtractorInterface
 from tiddlyweb.web.http import HTTP400
 from tiddlyweb.util import sha
 
+from tiddlywebplugins.utils import get_store
+import simplejson as json
+import threading
 import Cookie
 import logging
 
+_provisioner = []
+_provisioner_lock = threading.Lock()
+
+def _user_space(usersign):
+    """
+    return the space (as passed to Space.create_space)
+    for the user called usersign
+    """
+    public_bag = '%s_public' % usersign
+    private_bag = '%s_private' % usersign
+    return {
+        'bags': {
+            public_bag: {
+                'policy': {
+                    "read": [],
+                    "create": [usersign], 
+                    "manage": [usersign, "R:ADMIN"], 
+                    "accept": [], 
+                    "write": [usersign], 
+                    "owner": usersign, 
+                    "delete": [usersign, "R:ADMIN"]
+                }
+            },
+            private_bag: {
+                'policy': {
+                    "read": [usersign],
+                    "create": [usersign], 
+                    "manage": [usersign, "R:ADMIN"], 
+                    "accept": [], 
+                    "write": [usersign], 
+                    "owner": usersign, 
+                    "delete": [usersign]
+                }
+            }
+        },
+        'recipes': {
+            '%s' % usersign: {
+                'recipe': [
+                    ['system',''],
+                    [public_bag, ''],
+                    [private_bag,'']
+                ],
+                'policy': {
+                    "read": [usersign],
+                    "create": [usersign], 
+                    "manage": [usersign, "R:ADMIN"], 
+                    "accept": [], 
+                    "write": [usersign], 
+                    "owner": usersign, 
+                    "delete": [usersign]
+                }
+            }
+        }
+    }
+
+
+def _get_provisioner(config):
+    """
+    return the Provisioner for this process,
+    creating it if necessary
+    """
+    if not _provisioner:
+        _provisioner_lock.acquire()
+        try:
+            if not _provisioner:
+                _provisioner.append(Provisioner(
+                    lambda: Space({'tiddlyweb.store': get_store(config)}),
+                    workers=config.get('user_space_workers', DEFAULT_WORKERS),
+                    queue_size=config.get('user_space_queue_size', DEFAULT_QUEUE_SIZE),
+                    wait=config.get('user_space_wait', DEFAULT_WAIT)))
+        finally:
+            _provisioner_lock.release()
+    return _provisioner[0]
+
+
+class SpaceReady(object):
+    """
+    WSGI middleware that holds back requests for a user's bags
+    or recipe until they have been created
+    """
+    def __init__(self, application):
+        self.application = application
+
+    def __call__(self, environ, start_response):
+        _get_provisioner(environ['tiddlyweb.config']).wait_for_path(
+            environ.get('PATH_INFO', ''))
+        return self.application(environ, start_response)
+
+
+def provision_stats(environ, start_response):
+    """
+    report the space provisioning queue depth and
+    latency as JSON
+    """
+    start_response('200 OK', [
+        ('Content-Type', 'application/json; charset=utf-8'),
+        ('Cache-Control', 'no-cache')
+        ])
+    return [json.dumps(_get_provisioner(environ['tiddlyweb.config']).stats())]
+
+
 class Extractor(ExtractorInterface):
     """
     Look in the headers for a cookie named 'tiddlyweb_user'.
@@ -47,56 +159,10 @@ class Extractor(ExtractorInterface):
                 except (StoreMethodNotImplemented, NoUserError):
                     pass
                     
-                #check that the user has the requisite bags
-                #if they don't, create them
-                public_bag = '%s_public' % user.usersign
-                private_bag = '%s_private' % user.usersign
-                space = {
-                    'bags': {
-                        public_bag: {
-                            'policy': {
-                                "read": [],
-                                "create": [user.usersign], 
-                                "manage": [user.usersign, "R:ADMIN"], 
-                                "accept": [], 
-                                "write": [user.usersign], 
-                                "owner": user.usersign, 
-                                "delete": [user.usersign, "R:ADMIN"]
-                            }
-                        },
-                        private_bag: {
-                            'policy': {
-                                "read": [user.usersign],
-                                "create": [user.usersign], 
-                                "manage": [user.usersign, "R:ADMIN"], 
-                                "accept": [], 
-                                "write": [user.usersign], 
-                                "owner": user.usersign, 
-                                "delete": [user.usersign]
-                            }
-                        }
-                    },
-                    'recipes': {
-                        '%s' % user.usersign: {
-                            'recipe': [
-                                ['system',''],
-                                [public_bag, ''],
-                                [private_bag,'']
-                            ],
-                            'policy': {
-                                "read": [user.usersign],
-                                "create": [user.usersign], 
-                                "manage": [user.usersign, "R:ADMIN"], 
-                                "accept": [], 
-                                "write": [user.usersign], 
-                                "owner": user.usersign, 
-                                "delete": [user.usersign]
-                            }
-                        }
-                    }
-                }
-                user_space = Space(environ) 
-                user_space.create_space(space)
+                #make sure that the user has the requisite bags,
+                #without making them wait for them to be created
+                _get_provisioner(environ['tiddlyweb.config']).submit(
+                    user.usersign, _user_space(user.usersign))
                     
                 return {"name": user.usersign, "roles": user.list_roles()}
         except Cookie.CookieError, exc:
@@ -104,3 +170,8 @@ class Extractor(ExtractorInterface):
         except KeyError:
             pass
         return False
+
+
+def init(config):
+    config['server_request_filters'].append(SpaceReady)
+    config['selector'].add('/spaces/provisioning', GET=provision_stats)
@@ -0,0 +1,192 @@
+"""
+Create spaces in the background
+
+Creating a space means several writes to the store, which can
+be slow. Provisioner hands them to a small pool of worker threads
+(each with its own Space, and so its own store) through a bounded
+queue, so that a request that needs a space to exist doesn't have
+to wait for it to be made.
+
+Each space is queued at most once at a time, and a space that has
+already been made by this process isn't queued again. Anything that
+needs one of the space's bags or recipes can wait_for it, which only
+blocks if the space is still waiting to be made.
+
+A space that can't be made (or whose worker can't get a Space to
+make it with) is recorded as failed, with the error, in stats, and
+is tried again the next time it is submitted.
+"""
+from Queue import Queue, Full
+from collections import deque, OrderedDict
+import threading
+import logging
+import urllib
+import time
+
+DEFAULT_WORKERS = 2
+DEFAULT_QUEUE_SIZE = 100
+DEFAULT_WAIT = 10
+MAX_PROVISIONED = 10000
+MAX_FAILED = 100
+LATENCY_SAMPLES = 1000
+
+
+class Provisioner():
+    """
+    create spaces with a bounded pool of worker threads.
+
+    space_factory is called once per worker and should return
+    a new Space, so that each thread has its own store. if the
+    queue is full, the space is made straight away instead.
+    """
+    def __init__(self, space_factory, workers=DEFAULT_WORKERS, \
+            queue_size=DEFAULT_QUEUE_SIZE, wait=DEFAULT_WAIT):
+        self.space_factory = space_factory
+        self.workers = max(1, workers)
+        self.wait = wait
+        self.provisioned = 0
+        self.failed = 0
+        self.inline = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._queue = Queue(queue_size)
+        self._pending = {}
+        self._names = {}
+        self._done = OrderedDict()
+        self._failed = OrderedDict()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def submit(self, key, space):
+        """
+        make sure the space (a dict of bags/recipes, as passed
+        to Space.create_space) called key gets created
+        """
+        self._lock.acquire()
+        try:
+            if key in self._done or key in self._pending:
+                return
+            ready = threading.Event()
+            self._pending[key] = ready
+            for name in space.get('bags', {}):
+                self._names[('bags', name)] = ready
+            for name in space.get('recipes', {}):
+                self._names[('recipes', name)] = ready
+            self._start_workers()
+        finally:
+            self._lock.release()
+
+        job = (key, space, time.time())
+        try:
+            self._queue.put_nowait(job)
+        except Full:
+            logging.warn('space provisioning queue is full, creating %s now', key)
+            self.inline += 1
+            self._provision(None, job)
+
+    def wait_for(self, container_type, name, timeout=None):
+        """
+        wait until the space with the named bag or recipe
+        (container_type is 'bags' or 'recipes') has been made,
+        if it is still waiting to be. returns False if it timed out.
+        """
+        ready = self._names.get((container_type, name))
+        if ready is None:
+            return True
+        if timeout is None:
+            timeout = self.wait
+        ready.wait(timeout)
+        return ready.isSet()
+
+    def wait_for_path(self, path, timeout=None):
+        """
+        wait_for the bag or recipe in a URL path, if there is one
+        """
+        parts = path.lstrip('/').split('/')
+        if len(parts) < 2 or parts[0] not in ('bags', 'recipes'):
+            return True
+        name = urllib.unquote(parts[1]).decode('utf-8', 'replace')
+        return self.wait_for(parts[0], name, timeout)
+
+    def stats(self):
+        """
+        return a dict of statistics about provisioning
+        in this process, with times in milliseconds.
+        failed_keys has the error for each of the last
+        MAX_FAILED spaces that couldn't be made.
+        """
+        latencies = sorted(self.latencies)
+        stats = {
+            'queue_depth': self._queue.qsize(),
+            'pending': len(self._pending),
+            'provisioned': self.provisioned,
+            'failed': self.failed,
+            'failed_keys': dict(self._failed),
+            'inline': self.inline,
+            'latency_mean': None,
+            'latency_p95': None,
+            'latency_max': None
+        }
+        if latencies:
+            stats['latency_mean'] = sum(latencies) * 1000 / len(latencies)
+            stats['latency_p95'] = latencies[int(0.95 * (len(latencies) - 1))] * 1000
+            stats['latency_max'] = latencies[-1] * 1000
+        return stats
+
+    def _start_workers(self):
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work)
+            thread.setDaemon(True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        """
+        make the spaces in the queue, forever
+        """
+        space = None
+        while True:
+            space = self._provision(space, self._queue.get())
+
+    def _provision(self, space, job):
+        """
+        create the space in job (with space, or a new one from
+        space_factory if it is None), and let anything waiting
+        for it know it is done. returns the space used, or None
+        if there wasn't one.
+        """
+        key, definition, queued = job
+        error = None
+        try:
+            if space is None:
+                space = self.space_factory()
+            space.create_space(definition)
+        except Exception, exc:
+            logging.exception('failed to create space %s', key)
+            error = '%s: %s' % (exc.__class__.__name__, exc)
+
+        self._lock.acquire()
+        try:
+            ready = self._pending.pop(key, None)
+            for container_type in ('bags', 'recipes'):
+                for name in definition.get(container_type, {}):
+                    if self._names.get((container_type, name)) is ready:
+                        del self._names[(container_type, name)]
+            if error is None:
+                self.provisioned += 1
+                self.latencies.append(time.time() - queued)
+                self._failed.pop(key, None)
+                self._done[key] = True
+                while len(self._done) > MAX_PROVISIONED:
+                    self._done.popitem(last=False)
+            else:
+                #leave it to be tried again next time
+                self.failed += 1
+                self._failed.pop(key, None)
+                self._failed[key] = error
+                while len(self._failed) > MAX_FAILED:
+                    self._failed.popitem(last=False)
+        finally:
+            self._lock.release()
+            if ready is not None:
+                ready.set()
+        return space
@@ -58,6 +58,45 @@ class Space():
             except RecipeExistsError:
                 pass
 
+    def update_space(self, space):
+        """
+        apply the policies and descriptions in space to
+        the bags and recipes that already exist
+
+        anything in space that does not exist is skipped.
+        """
+        for bag_name, bag in space['bags'].iteritems():
+            try:
+                self.update_bag(bag_name, bag.get('policy'), bag.get('desc'))
+            except NoBagError:
+                pass
+
+        for recipe_name, recipe in space['recipes'].iteritems():
+            try:
+                self.update_recipe(recipe_name, recipe.get('policy'), \
+                    recipe.get('desc'))
+            except NoRecipeError:
+                pass
+
+    def delete_space(self, space):
+        """
+        delete the bags and recipes supplied by space
+
+        recipes are removed before the bags they refer to.
+        anything in space that does not exist is skipped.
+        """
+        for recipe_name in space['recipes']:
+            try:
+                self.delete_recipe(recipe_name)
+            except NoRecipeError:
+                pass
+
+        for bag_name in space['bags']:
+            try:
+                self.delete_bag(bag_name)
+            except NoBagError:
+                pass
+
     def exists(self, thing):
         """
         test if the object passed in exists
@@ -115,6 +154,36 @@ class Space():
         
         self._put_thing(recipe, policy, desc)
 
+    def update_bag(self, name, policy=None, desc=None):
+        """
+        set the policy and description on an existing bag
+
+        raises NoBagError if the bag does not exist
+        """
+        bag = self.store.get(Bag(name))
+        self._put_thing(bag, policy, desc)
+
+    def update_recipe(self, name, policy=None, desc=None):
+        """
+        set the policy and description on an existing recipe
+
+        raises NoRecipeError if the recipe does not exist
+        """
+        recipe = self.store.get(Recipe(name))
+        self._put_thing(recipe, policy, desc)
+
+    def delete_bag(self, name):
+        """
+        delete a bag, and all the tiddlers in it
+        """
+        self.store.delete(Bag(name))
+
+    def delete_recipe(self, name):
+        """
+        delete a recipe
+        """
+        self.store.delete(Recipe(name))
+
     def _put_thing(self, thing, policy, desc):
         """
         put the thing into the store without checking
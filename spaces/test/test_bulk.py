@@ -0,0 +1,97 @@
+"""
+test BulkRunner
+"""
+import sys
+sys.path.insert(0, '.')
+
+from StringIO import StringIO
+
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.recipe import Recipe
+from tiddlyweb.store import NoBagError
+
+from bulk import BulkRunner, project_names
+
+
+def _names(count):
+    return ['space%d' % number for number in range(count)]
+
+
+class ListingStore(object):
+    """
+    a store that only lists bags and recipes
+    """
+    def __init__(self, bags, recipes):
+        self.bags = bags
+        self.recipes = recipes
+
+    def list_bags(self):
+        return [Bag(name) for name in self.bags]
+
+    def list_recipes(self):
+        return [Recipe(name) for name in self.recipes]
+
+
+def test_project_names():
+    store = ListingStore(
+        ['alpha_config', 'alpha_comments', 'x_report_config', 'other'],
+        ['alpha', 'alpha_report', 'x_report', 'x_report_report', 'other'])
+    assert sorted(project_names(store)) == ['alpha', 'x_report']
+
+
+def test_applies_action_to_every_name():
+    applied = []
+    def action(space, name):
+        applied.append((space, name))
+    runner = BulkRunner(lambda: 'space', workers=3, report=None)
+    failed = runner.run(action, _names(20))
+
+    assert failed == []
+    assert runner.done == 20
+    assert sorted(name for space, name in applied) == sorted(_names(20))
+    assert set(space for space, name in applied) == set(['space'])
+
+
+def test_failures_are_returned():
+    def action(space, name):
+        if name == 'space3':
+            raise NoBagError('no bag')
+        if name == 'space5':
+            raise ValueError('broken')
+    runner = BulkRunner(lambda: 'space', workers=2, report=None)
+    failed = dict(runner.run(action, _names(10)))
+
+    assert sorted(failed) == ['space3', 'space5']
+    assert isinstance(failed['space3'], NoBagError)
+    assert runner.done == 10
+
+
+def test_dry_run_prints_plan():
+    applied = []
+    def update_project(space, name):
+        applied.append(name)
+    def space_factory():
+        raise AssertionError('dry run should not touch the store')
+    out = StringIO()
+    runner = BulkRunner(space_factory, workers=2, dry_run=True, report=None,
+        out=out)
+    failed = runner.run(update_project, _names(5))
+
+    assert failed == []
+    assert applied == []
+    lines = sorted(out.getvalue().splitlines())
+    assert lines == ['dry run: would apply update_project to %s' % name
+        for name in sorted(_names(5))]
+
+
+def test_space_factory_failure_does_not_block():
+    def space_factory():
+        raise IOError('store unavailable')
+    def action(space, name):
+        pass
+    #many more names than fit in the queue
+    runner = BulkRunner(space_factory, workers=2, report=None)
+    failed = runner.run(action, _names(50))
+
+    assert len(failed) == 50
+    assert all(isinstance(error, IOError) for name, error in failed)
@@ -0,0 +1,111 @@
+"""
+test Provisioner
+"""
+import sys
+sys.path.insert(0, '.')
+
+import threading
+
+from provision import Provisioner
+
+
+class FakeSpace(object):
+    """
+    records the spaces it is asked to create, failing
+    for those in broken
+    """
+    def __init__(self, created, broken=()):
+        self.created = created
+        self.broken = broken
+
+    def create_space(self, definition):
+        name = definition['bags'].keys()[0]
+        if name in self.broken:
+            raise ValueError('%s is broken' % name)
+        self.created.append(name)
+
+
+def _space(name):
+    return {'bags': {name: {}}, 'recipes': {name: {}}}
+
+
+def test_creates_spaces():
+    created = []
+    provisioner = Provisioner(lambda: FakeSpace(created), workers=2)
+    for name in ('a', 'b', 'c'):
+        provisioner.submit(name, _space(name))
+    for name in ('a', 'b', 'c'):
+        assert provisioner.wait_for('bags', name, 2)
+    assert sorted(created) == ['a', 'b', 'c']
+    stats = provisioner.stats()
+    assert stats['provisioned'] == 3
+    assert stats['pending'] == 0
+    assert stats['failed_keys'] == {}
+
+
+def test_failed_space_is_reported():
+    created = []
+    provisioner = Provisioner(lambda: FakeSpace(created, ['bad']), workers=1)
+    provisioner.submit('bad', _space('bad'))
+    provisioner.submit('good', _space('good'))
+    assert provisioner.wait_for('recipes', 'bad', 2)
+    assert provisioner.wait_for('recipes', 'good', 2)
+
+    stats = provisioner.stats()
+    assert stats['pending'] == 0
+    assert stats['failed'] == 1
+    assert stats['failed_keys'] == {'bad': 'ValueError: bad is broken'}
+    assert created == ['good']
+
+
+def test_space_factory_failure():
+    attempts = []
+    created = []
+    def space_factory():
+        attempts.append(True)
+        if len(attempts) == 1:
+            raise IOError('no store')
+        return FakeSpace(created)
+    provisioner = Provisioner(space_factory, workers=1)
+    provisioner.submit('first', _space('first'))
+    assert provisioner.wait_for('bags', 'first', 2)
+    assert provisioner.stats()['failed_keys'] == {'first': 'IOError: no store'}
+
+    #the worker carries on, and the space is tried again when resubmitted
+    provisioner.submit('first', _space('first'))
+    provisioner.submit('second', _space('second'))
+    assert provisioner.wait_for('bags', 'first', 2)
+    assert provisioner.wait_for('bags', 'second', 2)
+    assert sorted(created) == ['first', 'second']
+    stats = provisioner.stats()
+    assert stats['pending'] == 0
+    assert stats['failed_keys'] == {}
+
+
+def test_inline_when_queue_full():
+    created = []
+    started = threading.Event()
+    release = threading.Event()
+
+    class SlowSpace(FakeSpace):
+        def create_space(self, definition):
+            started.set()
+            release.wait(2)
+            FakeSpace.create_space(self, definition)
+
+    def space_factory():
+        if not started.isSet():
+            return SlowSpace(created)
+        raise IOError('no store')
+
+    provisioner = Provisioner(space_factory, workers=1, queue_size=1)
+    provisioner.submit('slow', _space('slow'))
+    started.wait(2)
+    provisioner.submit('queued', _space('queued'))
+    #made straight away, which fails without raising
+    provisioner.submit('inline', _space('inline'))
+    assert provisioner.stats()['failed_keys'] == {
+        'inline': 'IOError: no store'}
+    release.set()
+    assert provisioner.wait_for('bags', 'queued', 2)
+    assert sorted(created) == ['queued', 'slow']
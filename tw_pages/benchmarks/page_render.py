@@ -0,0 +1,98 @@
+"""
+Benchmark rendering a page through tiddlywebpages.template
+
+Compares making a new jinja Environment for every page view (as
+each request used to) with the shared Environment in Template.
+
+usage: python benchmarks/page_render.py [<page_views>]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tiddlywebpages.template import Template, _get_template
+
+from jinja2 import Environment, FunctionLoader
+
+LIST_TEMPLATE = """
+<ul>
+{% for tiddler in tiddlers %}
+    <li><a href="{{ prefix }}/{{ tiddler.title }}">{{ tiddler.title }}</a>
+    {% if tiddler.tags %}({{ tiddler.tags|join(', ') }}){% endif %}</li>
+{% endfor %}
+</ul>
+{% for name, html in extra.items() %}<div class="{{ name }}">{{ html }}</div>{% endfor %}
+"""
+
+SIDEBAR_TEMPLATE = """
+{% for tiddler in tiddlers %}<a href="{{ prefix }}/{{ tiddler.title }}">{{ tiddler.title }}</a>{% endfor %}
+"""
+
+WRAPPER_TEMPLATE = """
+<html><head><title>{{ title }}</title></head><body>{{ content }}</body></html>
+"""
+
+
+class FakeTiddler(object):
+    def __init__(self, title):
+        self.title = title
+        self.tags = ['tag%d' % (i % 5) for i in range(3)]
+
+
+def make_config():
+    serializers = {
+        'Default': {'template': WRAPPER_TEMPLATE},
+        'list': {'template': LIST_TEMPLATE},
+    }
+    for i in range(6):
+        serializers['sidebar%d' % i] = {'template': SIDEBAR_TEMPLATE}
+    return {'tw_pages': {}, 'tw_pages_serializers': serializers,
+        'tw_pages_revision': 1}
+
+
+def render_page(template, tiddlers):
+    extra = {}
+    for i in range(6):
+        template.set_template('sidebar%d' % i)
+        extra['sidebar%d' % i] = template.render(tiddlers=tiddlers[:5],
+            prefix='')
+    template.set_template('list')
+    content = template.render(tiddlers=tiddlers, extra=extra, prefix='')
+    template.set_template('Default')
+    return template.render(content=content, title='bench', prefix='')
+
+
+class UnsharedTemplate(Template):
+    """
+    Template as it was, with a new Environment for every request
+    """
+    def __init__(self, environ):
+        self.environ = environ
+        self.template = None
+        config = environ['tiddlyweb.config']
+        self.template_env = Environment(
+            loader=FunctionLoader(lambda name: _get_template(config, name)))
+
+
+def bench(template_class, environ, tiddlers, views):
+    start = time.time()
+    for i in range(views):
+        render_page(template_class(environ), tiddlers)
+    return time.time() - start
+
+
+def main(args):
+    views = args and int(args[0]) or 500
+    environ = {'tiddlyweb.config': make_config()}
+    tiddlers = [FakeTiddler('tiddler%d' % i) for i in range(100)]
+
+    for name, template_class in [('new environment per request',
+            UnsharedTemplate), ('shared environment', Template)]:
+        elapsed = bench(template_class, environ, tiddlers, views)
+        print '%-30s %8.2f ms/page' % (name, elapsed * 1000 / views)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
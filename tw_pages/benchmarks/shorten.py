@@ -0,0 +1,52 @@
+"""
+Benchmark the shorten filter over a 100 tiddler listing
+
+Compares the single pass shorten with slicing the string and
+closing the tags with a BeautifulSoup round trip (as it used to).
+
+usage: python benchmarks/shorten.py [<listings>]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tiddlywebpages.filters.shorten import shorten
+
+PARAGRAPH = (u'<p>Some <b>bold</b> and <i>italic</i> text, with a '
+    u'<a href="/bags/common/tiddlers/Link">link</a> &amp; an entity.</p>\n')
+
+
+def soup_shorten(mystr, count):
+    from BeautifulSoup import BeautifulSoup
+    return BeautifulSoup(mystr[0:count]).prettify()
+
+
+def bench(function, texts, listings):
+    start = time.time()
+    for i in range(listings):
+        for text in texts:
+            function(text, 200)
+    return time.time() - start
+
+
+def main(args):
+    listings = args and int(args[0]) or 20
+    texts = [PARAGRAPH * (5 + i % 20) for i in range(100)]
+
+    functions = [('single pass', shorten)]
+    try:
+        import BeautifulSoup
+        functions.append(('BeautifulSoup', soup_shorten))
+    except ImportError:
+        print 'BeautifulSoup is not installed, skipping it'
+
+    for name, function in functions:
+        elapsed = bench(function, texts, listings)
+        print '%-15s %8.3f ms/listing %8.1f us/call' % (name,
+            elapsed * 1000 / listings, elapsed * 1000000 / (listings * 100))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,75 @@
+"""
+Benchmark registering templates at startup
+
+Fills a text store with <templates> template tiddlers and times
+register_templates reading every one of them, and then using
+the metadata_cache left behind by the first run.
+
+usage: python benchmarks/startup.py [<templates>]
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tiddlywebpages.config import config as twp_config
+from tiddlywebpages.register import register_templates
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import Store
+from tiddlyweb.util import merge_config
+
+TEMPLATE = u"""
+<ul>
+{% for tiddler in tiddlers %}
+    <li><a href="{{ prefix }}/{{ tiddler.title }}">{{ tiddler.title }}</a></li>
+{% endfor %}
+</ul>
+""" * 20
+
+
+def make_store(directory, templates):
+    config['server_store'] = ['text', {'store_root': directory}]
+    store = Store(config['server_store'][0], config['server_store'][1],
+        {'tiddlyweb.config': config})
+    store.put(Bag('templates'))
+    for i in range(templates):
+        tiddler = Tiddler('template%d' % i, 'templates')
+        tiddler.text = TEMPLATE
+        tiddler.fields = {'mime_type': 'text/html', 'page_title': 'Page %d' % i,
+            'sidebar': 'sidebar%d' % i}
+        store.put(tiddler)
+    return store
+
+
+def bench(store):
+    config['serializers'] = {}
+    config['extension_types'] = {}
+    start = time.time()
+    register_templates(config, store)
+    return time.time() - start
+
+
+def main(args):
+    templates = args and int(args[0]) or 200
+    directory = tempfile.mkdtemp()
+    try:
+        merge_config(config, twp_config)
+        store = make_store(os.path.join(directory, 'store'), templates)
+        config['tw_pages']['metadata_cache'] = os.path.join(directory,
+            'metadata.json')
+        for name in ('without metadata', 'with metadata'):
+            elapsed = bench(store)
+            print '%-17s %8.1f ms for %d templates' % (name, elapsed * 1000,
+                templates)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
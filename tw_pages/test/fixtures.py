@@ -0,0 +1,173 @@
+"""
+a site made from a text store, and a way to make requests
+to it, for the tests to use
+"""
+import sys
+sys.path.insert(0, '.')
+
+import os
+import shutil
+import tempfile
+from StringIO import StringIO
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.recipe import Recipe
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import Store
+from tiddlyweb.web.serve import load_app
+
+import tiddlywebpages.index
+from tiddlywebpages.config import config as twp_config
+
+REQUEST_FILTERS = list(config['server_request_filters'])
+RESPONSE_FILTERS = list(config['server_response_filters'])
+STORE_DIR = os.path.join(tempfile.gettempdir(), 'tw_pages_test_store')
+
+WRAPPER = u'<html><title>{{ title }}</title><body>{{ content }}</body></html>'
+
+LIST_TEMPLATE = u"""<div class="latest">{{ extra.latest }}</div>
+<ul>{% for tiddler in tiddlers %}<li>{{ tiddler.title }}</li>{% endfor %}</ul>"""
+
+SIDEBAR_TEMPLATE = u"""<ul>{% for tiddler in tiddlers %}<li>{{ tiddler.title }}:{{ tiddler.text }}</li>{% endfor %}</ul>"""
+
+TIDDLER_TEMPLATE = u"""{% for tiddler in tiddlers %}<h1>{{ tiddler.title }}</h1>
+<div>{{ tiddler.text }}</div>{% endfor %}"""
+
+#the names used by tiddlywebconfig.py in this directory
+SITE_CONFIG = u"""container: site
+list_tiddlers: list
+single_tiddler: tiddler
+wrapper: Default"""
+
+
+def get_store():
+    return Store('text', {'store_root': STORE_DIR}, {'tiddlyweb.config': config})
+
+
+def make_store():
+    """
+    make an empty store, returning it
+    """
+    if os.path.exists(STORE_DIR):
+        shutil.rmtree(STORE_DIR)
+    return get_store()
+
+
+def put_tiddler(store, title, bag, text=u'', tags=None, fields=None, **attributes):
+    tiddler = Tiddler(title, bag)
+    tiddler.text = text
+    tiddler.tags = tags or []
+    tiddler.fields = fields or {}
+    for name, value in attributes.items():
+        setattr(tiddler, name, value)
+    store.put(tiddler)
+    return tiddler
+
+
+def make_site(tiddlers=10):
+    """
+    fill a new store with templates, a site recipe and
+    content tiddlers. returns the store.
+    """
+    store = make_store()
+    for bag_name in ('templates', 'config', 'system', 'content'):
+        store.put(Bag(bag_name))
+    recipe = Recipe('site')
+    recipe.set_recipe([['system', ''], ['content', '']])
+    store.put(recipe)
+
+    put_tiddler(store, 'Default', 'templates', WRAPPER)
+    put_tiddler(store, 'list', 'templates', LIST_TEMPLATE,
+        fields={'mime_type': 'text/html',
+            'latest': 'site?select=tag:news;sort=-modified;limit=3'})
+    put_tiddler(store, 'latest', 'templates', SIDEBAR_TEMPLATE)
+    put_tiddler(store, 'tiddler', 'templates', TIDDLER_TEMPLATE,
+        fields={'mime_type': 'text/html'})
+    put_tiddler(store, 'TWPagesConfig', 'config', SITE_CONFIG)
+
+    for number in range(tiddlers):
+        put_tiddler(store, u'item %d' % number, 'content', u'text %d' % number,
+            tags=number % 2 and ['news'] or ['blog'],
+            modified='2010010%d000000' % (number % 10))
+    return store
+
+
+def make_app(**tw_pages):
+    """
+    load the app with tiddlywebpages, as configured by tiddlywebconfig.py
+    and then tw_pages, forgetting anything left by earlier tests
+    """
+    defaults = dict(twp_config['tw_pages'])
+    for key in config.keys():
+        if key.startswith('tw_pages_'):
+            del config[key]
+    tiddlywebpages.index.INDEXES.clear()
+    config['server_request_filters'] = list(REQUEST_FILTERS)
+    config['server_response_filters'] = list(RESPONSE_FILTERS)
+    config['server_store'] = ['text', {'store_root': STORE_DIR}]
+    config['system_plugins'] = ['tiddlywebpages']
+    config['log_level'] = 'CRITICAL'
+    config['log_file'] = os.devnull
+    #so that tiddlywebpages.init sees them, as merged with its defaults
+    twp_config['tw_pages'].update(tw_pages)
+    try:
+        app = load_app()
+    finally:
+        twp_config['tw_pages'].clear()
+        twp_config['tw_pages'].update(defaults)
+    config['tw_pages'].update(tw_pages)
+    return app
+
+
+def make_environ(path, query='', method='GET', headers=None, body='',
+        content_type=None):
+    """
+    return the environ for a request
+    """
+    environ = {
+        'REQUEST_METHOD': method,
+        'SCRIPT_NAME': '',
+        'PATH_INFO': path,
+        'QUERY_STRING': query,
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '8080',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': 'localhost:8080',
+        'HTTP_ACCEPT': 'text/html',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': StringIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    if content_type:
+        environ['CONTENT_TYPE'] = content_type
+    for name, value in (headers or {}).items():
+        environ['HTTP_%s' % name.upper().replace('-', '_')] = value
+    return environ
+
+
+def request(app, path, query='', method='GET', headers=None, body='',
+        content_type=None, chunks=False):
+    """
+    make a request to app, returning (status, headers, body, environ).
+    if chunks is True, body is the list of pieces it was sent in.
+    """
+    environ = make_environ(path, query, method, headers, body, content_type)
+    response = {}
+    def start_response(status, response_headers, exc_info=None):
+        response['status'] = status
+        response['headers'] = dict(response_headers)
+    output = app(environ, start_response)
+    try:
+        body = list(output)
+        if not chunks:
+            body = ''.join(body)
+    finally:
+        if hasattr(output, 'close'):
+            output.close()
+    return response['status'], response['headers'], body, environ
@@ -0,0 +1,127 @@
+"""
+test the caches shared between requests
+"""
+import sys
+sys.path.insert(0, '.')
+
+import os
+import stat
+import sqlite3
+import tempfile
+import cPickle as pickle
+
+from tiddlywebpages import cache
+from tiddlywebpages.cache import LRUCache, SQLiteCache, get_cache, \
+    check_backend
+
+CACHE_PATH = os.path.join(tempfile.gettempdir(), 'tw_pages_test_cache.sqlite')
+
+
+def setup_function(function):
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(CACHE_PATH + suffix):
+            os.remove(CACHE_PATH + suffix)
+
+
+def _used(key):
+    connection = sqlite3.connect(CACHE_PATH)
+    try:
+        return connection.execute('SELECT used FROM cache WHERE key = ?',
+            (cache._key(key),)).fetchone()[0]
+    finally:
+        connection.close()
+
+
+def test_lru():
+    lru = LRUCache(max_items=2)
+    lru.set('a', 'A')
+    lru.set('b', 'B')
+    assert lru.get('a') == 'A'
+    lru.set('c', 'C')
+    assert lru.get('b') is None
+    assert lru.get('a') == 'A'
+    assert lru.stats()['evictions'] == 1
+
+
+def test_sqlite():
+    sqlite = SQLiteCache(CACHE_PATH, 'test', secret='secret')
+    sqlite.set(('a', 1), {'value': [1, 2]})
+    assert sqlite.get(('a', 1)) == {'value': [1, 2]}
+    assert sqlite.get('missing') is None
+    #shared with others using the file
+    other = SQLiteCache(CACHE_PATH, 'test', secret='secret')
+    assert other.get(('a', 1)) == {'value': [1, 2]}
+
+
+def test_file_is_private():
+    SQLiteCache(CACHE_PATH, 'test').set('a', 'A')
+    assert stat.S_IMODE(os.stat(CACHE_PATH).st_mode) & 077 == 0
+
+
+def test_unsigned_values_ignored():
+    sqlite = SQLiteCache(CACHE_PATH, 'test', secret='secret')
+    sqlite.set('a', 'A')
+    #as if written by something without the secret
+    for value in (pickle.dumps('forged'),
+            SQLiteCache(CACHE_PATH, 'test', secret='other')._sign(
+                pickle.dumps('forged'))):
+        connection = sqlite3.connect(CACHE_PATH)
+        connection.execute('UPDATE cache SET value = ?',
+            (sqlite3.Binary(value),))
+        connection.commit()
+        connection.close()
+        assert sqlite.get('a') is None
+
+
+def test_used_written_in_batches():
+    sqlite = SQLiteCache(CACHE_PATH, 'test')
+    sqlite.touch_every = 3
+    sqlite.set('a', 'A')
+    stored = _used('a')
+    sqlite.get('a')
+    sqlite.get('a')
+    assert _used('a') == stored
+    sqlite.get('a')
+    assert _used('a') > stored
+
+
+def test_eviction_uses_recent_hits():
+    sqlite = SQLiteCache(CACHE_PATH, 'test', max_items=2)
+    sqlite.evict_every = 3
+    sqlite.set('a', 'A')
+    sqlite.set('b', 'B')
+    #not yet written, but must be before evicting
+    assert sqlite.get('a') == 'A'
+    sqlite.set('c', 'C')
+    assert sqlite.get('a') == 'A'
+    assert sqlite.get('b') is None
+
+
+def test_cache_path_required():
+    config = {'tw_pages': {'cache_backend': 'sqlite', 'cache_path': None}}
+    for check in (check_backend, lambda config: get_cache(config, 'test')):
+        try:
+            check(config)
+            assert False, 'ValueError not raised'
+        except ValueError, exc:
+            assert 'cache_path' in str(exc)
+
+
+def test_unusable_cache_path():
+    config = {'tw_pages': {'cache_backend': 'sqlite',
+        'cache_path': os.path.join(CACHE_PATH, 'not', 'there')}}
+    try:
+        check_backend(config)
+        assert False, 'ValueError not raised'
+    except ValueError:
+        pass
+
+
+def test_backends():
+    check_backend({'tw_pages': {}})
+    config = {'tw_pages': {'cache_backend': 'sqlite', 'cache_path': CACHE_PATH},
+        'secret': 'secret'}
+    check_backend(config)
+    assert isinstance(get_cache(config, 'test'), SQLiteCache)
+    assert get_cache(config, 'test').secret == 'secret'
+    assert isinstance(get_cache({'tw_pages': {}}, 'test'), LRUCache)
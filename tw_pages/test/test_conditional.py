@@ -0,0 +1,83 @@
+"""
+test ETags and 304 Not Modified for rendered pages
+"""
+import sys
+sys.path.insert(0, '.')
+sys.path.insert(0, 'test')
+
+from fixtures import make_site, make_app, get_store, put_tiddler, request
+
+PAGE = '/recipes/site/tiddlers'
+
+
+def _get(app, etag=None):
+    headers = etag and {'If-None-Match': etag} or {}
+    status, headers, body, environ = request(app, PAGE, headers=headers)
+    headers = dict((name.lower(), value) for name, value in headers.items())
+    return status, headers.get('etag'), body
+
+
+def _change_latest():
+    #the newest news tiddler, so it is in the latest sub-template
+    put_tiddler(get_store(), u'item 9', 'content', u'changed',
+        tags=['news'], modified='20100109000000')
+
+
+def test_etag_and_304():
+    make_site()
+    app = make_app()
+    status, etag, body = _get(app)
+    assert status.startswith('200')
+    assert etag
+
+    status, second_etag, body = _get(app, etag)
+    assert status.startswith('304')
+    assert second_etag == etag
+
+
+def test_changed_sub_template_changes_etag():
+    make_site()
+    app = make_app()
+    status, etag, body = _get(app)
+    _change_latest()
+
+    status, new_etag, body = _get(app, etag)
+    assert status.startswith('200')
+    assert new_etag != etag
+    assert 'item 9:changed' in body
+
+    status, etag, body = _get(app, new_etag)
+    assert status.startswith('304')
+
+
+def test_streamed_pages_have_etags():
+    make_site()
+    app = make_app(stream=True)
+    status, etag, body = _get(app)
+    assert status.startswith('200')
+    assert etag
+
+    #streamed this time, with the ETag worked out beforehand
+    status, streamed_etag, streamed_body = _get(app)
+    assert status.startswith('200')
+    assert streamed_etag == etag
+    assert streamed_body == body
+
+    status, third_etag, body = _get(app, streamed_etag)
+    assert status.startswith('304')
+
+
+def test_streamed_page_changes():
+    make_site()
+    app = make_app(stream=True)
+    status, etag, body = _get(app)
+    _change_latest()
+
+    status, new_etag, body = _get(app, etag)
+    assert status.startswith('200')
+    assert new_etag != etag
+    assert 'item 9:changed' in body
+
+    status, etag, body = _get(app, new_etag)
+    assert status.startswith('304')
+
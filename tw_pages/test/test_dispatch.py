@@ -0,0 +1,73 @@
+"""
+test working out which template renders a page
+"""
+import sys
+sys.path.insert(0, '.')
+
+from tiddlywebpages.register import build_dispatch, resolve_dispatch
+
+
+def _config():
+    config = {
+        'tw_pages_serializers': {
+            'Default': {'plugins': {'list_tiddlers': 'plainlist'}},
+            'plainlist': {'wrapper': None, 'title': None},
+            'list': {'wrapper': None, 'title': 'Everything'},
+            'tiddler': {'wrapper': None, 'title': None},
+            'feed': {'wrapper': 'FeedWrapper', 'title': 'Feed'},
+        },
+        'tw_pages_config': {
+            'site': {'list_tiddlers': 'list', 'single_tiddler': 'tiddler'},
+            'wrapped': {'list_tiddlers': 'list', 'wrapper': 'Site'},
+        }
+    }
+    build_dispatch(config)
+    return config
+
+
+def test_configured_container():
+    config = _config()
+    assert resolve_dispatch(config, 'site', None, 'list_tiddlers') == \
+        ('list', 'Default', 'Everything')
+    assert resolve_dispatch(config, 'site', None, 'single_tiddler') == \
+        ('tiddler', 'Default', None)
+    assert resolve_dispatch(config, 'wrapped', None, 'list_tiddlers') == \
+        ('list', 'Site', 'Everything')
+
+
+def test_extension():
+    config = _config()
+    assert resolve_dispatch(config, 'site', 'feed', 'list_tiddlers') == \
+        ('feed', 'FeedWrapper', 'Feed')
+    #the container's wrapper wins over the template's
+    assert resolve_dispatch(config, 'wrapped', 'feed', 'list_tiddlers') == \
+        ('feed', 'Site', 'Feed')
+
+
+def test_unconfigured():
+    config = _config()
+    assert resolve_dispatch(config, 'other', None, 'list_tiddlers') == \
+        ('plainlist', 'Default', None)
+    assert resolve_dispatch(config, 'site', 'unknown', 'list_tiddlers') == \
+        ('list', 'Default', 'Everything')
+    try:
+        resolve_dispatch(config, 'other', None, 'single_tiddler')
+        assert False, 'KeyError not raised'
+    except KeyError:
+        pass
+
+
+def test_rebuilt_whole():
+    config = _config()
+    dispatch = config['tw_pages_dispatch']
+    config['tw_pages_config']['site']['list_tiddlers'] = 'plainlist'
+    build_dispatch(config)
+    assert config['tw_pages_dispatch'] is not dispatch
+    assert resolve_dispatch(config, 'site', None, 'list_tiddlers')[0] == \
+        'plainlist'
+
+
+def test_before_templates_registered():
+    config = {'tw_pages_config': {}}
+    build_dispatch(config)
+    assert 'tw_pages_dispatch' not in config
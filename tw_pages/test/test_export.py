@@ -0,0 +1,91 @@
+"""
+test exporting a site to static files
+"""
+import sys
+sys.path.insert(0, '.')
+sys.path.insert(0, 'test')
+
+import os
+import shutil
+import tempfile
+
+from tiddlyweb.config import config
+from tiddlyweb.model.tiddler import Tiddler
+
+from tiddlywebpages import export
+
+from fixtures import make_site, make_app, put_tiddler
+
+EXPORT_DIR = os.path.join(tempfile.gettempdir(), 'tw_pages_test_export')
+
+
+def setup_function(function):
+    if os.path.exists(EXPORT_DIR):
+        shutil.rmtree(EXPORT_DIR)
+    store = make_site(tiddlers=3)
+    put_tiddler(store, u'two words', 'content', u'spaced')
+    put_tiddler(store, u'a/b', 'content', u'slashed')
+    put_tiddler(store, u'caf\xe9', 'content', u'accented')
+    make_app()
+    export.init(config)
+
+
+def _export():
+    export.twpexport([EXPORT_DIR, '--processes=1', 'site'])
+
+
+def _page(*parts):
+    return os.path.join(EXPORT_DIR, 'recipes', 'site', *parts)
+
+
+def test_files_are_named_as_linked():
+    _export()
+    assert '<li>item 1</li>' in open(_page('tiddlers.html')).read()
+    assert os.path.exists(_page('tiddlers', 'item 1.html'))
+    assert os.path.exists(_page('tiddlers', 'two words.html'))
+    assert os.path.exists(_page('tiddlers', 'a%2Fb.html'))
+    assert os.path.exists(_page('tiddlers', u'caf\xe9.html'.encode('utf-8')))
+    assert 'slashed' in open(_page('tiddlers', 'a%2Fb.html')).read()
+
+
+def test_page_url():
+    assert export._page_url(('recipes', 'site', u'two words/x'), None) == \
+        'recipes/site/tiddlers/two%20words%2Fx'
+    assert export._page_url(('bags', 'content', None), 'json') == \
+        'bags/content/tiddlers.json'
+    assert export._page_path(('bags', '..', u'.'), None) == \
+        u'bags/%2E%2E/tiddlers/%2E.html'
+
+
+def test_failed_page_is_kept():
+    _export()
+    page = _page('tiddlers', 'item 1.html')
+    original = open(page).read()
+
+    tiddler_as = export.Serialization.tiddler_as
+    def broken(self, tiddler):
+        if tiddler.title == 'item 1':
+            raise ValueError('broken')
+        return tiddler_as(self, tiddler)
+    export.Serialization.tiddler_as = broken
+    try:
+        put_tiddler(export.get_store(config), u'item 1', 'content', u'changed')
+        _export()
+    finally:
+        export.Serialization.tiddler_as = tiddler_as
+    assert open(page).read() == original
+    assert 'recipes/site/tiddlers/item 1.html' in \
+        export._read_manifest(EXPORT_DIR)
+
+    #and it is rendered again once it can be
+    _export()
+    assert 'changed' in open(page).read()
+
+
+def test_removed_tiddler_is_removed():
+    _export()
+    store = export.get_store(config)
+    store.delete(Tiddler(u'two words', 'content'))
+    _export()
+    assert not os.path.exists(_page('tiddlers', 'two words.html'))
+    assert os.path.exists(_page('tiddlers', 'item 1.html'))
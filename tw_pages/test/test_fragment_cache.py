@@ -0,0 +1,61 @@
+"""
+test caching rendered sub-templates between page views
+"""
+import sys
+sys.path.insert(0, '.')
+sys.path.insert(0, 'test')
+
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.recipe import Recipe
+
+from tiddlywebpages.store_hooks import hooked_store
+
+from fixtures import make_site, make_app, get_store, put_tiddler, request, \
+    LIST_TEMPLATE, SIDEBAR_TEMPLATE
+
+
+def setup_function(function):
+    global app
+    store = make_site(3)
+    store.put(Bag('notes'))
+    recipe = Recipe('notes')
+    recipe.set_recipe([['notes', '']])
+    store.put(recipe)
+    put_tiddler(store, 'note', 'notes', u'first')
+    #outer is cached, and its own sub-template reads notes, which isn't in site
+    put_tiddler(store, 'list', 'templates',
+        LIST_TEMPLATE + u'<div class="outer">{{ extra.outer }}</div>',
+        fields={'mime_type': 'text/html', 'outer': 'site?limit=1'})
+    put_tiddler(store, 'outer', 'templates', u'{{ extra.notes }}',
+        fields={'fragment_cache': 'true', 'notes': 'notes'})
+    put_tiddler(store, 'notes', 'templates', SIDEBAR_TEMPLATE)
+    app = make_app()
+
+
+def _outer():
+    status, headers, body, environ = request(app, '/recipes/site/tiddlers')
+    assert status.startswith('200')
+    return body.split('<div class="outer">', 1)[1]
+
+
+def test_cached():
+    first = _outer()
+    assert 'note:first' in first
+    #changed behind the cache's back, so the cached copy is used
+    put_tiddler(get_store(), 'note', 'notes', u'unseen')
+    assert _outer() == first
+
+
+def test_sub_template_bag_changed():
+    assert 'note:first' in _outer()
+    put_tiddler(hooked_store(get_store()), 'note', 'notes', u'second')
+    outer = _outer()
+    assert 'note:second' in outer
+    assert 'note:first' not in outer
+
+
+def test_own_bag_changed():
+    assert 'note:first' in _outer()
+    put_tiddler(get_store(), 'note', 'notes', u'second')
+    put_tiddler(hooked_store(get_store()), 'item 0', 'content', u'changed')
+    assert 'note:second' in _outer()
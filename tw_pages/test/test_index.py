@@ -0,0 +1,184 @@
+"""
+test answering sub-template filters from the index
+"""
+import sys
+sys.path.insert(0, '.')
+sys.path.insert(0, 'test')
+
+import threading
+import time
+
+from tiddlyweb.config import config
+from tiddlyweb.filters import FilterError
+from tiddlyweb.filters.select import ATTRIBUTE_SELECTOR
+from tiddlyweb.filters.sort import ATTRIBUTE_SORT_KEY
+from tiddlyweb.model.recipe import Recipe
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import Store
+
+from tiddlywebpages import index
+
+from fixtures import make_site, get_store, put_tiddler, STORE_DIR
+
+
+class SlowStore(object):
+    """
+    count and slow down the tiddlers read from a store
+    """
+    def __init__(self, store, delay=0):
+        self.store = store
+        self.delay = delay
+        self.reads = 0
+
+    def get(self, thing):
+        if isinstance(thing, Tiddler):
+            self.reads += 1
+            time.sleep(self.delay)
+        return self.store.get(thing)
+
+
+def setup_function(function):
+    store = make_site(tiddlers=4)
+    for number, modifier in enumerate(['alice', 'bob', 'alice', 'carol']):
+        put_tiddler(store, u'item %d' % number, 'content', u'text %d' % number,
+            tags=['news'], fields={'colour': number % 2 and 'red' or 'blue'},
+            modifier=modifier, type=number == 3 and 'text/html' or None)
+    index.INDEXES.clear()
+    index._build_locks.clear()
+
+
+def _query(filter_string, filter_index=True):
+    return sorted(_ordered(filter_string, filter_index))
+
+
+def _ordered(filter_string, filter_index=True):
+    environ = {'tiddlyweb.config': {'tw_pages': {'filter_index': filter_index}},
+        'tiddlyweb.store': get_store()}
+    recipe = get_store().get(Recipe('site'))
+    return [tiddler.title for tiddler in
+        index.query_recipe(environ, recipe, filter_string)]
+
+
+def _sorted_values(filter_string, attribute, filter_index=True):
+    """
+    the value of attribute for each tiddler found, as tiddlers
+    that sort the same come in no particular order
+    """
+    values = []
+    for title in _ordered(filter_string, filter_index):
+        tiddler = get_store().get(Tiddler(title, 'content'))
+        values.append(getattr(tiddler, attribute, None) or
+            tiddler.fields.get(attribute))
+    return values
+
+
+def test_same_answer_as_filters():
+    for filter_string in ['select=modifier:alice', 'select=modifier:!alice',
+            'select=creator:bob', 'select=type:text/html',
+            'select=field:colour', 'select=colour:red', 'select=tag:news',
+            'like=modifier:ALI', 'sort=-modifier;limit=2',
+            'select=text:text 1', 'like=text:2']:
+        assert _query(filter_string) == _query(filter_string, False), \
+            filter_string
+    assert _query('select=modifier:alice') == ['item 0', 'item 2']
+
+
+def test_plan_leaves_unindexed_attributes():
+    for filter_string in ['select=text:x', 'select=recipe:site',
+            'like=text:x', 'sort=text', 'sort=tags', 'select=fields:x']:
+        assert index.plan(filter_string) == ([], filter_string), filter_string
+    steps, remaining = index.plan('select=modifier:alice;select=text:x')
+    assert steps == [('select', u'modifier', u'alice', False, None)]
+    assert remaining == 'select=text:x'
+
+
+def test_same_order_as_filters():
+    for filter_string, attribute in [('sort=modifier', 'modifier'),
+            ('sort=-modified', 'modified'), ('sort=colour', 'colour'),
+            ('select=tag:news;sort=-colour;limit=3', 'colour')]:
+        assert _sorted_values(filter_string, attribute) == \
+            _sorted_values(filter_string, attribute, False), filter_string
+    for filter_index in (True, False):
+        try:
+            _ordered('sort=flavour', filter_index)
+            assert False, 'FilterError not raised'
+        except FilterError:
+            pass
+
+
+def test_plugin_sort_key():
+    ATTRIBUTE_SORT_KEY['modifier'] = lambda value: \
+        {'carol': 0, 'bob': 1, 'alice': 2}[value]
+    try:
+        assert index.plan('sort=modifier') == ([], 'sort=modifier')
+        assert _sorted_values('sort=modifier', 'modifier') == \
+            _sorted_values('sort=modifier', 'modifier', False) == \
+            ['carol', 'bob', 'alice', 'alice']
+    finally:
+        del ATTRIBUTE_SORT_KEY['modifier']
+
+
+def test_plugin_selector():
+    ATTRIBUTE_SELECTOR['modifier'] = lambda tiddler, attribute, value: \
+        getattr(tiddler, attribute).startswith(value)
+    try:
+        assert index.plan('select=modifier:a')[0] == []
+        assert _query('select=modifier:a') == ['item 0', 'item 2']
+    finally:
+        del ATTRIBUTE_SELECTOR['modifier']
+
+
+def test_fingerprint_index_expires():
+    store = Store('text', {'store_root': STORE_DIR},
+        {'tiddlyweb.config': {'tw_pages': {'filter_index_ttl': 30}}})
+    index.index_fingerprint(store, 'content')
+    assert index.INDEXES['content'].ttl == 30
+
+
+def test_built_once():
+    store = SlowStore(get_store(), 0.01)
+    threads = [threading.Thread(target=index.get_index,
+        args=(store, 'content')) for i in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert store.reads == 4
+    assert len(index.INDEXES['content'].list_entries()) == 4
+
+
+def test_expired_index_used_while_rebuilt():
+    old = index.get_index(get_store(), 'content', ttl=1)
+    old.built -= 10
+    store = SlowStore(get_store(), 0.1)
+    rebuilding = threading.Thread(target=index.get_index,
+        args=(store, 'content'))
+    rebuilding.start()
+    time.sleep(0.05)
+
+    started = time.time()
+    assert index.get_index(store, 'content') is old
+    assert time.time() - started < 0.1
+    rebuilding.join()
+    new = index.get_index(store, 'content')
+    assert new is not old
+    assert new.ttl == 1
+    assert store.reads == 4
+
+
+def test_changes_while_building_are_kept():
+    store = SlowStore(get_store(), 0.05)
+    building = threading.Thread(target=index.get_index,
+        args=(store, 'content'))
+    building.start()
+    time.sleep(0.02)
+    #as the store hooks would
+    tiddler = put_tiddler(get_store(), u'new one', 'content')
+    index._tiddler_put(None, tiddler)
+    tiddler = Tiddler(u'item 3', 'content')
+    get_store().delete(tiddler)
+    index._tiddler_delete(None, tiddler)
+    building.join()
+    titles = sorted(entry.title for entry in
+        index.INDEXES['content'].list_entries())
+    assert titles == ['item 0', 'item 1', 'item 2', 'new one']
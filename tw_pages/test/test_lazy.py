@@ -0,0 +1,91 @@
+"""
+test loading tiddlers lazily for templates
+"""
+import sys
+sys.path.insert(0, '.')
+sys.path.insert(0, 'test')
+
+from tiddlyweb.model.tiddler import Tiddler
+
+from tiddlywebpages.lazy import LazyTiddlers, LazyTiddler, lazy_tiddlers
+
+from fixtures import make_site, get_store
+
+
+class CountingStore(object):
+    def __init__(self, store):
+        self.store = store
+        self.reads = 0
+
+    def get(self, thing):
+        self.reads += 1
+        return self.store.get(thing)
+
+
+def setup_module(module):
+    make_site()
+
+
+def _listing(count=10, taken=None):
+    for number in range(count):
+        if taken is not None:
+            taken.append(number)
+        yield Tiddler(u'item %d' % number, 'content')
+
+
+def _environ():
+    return {'tiddlyweb.store': CountingStore(get_store())}
+
+
+def test_listed_attributes_not_read():
+    environ = _environ()
+    tiddler = LazyTiddler(Tiddler(u'item 1', 'content'), environ)
+    assert tiddler.title == u'item 1'
+    assert tiddler.bag == u'content'
+    assert environ['tiddlyweb.store'].reads == 0
+    assert tiddler.text == u'text 1'
+    assert tiddler.tags == [u'news']
+    assert environ['tiddlyweb.store'].reads == 1
+
+
+def test_read_once_per_request():
+    environ = _environ()
+    for i in range(3):
+        assert LazyTiddler(Tiddler(u'item 2', 'content'), environ).text == \
+            u'text 2'
+    assert environ['tiddlyweb.store'].reads == 1
+
+
+def test_missing_tiddler():
+    environ = _environ()
+    tiddler = LazyTiddler(Tiddler(u'missing', 'content'), environ)
+    assert tiddler.text == u''
+
+
+def test_only_what_is_used_is_listed():
+    taken = []
+    tiddlers = LazyTiddlers(_listing(taken=taken), _environ())
+    assert [tiddler.title for tiddler in tiddlers[:3]] == \
+        [u'item 0', u'item 1', u'item 2']
+    assert taken == [0, 1, 2]
+    assert tiddlers[1].title == u'item 1'
+    assert tiddlers
+    assert taken == [0, 1, 2]
+
+    assert len(tiddlers) == 10
+    assert tiddlers[-1].title == u'item 9'
+    assert [tiddler.title for tiddler in tiddlers.page(2, size=4)] == \
+        [u'item 4', u'item 5', u'item 6', u'item 7']
+
+
+def test_iterated_more_than_once():
+    tiddlers = LazyTiddlers(_listing(3), _environ())
+    first = [tiddler.title for tiddler in tiddlers]
+    assert [tiddler.title for tiddler in tiddlers] == first
+    assert [tiddler.title for tiddler in tiddlers.raw()] == first
+    assert not LazyTiddlers([], _environ())
+
+
+def test_not_wrapped_twice():
+    tiddlers = LazyTiddlers(_listing(3), _environ())
+    assert lazy_tiddlers(tiddlers, {}) is tiddlers
@@ -0,0 +1,202 @@
+"""
+test running sub-templates in parallel
+"""
+import sys
+sys.path.insert(0, '.')
+
+import threading
+import time
+
+from tiddlywebpages.parallel import run_parallel, request_slots, \
+    check_cancelled, Cancelled, WorkerPool, POOL
+
+
+def test_results():
+    slots = threading.Semaphore(3)
+    jobs = [(number, lambda x: x * 2, (number,)) for number in range(10)]
+    assert run_parallel(jobs, slots) == dict((number, number * 2)
+        for number in range(10))
+    #every thread gives its slot back once there is nothing left to do
+    time.sleep(0.1)
+    assert [slots.acquire(False) for i in range(4)] == [True, True, True, False]
+
+
+def test_no_slots_runs_in_this_thread():
+    slots = threading.Semaphore(0)
+    jobs = [(number, lambda: threading.currentThread(), ())
+        for number in range(3)]
+    results = run_parallel(jobs, slots)
+    assert set(results.values()) == set([threading.currentThread()])
+
+
+def test_threads_reused():
+    def job():
+        time.sleep(0.01)
+        return threading.currentThread()
+    jobs = [(number, job, ()) for number in range(6)]
+    run_parallel(jobs, threading.Semaphore(3))
+    time.sleep(0.1)
+    threads = POOL.threads
+    results = run_parallel(jobs, threading.Semaphore(3))
+    assert threading.currentThread() not in results.values()
+    #the threads left waiting by the first run are used again
+    assert POOL.threads == threads
+
+
+def test_idle_threads_end():
+    pool = WorkerPool(idle_timeout=0.05)
+    done = threading.Event()
+    pool.submit(done.set)
+    assert done.wait(1) or done.isSet()
+    assert pool.threads == 1
+    time.sleep(0.2)
+    assert pool.threads == 0
+    assert pool.idle == 0
+
+
+def test_request_slots():
+    environ = {'tiddlyweb.config': {'tw_pages': {'render_threads': 3}}}
+    slots = request_slots(environ)
+    assert request_slots(environ) is slots
+    assert [slots.acquire(False) for i in range(4)] == [True, True, True, False]
+
+    environ = {'tiddlyweb.config': {'tw_pages': {'render_threads': 1}}}
+    assert not request_slots(environ).acquire(False)
+
+
+def test_nested_jobs_share_slots():
+    slots = threading.Semaphore(3)
+    lock = threading.Lock()
+    running = {}
+    most = []
+
+    def leaf():
+        ident = threading.currentThread().ident
+        lock.acquire()
+        running[ident] = running.get(ident, 0) + 1
+        most.append(len(running))
+        lock.release()
+        time.sleep(0.02)
+        lock.acquire()
+        running[ident] -= 1
+        if not running[ident]:
+            del running[ident]
+        lock.release()
+        return 'leaf'
+
+    def branch():
+        jobs = [(number, leaf, ()) for number in range(4)]
+        return run_parallel(jobs, slots)
+
+    jobs = [(number, branch, ()) for number in range(4)]
+    results = run_parallel(jobs, slots)
+
+    assert len(results) == 4
+    assert all(result == dict((number, 'leaf') for number in range(4))
+        for result in results.values())
+    #three threads from the slots, none for the nested jobs
+    assert max(most) <= 3
+
+
+def test_errors_are_raised():
+    def broken():
+        raise ValueError('broken')
+    jobs = [(1, broken, ()), (2, lambda: 'ok', ())]
+    try:
+        run_parallel(jobs, threading.Semaphore(2))
+        assert False, 'ValueError not raised'
+    except ValueError:
+        pass
+
+
+def test_timed_out_job_is_cancelled():
+    carried_on = []
+    stopped = threading.Event()
+
+    def slow():
+        time.sleep(0.3)
+        try:
+            check_cancelled()
+        except Cancelled:
+            stopped.set()
+            raise
+        carried_on.append(True)
+        return 'slow'
+
+    jobs = [('slow', slow, ()), ('fast', lambda: 'fast', ())]
+    results = run_parallel(jobs, threading.Semaphore(2), timeout=0.1,
+        default='missing')
+    assert results == {'slow': 'missing', 'fast': 'fast'}
+
+    assert stopped.wait(2) or stopped.isSet()
+    assert carried_on == []
+
+
+def test_nested_jobs_cancelled_with_parent():
+    slots = threading.Semaphore(4)
+    stopped = threading.Event()
+
+    def inner():
+        time.sleep(0.3)
+        try:
+            check_cancelled()
+        except Cancelled:
+            stopped.set()
+            raise
+        return 'inner'
+
+    def outer():
+        return run_parallel([(1, inner, ()), (2, inner, ())], slots)
+
+    results = run_parallel([('outer', outer, ()), ('other', lambda: 'ok', ())],
+        slots, timeout=0.1, default='missing')
+    assert results == {'outer': 'missing', 'other': 'ok'}
+    stopped.wait(2)
+    assert stopped.isSet()
+
+
+def test_inline_job_times_out():
+    stopped = []
+
+    def slow():
+        time.sleep(0.2)
+        try:
+            check_cancelled()
+        except Cancelled:
+            stopped.append(True)
+            raise
+        return 'slow'
+
+    def late():
+        #doesn't check, so finishes, but too late to be used
+        time.sleep(0.2)
+        return 'late'
+
+    jobs = [('slow', slow, ()), ('late', late, ()), ('fast', lambda: 'fast', ())]
+    results = run_parallel(jobs, threading.Semaphore(0), timeout=0.1,
+        default='missing')
+    assert results == {'slow': 'missing', 'late': 'missing', 'fast': 'fast'}
+    assert stopped == [True]
+    #nothing is left cancelled in this thread
+    check_cancelled()
+
+
+def test_inline_jobs_cancelled_with_parent():
+    ran = []
+
+    def inner(number):
+        time.sleep(0.15)
+        check_cancelled()
+        ran.append(number)
+        return number
+
+    def outer():
+        #no threads left, so these run inline in the outer job's thread
+        return run_parallel([(1, inner, (1,)), (2, inner, (2,))],
+            threading.Semaphore(0), timeout=10)
+
+    results = run_parallel([('outer', outer, ()), ('other', lambda: 'ok', ())],
+        threading.Semaphore(2), timeout=0.1, default='missing')
+    assert results == {'outer': 'missing', 'other': 'ok'}
+    time.sleep(0.4)
+    assert ran == []
@@ -0,0 +1,100 @@
+"""
+test handing tiddlers on to other (non TiddlyWebPages) serializers
+"""
+import sys
+sys.path.insert(0, '.')
+sys.path.insert(0, 'test')
+
+import threading
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+
+from tiddlywebpages.serialization import (Serialization, TiddlerListBag,
+    _as_text)
+
+from fixtures import make_site, make_app, make_environ, get_store
+
+
+def setup_module(module):
+    make_site(3)
+    make_app()
+
+
+def _serialization():
+    environ = make_environ('/recipes/site/tiddlers.txt')
+    environ['tiddlyweb.config'] = config
+    environ['tiddlyweb.store'] = get_store()
+    environ['tiddlyweb.usersign'] = {'name': 'GUEST', 'roles': []}
+    return Serialization(environ)
+
+
+def _tiddlers():
+    store = get_store()
+    return [store.get(Tiddler(u'item %d' % number, 'content'))
+        for number in range(3)]
+
+
+def test_serializer_reused():
+    serialization = _serialization()
+    serializer = serialization.get_serializer('txt')
+    assert serialization.get_serializer('txt') is serializer
+    assert serialization.get_serializer('json') is not serializer
+
+    #each thread has its own, as Serializer.object changes
+    other = []
+    thread = threading.Thread(
+        target=lambda: other.append(serialization.get_serializer('txt')))
+    thread.start()
+    thread.join()
+    assert other[0] is not serializer
+
+
+def test_tiddler_list_not_copied():
+    tiddlers = _tiddlers()
+    bag = TiddlerListBag(tiddlers)
+    assert bag.tmpbag
+    assert bag.list_tiddlers() is tiddlers
+    assert list(bag.gen_tiddlers()) == tiddlers
+
+    #a generator can only be gone through once, so it is kept as a list
+    bag = TiddlerListBag(tiddler for tiddler in tiddlers)
+    assert list(bag.gen_tiddlers()) == tiddlers
+    assert list(bag.gen_tiddlers()) == tiddlers
+
+
+def test_pass_through_list():
+    serialization = _serialization()
+    output = _as_text(serialization.pass_through_external_serializer('txt',
+        _tiddlers()))
+    for number in range(3):
+        assert u'item %d' % number in output
+
+
+def test_pass_through_bag():
+    bag = Bag('tmpbag', tmpbag=True)
+    bag.add_tiddlers(_tiddlers())
+    serialization = _serialization()
+    output = _as_text(serialization.pass_through_external_serializer('txt',
+        bag))
+    for number in range(3):
+        assert u'item %d' % number in output
+
+
+def test_pass_through_tiddler():
+    serialization = _serialization()
+    tiddler = _tiddlers()[1]
+    output = _as_text(serialization.pass_through_external_serializer('txt',
+        tiddler))
+    assert u'text 1' in output
+    #the serializer is used again for the next one
+    output = _as_text(serialization.pass_through_external_serializer('txt',
+        _tiddlers()[2]))
+    assert u'text 2' in output
+
+
+def test_as_text():
+    assert _as_text(u'already text') == u'already text'
+    assert _as_text(iter(['one ', u'two ', u'\u00e9'.encode('utf-8')])) == \
+        u'one two \u00e9'
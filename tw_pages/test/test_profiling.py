@@ -0,0 +1,110 @@
+"""
+test timing where rendering a page goes
+"""
+import sys
+sys.path.insert(0, '.')
+sys.path.insert(0, 'test')
+
+import threading
+
+import simplejson
+
+from tiddlywebpages import profiling
+from tiddlywebpages.profiling import Profiler, NULL_PROFILER, \
+    request_profiler, get_stats, PROFILE_HEADER
+
+from fixtures import make_site, make_app, request
+
+
+def setup_function(function):
+    profiling._stats.clear()
+
+
+def test_tree():
+    profiler = Profiler()
+    outer = profiler.start('template', 'list')
+    assert profiler.timed('render', 'list', lambda: 'done') == 'done'
+    profiler.stop(outer)
+    root = profiler.finish('page name')
+
+    assert [timing.describe() for timing in root.walk()] == \
+        ['page page name', 'template list', 'render list']
+    assert root.as_header().startswith('page page name=')
+    assert '[template list=' in root.as_header()
+    assert root.as_text().splitlines()[2].startswith('    ')
+
+
+def test_other_threads_adopt():
+    profiler = Profiler()
+    timing = profiler.start('template', 'list')
+    def render():
+        profiler.adopt(timing)
+        profiler.timed('sub-template', 'latest', lambda: None)
+    thread = threading.Thread(target=render)
+    thread.start()
+    thread.join()
+    profiler.stop(timing)
+    assert [child.describe() for child in timing.children] == \
+        ['sub-template latest']
+
+
+def test_stats():
+    for elapsed in (0.1, 0.2, 0.3):
+        profiler = Profiler(max_samples=2)
+        timing = profiler.start('template', 'slow')
+        profiler.stop(timing)
+        timing.elapsed = elapsed
+        fast = profiler.start('template', 'fast')
+        profiler.stop(fast)
+        fast.elapsed = 0.001
+        #not listed
+        profiler.stop(profiler.start('store', 'read'))
+        profiler.finish('page')
+
+    stats = get_stats()
+    names = [(stat['kind'], stat['name']) for stat in stats]
+    assert names.index(('template', 'slow')) < names.index(('template', 'fast'))
+    assert ('store', 'read') not in names
+    slow = stats[names.index(('template', 'slow'))]
+    assert slow['count'] == 2
+    assert round(slow['max']) == 300
+
+
+def test_off():
+    environ = {'tiddlyweb.config': {'tw_pages': {'profile': False}}}
+    assert request_profiler(environ) is NULL_PROFILER
+    environ = {'tiddlyweb.config': {'tw_pages': {'profile': 'comment'}}}
+    profiler = request_profiler(environ)
+    assert isinstance(profiler, Profiler)
+    assert request_profiler(environ) is profiler
+
+
+def test_comment_and_stats_page():
+    make_site()
+    app = make_app(profile='comment', conditional_get=False)
+    status, headers, body, environ = request(app, '/recipes/site/tiddlers')
+    assert '<!-- tw_pages profile' in body
+    assert 'template list' in body
+    assert 'sub-template latest' in body
+
+    status, headers, body, environ = request(app, '/tiddlywebpages/stats')
+    stats = simplejson.loads(body)
+    assert 'list' in [stat['name'] for stat in stats['templates']]
+    assert 'caches' in stats
+
+
+def test_no_stats_page_by_default():
+    make_site()
+    app = make_app()
+    status, headers, body, environ = request(app, '/tiddlywebpages/stats')
+    assert status.startswith('404')
+    status, headers, body, environ = request(app, '/recipes/site/tiddlers')
+    assert '<!-- tw_pages profile' not in body
+
+
+def test_header():
+    make_site()
+    app = make_app(profile='header', conditional_get=False)
+    status, headers, body, environ = request(app, '/recipes/site/tiddlers')
+    assert 'template list=' in headers[PROFILE_HEADER]
+    assert '<!-- tw_pages profile' not in body
@@ -0,0 +1,63 @@
+"""
+test reloading templates that have changed in the store
+"""
+import sys
+sys.path.insert(0, '.')
+sys.path.insert(0, 'test')
+
+from tiddlyweb.config import config
+from tiddlyweb.model.tiddler import Tiddler
+
+from fixtures import make_site, make_app, get_store, put_tiddler, request
+
+PAGE = '/recipes/site/tiddlers/item%201'
+
+
+def _get(app):
+    status, headers, body, environ = request(app, PAGE)
+    assert status.startswith('200')
+    return body
+
+
+def _change_template():
+    put_tiddler(get_store(), 'tiddler', 'templates',
+        u'{% for tiddler in tiddlers %}changed {{ tiddler.title }}{% endfor %}',
+        fields={'mime_type': 'text/html'})
+
+
+def setup_function(function):
+    make_site()
+
+
+def test_changed_template_reloaded():
+    app = make_app(reload_interval=10)
+    assert '<h1>item 1</h1>' in _get(app)
+    revision = config['tw_pages_serializers']['tiddler']['revision']
+    _change_template()
+
+    #not until reload_interval has passed
+    assert '<h1>item 1</h1>' in _get(app)
+    config['tw_pages_checked'] -= 11
+    assert 'changed item 1' in _get(app)
+    assert config['tw_pages_serializers']['tiddler']['revision'] > revision
+
+
+def test_no_reloading():
+    app = make_app(reload_interval=0)
+    _get(app)
+    _change_template()
+    config['tw_pages_checked'] -= 3600
+    assert '<h1>item 1</h1>' in _get(app)
+
+
+def test_new_and_removed_templates():
+    app = make_app(reload_interval=10)
+    _get(app)
+    fingerprint = config['tw_pages_fingerprint']
+    put_tiddler(get_store(), 'extra', 'templates', u'extra')
+    get_store().delete(Tiddler('latest', 'templates'))
+    config['tw_pages_checked'] -= 11
+    _get(app)
+    assert 'extra' in config['tw_pages_serializers']
+    assert 'latest' not in config['tw_pages_serializers']
+    assert config['tw_pages_fingerprint'] != fingerprint
@@ -0,0 +1,105 @@
+"""
+test the per request store cache
+"""
+import sys
+sys.path.insert(0, '.')
+sys.path.insert(0, 'test')
+
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.recipe import Recipe
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import NoTiddlerError
+from tiddlyweb import control
+
+from tiddlywebpages.request_store import RequestStore, request_store
+
+from fixtures import make_site, make_app, get_store, request
+
+
+def setup_module(module):
+    make_site()
+
+
+def _titles(bag):
+    return sorted(tiddler.title for tiddler in bag.list_tiddlers())
+
+
+def test_reads_are_shared():
+    store = RequestStore(get_store())
+    first = store.get(Tiddler('item 1', 'content'))
+    second = store.get(Tiddler('item 1', 'content'))
+    assert first.text == second.text == 'text 1'
+    assert first is not second
+    assert store.reads == 1
+    assert store.saved == 1
+
+
+def test_skinny_bag_is_not_given_for_full_bag():
+    store = RequestStore(get_store())
+    skinny = Bag('content')
+    skinny.skinny = True
+    assert _titles(store.get(skinny)) == []
+
+    full = store.get(Bag('content'))
+    assert len(_titles(full)) == 10
+
+
+def test_recipe_tiddlers_after_skinny_read():
+    store = RequestStore(get_store())
+    recipe = store.get(Recipe('site'))
+    #reads each bag skinny, then in full to load the tiddlers
+    tiddlers = control.get_tiddlers_from_recipe(recipe, {'tiddlyweb.store': store})
+    assert len(list(tiddlers)) == 10
+
+
+def test_fingerprints_of_skinny_and_full_bags():
+    store = RequestStore(get_store())
+    skinny = Bag('content')
+    skinny.skinny = True
+    store.get(skinny)
+    store.get(Bag('content'))
+    keys = list(store.dependencies)
+    assert ('bag', 'content', True) in keys
+    assert ('bag', 'content', False) in keys
+
+    fingerprints = RequestStore(get_store()).fingerprints(keys)
+    assert fingerprints == store.dependencies
+
+
+def test_put_clears_cache():
+    store = RequestStore(get_store())
+    tiddler = store.get(Tiddler('item 2', 'content'))
+    store.put(Tiddler('new one', 'content'))
+    assert len(_titles(store.get(Bag('content')))) == 11
+    store.delete(Tiddler('new one', 'content'))
+    assert len(_titles(store.get(Bag('content')))) == 10
+
+
+def test_missing_tiddler():
+    store = RequestStore(get_store())
+    try:
+        store.get(Tiddler('missing', 'content'))
+        assert False, 'NoTiddlerError not raised'
+    except NoTiddlerError:
+        pass
+
+
+def test_request_store_in_environ():
+    environ = {'tiddlyweb.store': get_store()}
+    store = request_store(environ)
+    assert isinstance(store, RequestStore)
+    assert request_store(environ) is store
+
+
+def test_sub_templates_rendered_without_conditional_get():
+    app = make_app(conditional_get=False)
+    for i in range(2):
+        status, headers, body, environ = request(app, '/recipes/site/tiddlers')
+        assert status.startswith('200')
+        assert '<li>item 9:text 9</li><li>item 7:text 7</li>' in body
+
+
+def test_sub_templates_rendered_first_time():
+    app = make_app()
+    status, headers, body, environ = request(app, '/recipes/site/tiddlers')
+    assert '<li>item 9:text 9</li><li>item 7:text 7</li>' in body
@@ -0,0 +1,47 @@
+"""
+test shortening HTML
+"""
+import sys
+sys.path.insert(0, '.')
+
+from tiddlywebpages.filters.shorten import shorten
+
+
+def test_short_enough():
+    assert shorten(u'<p>short</p>', 10) == u'<p>short</p>'
+    assert shorten(u'plain text', 10) == u'plain text'
+
+
+def test_open_tags_closed():
+    assert shorten(u'<div><p>some <b>bold</b> text</p></div>', 7) == \
+        u'<div><p>some <b>bo</b></p></div>'
+    assert shorten(u'<ul><li>one</li><li>two</li></ul>', 4) == \
+        u'<ul><li>one</li><li>t</li></ul>'
+
+
+def test_tags_and_entities_not_counted():
+    assert shorten(u'<a href="/a/long/link">ab</a>cd', 3) == \
+        u'<a href="/a/long/link">ab</a>c'
+    assert shorten(u'a &amp; b', 3) == u'a &amp;'
+    assert shorten(u'a<!-- a comment -->bc', 2) == u'a<!-- a comment -->b'
+
+
+def test_void_tags():
+    assert shorten(u'one<br>two<img src="x"/>three', 5) == u'one<br>tw'
+
+
+def test_words():
+    assert shorten(u'<p>some words here</p>', 12, words=True) == \
+        u'<p>some words</p>'
+    assert shorten(u'<p>enormous</p>', 3, words=True) == u'<p>eno</p>'
+    assert shorten(u'<p>some words here</p>', 12, words=True,
+        end=u'...') == u'<p>some words...</p>'
+
+
+def test_end_only_when_cut():
+    assert shorten(u'whole', 5, end=u'...') == u'whole'
+    assert shorten(u'whole thing', 5, end=u'...') == u'whole...'
+
+
+def test_no_tag_opened_after_the_cut():
+    assert shorten(u'abc<b>def</b>', 3) == u'abc'
@@ -0,0 +1,89 @@
+"""
+test starting up without reading every template
+"""
+import sys
+sys.path.insert(0, '.')
+sys.path.insert(0, 'test')
+
+import os
+import tempfile
+
+from tiddlyweb.config import config
+from tiddlyweb.model.tiddler import Tiddler
+
+from tiddlywebpages.filters import lazy_filter
+from tiddlywebpages.register import register_templates
+
+from fixtures import make_site, make_app, get_store, put_tiddler, request
+
+METADATA = os.path.join(tempfile.gettempdir(), 'tw_pages_test_metadata.json')
+
+
+class CountingStore(object):
+    """
+    count the tiddlers read in full
+    """
+    def __init__(self, store):
+        self.store = store
+        self.read = []
+
+    def get(self, thing):
+        if isinstance(thing, Tiddler):
+            self.read.append(thing.title)
+        return self.store.get(thing)
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+
+def setup_function(function):
+    if os.path.exists(METADATA):
+        os.remove(METADATA)
+    make_site()
+
+
+def test_lazy_filter():
+    sys.modules.pop('colorsys', None)
+    rgb_to_hsv = lazy_filter('colorsys', 'rgb_to_hsv')
+    assert 'colorsys' not in sys.modules
+    assert rgb_to_hsv(1, 0, 0) == (0, 1, 1)
+    assert 'colorsys' in sys.modules
+    assert rgb_to_hsv.__name__ == 'rgb_to_hsv'
+
+
+def test_templates_registered_from_metadata():
+    app = make_app(metadata_cache=METADATA)
+    register_templates(config, get_store())
+    assert os.path.exists(METADATA)
+
+    store = CountingStore(get_store())
+    register_templates(config, store)
+    assert store.read == []
+    assert config['tw_pages_serializers']['list']['template'] is None
+    assert config['tw_pages_serializers']['list']['plugins']['latest'] == \
+        'site?select=tag:news;sort=-modified;limit=3'
+
+    #read when it is first used
+    status, headers, body, environ = request(app, '/recipes/site/tiddlers')
+    assert '<li>item 1</li>' in body
+    assert config['tw_pages_serializers']['list']['template'] is not None
+
+
+def test_changed_template_read():
+    make_app(metadata_cache=METADATA)
+    register_templates(config, get_store())
+    put_tiddler(get_store(), 'list', 'templates', u'changed',
+        fields={'mime_type': 'text/html'})
+
+    store = CountingStore(get_store())
+    register_templates(config, store)
+    assert store.read == ['list']
+    assert config['tw_pages_serializers']['list']['template'] == u'changed'
+
+
+def test_no_metadata_cache():
+    make_app()
+    store = CountingStore(get_store())
+    register_templates(config, store)
+    assert sorted(store.read) == ['Default', 'latest', 'list', 'tiddler']
+    assert not os.path.exists(METADATA)
@@ -0,0 +1,62 @@
+"""
+test that changes to bags and tiddlers are noticed,
+with or without tiddlyweb's own store hooks
+"""
+import sys
+sys.path.insert(0, '.')
+sys.path.insert(0, 'test')
+
+import simplejson
+
+from tiddlyweb.config import config
+
+from tiddlywebpages.cache import bag_generation
+from tiddlywebpages.store_hooks import hooked_store, HookedStore, StoreHooks, \
+    NATIVE_HOOKS
+
+from fixtures import make_site, make_app, get_store, put_tiddler, request
+
+
+def setup_module(module):
+    make_site()
+    module.app = make_app()
+
+
+def test_store_hooks_installed():
+    filters = config['server_request_filters']
+    if NATIVE_HOOKS:
+        assert StoreHooks not in filters
+    else:
+        assert filters.count(StoreHooks) == 1
+
+
+def test_hooked_store_wraps_once():
+    store = hooked_store(get_store())
+    assert hooked_store(store) is store
+    if not NATIVE_HOOKS:
+        assert isinstance(store, HookedStore)
+
+
+def test_put_bumps_generation():
+    before = bag_generation(config, 'content')
+    put_tiddler(hooked_store(get_store()), 'changed', 'content', u'hello')
+    assert bag_generation(config, 'content') == before + 1
+    assert bag_generation(config, 'system') == 0
+
+
+def test_web_put_bumps_generation():
+    before = bag_generation(config, 'content')
+    status, headers, body, environ = request(app,
+        '/bags/content/tiddlers/from%20the%20web', method='PUT',
+        body=simplejson.dumps({'text': 'hello'}),
+        content_type='application/json')
+    assert status.startswith('204')
+    assert bag_generation(config, 'content') == before + 1
+
+
+def test_delete_bumps_generation():
+    before = bag_generation(config, 'content')
+    status, headers, body, environ = request(app,
+        '/bags/content/tiddlers/item%200', method='DELETE')
+    assert status.startswith('204')
+    assert bag_generation(config, 'content') == before + 1
@@ -0,0 +1,39 @@
+"""
+test sending pages as they are rendered
+"""
+import sys
+sys.path.insert(0, '.')
+sys.path.insert(0, 'test')
+
+from fixtures import make_site, make_app, put_tiddler, request
+
+PAGE = '/recipes/site/tiddlers'
+
+
+def setup_function(function):
+    make_site(tiddlers=50)
+
+
+def _chunks(app):
+    status, headers, chunks, environ = request(app, PAGE, chunks=True)
+    assert status.startswith('200')
+    return chunks
+
+
+def test_streamed_page_is_the_same():
+    whole = _chunks(make_app(conditional_get=False))
+    streamed = _chunks(make_app(conditional_get=False, stream=True))
+    assert ''.join(streamed) == ''.join(whole)
+    assert len(streamed) > 2
+    #the start of the wrapper is sent first
+    assert streamed[0].startswith('<html>')
+    assert streamed[0].endswith('<body>')
+
+
+def test_wrapper_used_twice_is_sent_whole():
+    put_tiddler(make_site(tiddlers=5), 'Default', 'templates',
+        u'<html><body>{{ content }}{{ content }}</body></html>')
+    streamed = _chunks(make_app(conditional_get=False, stream=True))
+    whole = _chunks(make_app(conditional_get=False))
+    assert ''.join(streamed) == ''.join(whole)
+    assert ''.join(streamed).count('<li>item 1</li>') == 2
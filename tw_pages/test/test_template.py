@@ -0,0 +1,56 @@
+"""
+test sharing the jinja Environment, and compiled templates,
+between requests
+"""
+import sys
+sys.path.insert(0, '.')
+sys.path.insert(0, 'test')
+
+from tiddlyweb.config import config
+from tiddlyweb.model.tiddler import Tiddler
+
+from tiddlywebpages.template import Template, get_environment
+from tiddlywebpages.register import register_template
+
+from fixtures import make_site, make_app, request
+
+
+def setup_module(module):
+    make_site()
+    make_app()
+
+
+def _template(revision, text):
+    tiddler = Tiddler('shared', 'templates')
+    tiddler.revision = revision
+    tiddler.text = text
+    register_template(config, tiddler)
+
+
+def test_one_environment():
+    environment = get_environment(config)
+    assert get_environment(config) is environment
+    assert Template({'tiddlyweb.config': config}).template_env is environment
+
+
+def test_compiled_once_per_revision():
+    _template(1, u'first {{ value }}')
+    template = Template({'tiddlyweb.config': config})
+    compiled = template.get_template('shared')
+    assert compiled.render(value='x') == u'first x'
+    assert Template({'tiddlyweb.config': config}).get_template('shared') \
+        is compiled
+
+    _template(2, u'second {{ value }}')
+    recompiled = template.get_template('shared')
+    assert recompiled is not compiled
+    assert recompiled.render(value='x') == u'second x'
+
+
+def test_environment_shared_by_requests():
+    app = make_app()
+    request(app, '/recipes/site/tiddlers')
+    environment = config['tw_pages_environment']
+    status, headers, body, environ = request(app, '/recipes/site/tiddlers')
+    assert status.startswith('200')
+    assert config['tw_pages_environment'] is environment
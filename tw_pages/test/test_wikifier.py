@@ -0,0 +1,110 @@
+"""
+test the wikified filter and its caches
+"""
+import sys
+sys.path.insert(0, '.')
+
+import os
+import shutil
+import tempfile
+import time
+
+from tiddlyweb.config import config
+
+from tiddlywebpages.filters import wikifier
+
+CACHE_DIR = os.path.join(tempfile.gettempdir(), 'tw_pages_test_wikify')
+
+
+def setup_function(function):
+    config.pop('tw_pages_caches', None)
+    if os.path.exists(CACHE_DIR):
+        shutil.rmtree(CACHE_DIR)
+    os.mkdir(CACHE_DIR)
+    config.setdefault('tw_pages', {}).update({
+        'wikify_cache_size': 1000,
+        'wikify_cache_bytes': None,
+        'wikify_cache_dir': CACHE_DIR,
+        'wikify_cache_dir_size': 20,
+        'wikify_cache_dir_bytes': None,
+    })
+    wikifier.PRUNE_EVERY = 10
+    wikifier.DISK_STATS['writes'] = 0
+
+
+def teardown_function(function):
+    config['tw_pages']['wikify_cache_dir'] = None
+    config.pop('tw_pages_caches', None)
+    shutil.rmtree(CACHE_DIR)
+
+
+def _files():
+    return [name for name in os.listdir(CACHE_DIR) if name.endswith('.html')]
+
+
+def test_cached():
+    html = wikifier.wikifier(u'some text', 'recipe')
+    stats = wikifier.wikify_stats()
+    assert wikifier.wikifier(u'some text', 'recipe') == html
+    assert wikifier.wikify_stats()['hits'] == stats['hits'] + 1
+    assert len(_files()) == 1
+
+
+def test_read_from_disk():
+    html = wikifier.wikifier(u'from disk', 'recipe')
+    #as if the process had restarted
+    config.pop('tw_pages_caches')
+    hits = wikifier.wikify_stats()['disk_hits']
+    assert wikifier.wikifier(u'from disk', 'recipe') == html
+    assert wikifier.wikify_stats()['disk_hits'] == hits + 1
+
+
+def test_disk_is_bounded():
+    for number in range(95):
+        wikifier.wikifier(u'text %d' % number, 'recipe')
+    assert len(_files()) <= 20 + wikifier.PRUNE_EVERY
+    assert wikifier.wikify_stats()['disk_evictions'] > 0
+
+
+def test_disk_bounded_by_bytes():
+    config['tw_pages']['wikify_cache_dir_size'] = None
+    config['tw_pages']['wikify_cache_dir_bytes'] = 2000
+    for number in range(50):
+        wikifier.wikifier(u'%d %s' % (number, 'x' * 100), 'recipe')
+    total = sum(os.path.getsize(os.path.join(CACHE_DIR, name))
+        for name in _files())
+    assert total <= 2000 + wikifier.PRUNE_EVERY * 200
+
+
+def test_least_recently_used_pruned_first():
+    wikifier.wikifier(u'keep me', 'recipe')
+    kept = wikifier._disk_path(wikifier._cache_key(u'keep me', 'recipe'))
+    for number in range(19):
+        wikifier.wikifier(u'old %d' % number, 'recipe')
+    old = time.time() - 1000
+    for name in _files():
+        os.utime(os.path.join(CACHE_DIR, name), (old, old))
+
+    #read from disk, which marks it as used
+    config.pop('tw_pages_caches')
+    wikifier.wikifier(u'keep me', 'recipe')
+    wikifier.DISK_STATS['writes'] = 0
+    for number in range(10):
+        wikifier.wikifier(u'new %d' % number, 'recipe')
+
+    files = _files()
+    assert len(files) <= 20
+    assert os.path.exists(kept)
+    for number in range(10):
+        assert os.path.exists(wikifier._disk_path(
+            wikifier._cache_key(u'new %d' % number, 'recipe')))
+
+
+def test_stale_temporary_files_removed():
+    stale = os.path.join(CACHE_DIR, 'abc.html.123.tmp')
+    open(stale, 'w').close()
+    old = time.time() - wikifier.STALE_TEMP_AGE - 10
+    os.utime(stale, (old, old))
+    for number in range(10):
+        wikifier.wikifier(u'text %d' % number, 'recipe')
+    assert not os.path.exists(stale)
@@ -4,11 +4,15 @@ TiddlyWebPages
 by Ben Gillies
 """
 from tiddlywebpages.register import refresh, register_config, \
-    register_templates,  BAG_OF_TEMPLATES
-from tiddlywebpages.filters import TW_PAGES_FILTERS
+    register_templates
+from tiddlywebpages.filters import TW_PAGES_FILTERS, lazy_filter
 from tiddlywebpages.config import config as twp_config
+from tiddlywebpages.cache import register_hooks, check_backend
+from tiddlywebpages.store_hooks import install as install_store_hooks
+from tiddlywebpages.index import register_hooks as register_index_hooks
+from tiddlywebpages.conditional import ETagHeader
+from tiddlywebpages.profiling import ProfileHeader, profile_stats
 
-from tiddlyweb import control
 from tiddlyweb.util import merge_config
 
 from tiddlywebplugins.utils import get_store
@@ -23,21 +27,44 @@ def init(config):
     
     #provide a way to allow people to refresh their URLs
     config['selector'].add('/tiddlywebpages/refresh', GET=refresh)
-                      
+    
+    #list the slowest templates, if their times are being kept
+    if config['tw_pages']['profile']:
+        config['selector'].add('/tiddlywebpages/stats', GET=profile_stats)
+    
+    #fail now, rather than on the first request, if the caches can't be used
+    check_backend(config)
+    
+    #invalidate cached fragments when their bags change
+    install_store_hooks(config)
+    register_hooks()
+    
+    #keep the filter indexes up to date
+    if config['tw_pages']['filter_index']:
+        register_index_hooks()
+    
+    #send the ETags worked out for rendered pages
+    if config['tw_pages']['conditional_get']:
+        config['server_response_filters'].insert(0, ETagHeader)
+    
+    #send the timings recorded for rendered pages
+    if config['tw_pages']['profile'] == 'header':
+        config['server_response_filters'].insert(0, ProfileHeader)
+    
+    load_templates(config)
+
+def load_templates(config):
+    """
+    load the filters, config and templates so that
+    pages can be rendered
+    """
     #get the store
     store = get_store(config)
     
-    #set the default config info
-    BAG_OF_TEMPLATES = config['tw_pages']['template_bag']
-    
-    if 'config' in config['tw_pages']:
-        register_config(config, store)
-        
+    #filters are only imported when they are first used
     for new_filter in config['tw_pages']['filters']:
-        _temp = __import__(new_filter, {}, {}, [new_filter])
-        TW_PAGES_FILTERS.append((new_filter, getattr(_temp, new_filter)))
+        TW_PAGES_FILTERS.append((new_filter, lazy_filter(new_filter, new_filter)))
         
     if 'config' in config['tw_pages']:
         register_config(config, store)
     register_templates(config, store)
-    
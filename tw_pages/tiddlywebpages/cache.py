@@ -0,0 +1,524 @@
+"""
+Caches shared between requests
+
+Every cache is made by get_cache, with the backend chosen by
+'cache_backend' in the tw_pages config:
+
+    memory - an LRUCache in each process (the default)
+    sqlite - an SQLiteCache in the file 'cache_path', shared by
+             every process on the host that uses the same file
+
+Cached fragments are keyed on the generation of each bag they
+were rendered from. The generation of a bag is bumped whenever
+a tiddler in it (or the bag itself) is changed, so fragments are
+not reused once their content has changed. Generations are kept
+by the same backend, so with sqlite a change made in one process
+is seen by all of them. Changes are found out about through
+tiddlywebpages.store_hooks.
+
+The sqlite file is created readable only by its owner, and each
+value in it is signed with the tiddlyweb 'secret', so that values
+written by anything else are never unpickled.
+"""
+from tiddlywebpages.store_hooks import HOOKS
+
+from tiddlyweb.util import sha
+
+from collections import OrderedDict
+import cPickle as pickle
+import threading
+import hashlib
+import hmac
+import logging
+import sqlite3
+import time
+import os
+
+_hooks_registered = []
+_backend_lock = threading.Lock()
+
+
+class LRUCache():
+    """
+    a thread safe least recently used cache, bounded by the
+    number of items and (optionally) their total size.
+
+    entries older than ttl seconds are treated as missing.
+    """
+    def __init__(self, max_items=1000, max_bytes=None, ttl=None, sizeof=len):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        return the value for key, or None if it is not cached
+        """
+        self._lock.acquire()
+        try:
+            try:
+                value, size, stored = self._items.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            if self.ttl and time.time() - stored > self.ttl:
+                self.bytes -= size
+                self.misses += 1
+                return None
+            #move it to the most recently used end
+            self._items[key] = (value, size, stored)
+            self.hits += 1
+            return value
+        finally:
+            self._lock.release()
+
+    def set(self, key, value):
+        """
+        store value under key, evicting the least recently
+        used entries if the cache is full
+        """
+        size = self.sizeof(value)
+        if self.max_bytes and size > self.max_bytes:
+            return
+        self._lock.acquire()
+        try:
+            if key in self._items:
+                self.bytes -= self._items.pop(key)[1]
+            self._items[key] = (value, size, time.time())
+            self.bytes += size
+            while len(self._items) > self.max_items or \
+                    (self.max_bytes and self.bytes > self.max_bytes):
+                old_key, (old_value, old_size, old_stored) = \
+                    self._items.popitem(last=False)
+                self.bytes -= old_size
+                self.evictions += 1
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """
+        empty the cache
+        """
+        self._lock.acquire()
+        try:
+            self._items.clear()
+            self.bytes = 0
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        """
+        return a dict of statistics about the cache
+        """
+        return {
+            'items': len(self._items),
+            'bytes': self.bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+
+class SQLiteCache(object):
+    """
+    a least recently used cache kept in an SQLite database, so
+    that it can be shared by several processes. bounded (roughly,
+    it is checked every evict_every sets) by the number of items 
+    and their total size, with values pickled.
+
+    entries older than ttl seconds are treated as missing. any
+    database errors are logged and treated as a miss, as are
+    values that weren't signed with secret.
+
+    when each entry was last used is written every touch_every
+    hits (and before evicting), rather than on every one.
+    """
+    evict_every = 50
+    touch_every = 50
+
+    def __init__(self, path, name, max_items=1000, max_bytes=None, ttl=None,
+            secret=''):
+        self.path = path
+        self.name = name
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        if isinstance(secret, unicode):
+            secret = secret.encode('utf-8')
+        self.secret = secret
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._sets = 0
+        self._used = {}
+        self._touches = 0
+        self._used_lock = threading.Lock()
+        self._local = threading.local()
+
+    def get(self, key):
+        """
+        return the value for key, or None if it is not cached
+        """
+        try:
+            connection = self._connect()
+            row = connection.execute('SELECT value, stored FROM cache '
+                'WHERE name = ? AND key = ?', (self.name, _key(key))).fetchone()
+            if row is None or (self.ttl and time.time() - row[1] > self.ttl):
+                self.misses += 1
+                return None
+            value = self._verify(str(row[0]))
+            if value is None:
+                logging.warn('tw_pages: %s cache has an unsigned value, '
+                    'ignoring it', self.name)
+                self.misses += 1
+                return None
+            self._touch(connection, _key(key))
+            self.hits += 1
+            return pickle.loads(value)
+        except (sqlite3.Error, pickle.UnpicklingError), exc:
+            logging.warn('tw_pages: %s cache get failed: %s', self.name, exc)
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        """
+        store value under key, evicting the least recently
+        used entries if the cache is full
+        """
+        value = self._sign(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        if self.max_bytes and len(value) > self.max_bytes:
+            return
+        now = time.time()
+        try:
+            connection = self._connect()
+            connection.execute('INSERT OR REPLACE INTO cache (name, key, value, '
+                'size, stored, used) VALUES (?, ?, ?, ?, ?, ?)', (self.name,
+                _key(key), sqlite3.Binary(value), len(value), now, now))
+            connection.commit()
+            self._sets += 1
+            if self._sets % self.evict_every == 0:
+                self._evict(connection)
+        except sqlite3.Error, exc:
+            logging.warn('tw_pages: %s cache set failed: %s', self.name, exc)
+
+    def _sign(self, value):
+        return hmac.new(self.secret, value, hashlib.sha1).digest() + value
+
+    def _verify(self, signed):
+        """
+        return the value in signed, or None if it wasn't
+        signed with our secret
+        """
+        size = hashlib.sha1().digest_size
+        signature, value = signed[:size], signed[size:]
+        if hmac.new(self.secret, value, hashlib.sha1).digest() != signature:
+            return None
+        return value
+
+    def _touch(self, connection, key):
+        """
+        note that key has been used, writing when every noted
+        key was last used every touch_every hits
+        """
+        self._used_lock.acquire()
+        try:
+            self._used[key] = time.time()
+            self._touches += 1
+            if self._touches < self.touch_every:
+                return
+            self._touches = 0
+        finally:
+            self._used_lock.release()
+        self._write_used(connection)
+
+    def _write_used(self, connection):
+        self._used_lock.acquire()
+        try:
+            used, self._used = self._used, {}
+        finally:
+            self._used_lock.release()
+        if used:
+            connection.executemany('UPDATE cache SET used = ? WHERE '
+                'name = ? AND key = ?', [(when, self.name, key)
+                for key, when in used.items()])
+            connection.commit()
+
+    def _evict(self, connection):
+        """
+        remove the least recently used entries until the
+        cache is within its bounds
+        """
+        self._write_used(connection)
+        items, total = connection.execute('SELECT COUNT(*), SUM(size) FROM '
+            'cache WHERE name = ?', (self.name,)).fetchone()
+        total = total or 0
+        excess = max(items - self.max_items, 0)
+        if self.max_bytes and total > self.max_bytes:
+            #count how many of the oldest entries it takes to get back under max_bytes
+            dropped = 0
+            needed = 0
+            for size, in connection.execute('SELECT size FROM cache WHERE '
+                    'name = ? ORDER BY used', (self.name,)):
+                if total - dropped <= self.max_bytes:
+                    break
+                dropped += size
+                needed += 1
+            excess = max(excess, needed)
+        if excess:
+            connection.execute('DELETE FROM cache WHERE name = ? AND key IN '
+                '(SELECT key FROM cache WHERE name = ? ORDER BY used LIMIT ?)',
+                (self.name, self.name, excess))
+            connection.commit()
+            self.evictions += excess
+
+    def clear(self):
+        """
+        empty the cache
+        """
+        try:
+            connection = self._connect()
+            connection.execute('DELETE FROM cache WHERE name = ?', (self.name,))
+            connection.commit()
+        except sqlite3.Error, exc:
+            logging.warn('tw_pages: %s cache clear failed: %s', self.name, exc)
+
+    def stats(self):
+        """
+        return a dict of statistics about the cache. items and 
+        bytes are for every process, the rest for this one.
+        """
+        try:
+            items, total = self._connect().execute('SELECT COUNT(*), '
+                'SUM(size) FROM cache WHERE name = ?', (self.name,)).fetchone()
+        except sqlite3.Error:
+            items, total = None, None
+        return {
+            'items': items,
+            'bytes': total or 0,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+    def _connect(self):
+        return _connect(self.path, self._local)
+
+
+class MemoryGenerations(object):
+    """
+    bag generations kept in this process
+    """
+    def __init__(self):
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        return self._generations.get(name, 0)
+
+    def bump(self, name):
+        self._lock.acquire()
+        try:
+            self._generations[name] = self._generations.get(name, 0) + 1
+        finally:
+            self._lock.release()
+
+
+class SQLiteGenerations(object):
+    """
+    bag generations kept in an SQLite database, so that
+    every process sees changes made by the others
+    """
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def get(self, name):
+        try:
+            row = _connect(self.path, self._local).execute('SELECT generation '
+                'FROM generations WHERE name = ?', (name,)).fetchone()
+        except sqlite3.Error, exc:
+            logging.warn('tw_pages: unable to read generation of %s: %s', name, exc)
+            #something that won't match any cached fragment
+            return time.time()
+        return row and row[0] or 0
+
+    def bump(self, name):
+        try:
+            connection = _connect(self.path, self._local)
+            connection.execute('INSERT OR IGNORE INTO generations (name, '
+                'generation) VALUES (?, 0)', (name,))
+            connection.execute('UPDATE generations SET generation = '
+                'generation + 1 WHERE name = ?', (name,))
+            connection.commit()
+        except sqlite3.Error, exc:
+            logging.warn('tw_pages: unable to bump generation of %s: %s', name, exc)
+
+
+def _key(key):
+    """
+    turn a cache key into a string that is the
+    same in every process
+    """
+    return sha(repr(key)).hexdigest()
+
+
+def _connect(path, local):
+    """
+    return the connection to the database at path for this
+    thread (and process), creating the tables if need be
+    """
+    connection = getattr(local, 'connection', None)
+    if connection is None or local.pid != os.getpid():
+        #cached values are pickled, so keep other users out of the file
+        os.close(os.open(path, os.O_CREAT | os.O_RDWR, 0600))
+        connection = sqlite3.connect(path, timeout=5)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('CREATE TABLE IF NOT EXISTS cache (name TEXT, '
+            'key TEXT, value BLOB, size INTEGER, stored REAL, used REAL, '
+            'PRIMARY KEY (name, key))')
+        connection.execute('CREATE INDEX IF NOT EXISTS cache_used ON '
+            'cache (name, used)')
+        connection.execute('CREATE TABLE IF NOT EXISTS generations '
+            '(name TEXT PRIMARY KEY, generation INTEGER)')
+        connection.commit()
+        local.connection = connection
+        local.pid = os.getpid()
+    return connection
+
+
+def get_cache(config, name, max_items=1000, max_bytes=None, ttl=None, 
+        sizeof=len):
+    """
+    return the named cache for this process, creating it
+    with the configured backend if necessary. sizeof is only 
+    used by the memory backend (sqlite uses the pickled size).
+    """
+    caches = config.setdefault('tw_pages_caches', {})
+    try:
+        return caches[name]
+    except KeyError:
+        pass
+    _backend_lock.acquire()
+    try:
+        if name not in caches:
+            tw_pages = config.get('tw_pages', {})
+            if tw_pages.get('cache_backend') == 'sqlite':
+                caches[name] = SQLiteCache(cache_path(config), name,
+                    max_items, max_bytes, ttl, config.get('secret', ''))
+            else:
+                caches[name] = LRUCache(max_items, max_bytes, ttl, sizeof)
+        return caches[name]
+    finally:
+        _backend_lock.release()
+
+
+def cache_path(config):
+    """
+    return the path of the sqlite file used by the sqlite
+    backend. raises ValueError if it isn't set.
+    """
+    path = config.get('tw_pages', {}).get('cache_path')
+    if not path:
+        raise ValueError("tw_pages: 'cache_backend' is 'sqlite' but "
+            "'cache_path' is not set")
+    return path
+
+
+def check_backend(config):
+    """
+    make sure the configured cache backend can be used,
+    so that any problem shows up when the app is loaded
+    rather than on a request. raises ValueError if not.
+    """
+    tw_pages = config.get('tw_pages', {})
+    backend = tw_pages.get('cache_backend') or 'memory'
+    if backend not in ('memory', 'sqlite'):
+        raise ValueError("tw_pages: unknown 'cache_backend' %r" % backend)
+    if backend == 'sqlite':
+        path = cache_path(config)
+        try:
+            _connect(path, threading.local())
+        except (OSError, sqlite3.Error), exc:
+            raise ValueError('tw_pages: unable to use %s as the cache: %s' %
+                (path, exc))
+
+
+def cache_stats(config):
+    """
+    return a dict of the statistics of each cache in use
+    """
+    stats = {}
+    for name, cache in config.get('tw_pages_caches', {}).items():
+        stats[name] = cache.stats()
+        stats[name]['backend'] = cache.__class__.__name__
+    return stats
+
+
+def get_fragment_cache(config):
+    """
+    return the fragment cache, creating it if necessary
+    """
+    tw_pages = config['tw_pages']
+    return get_cache(config, 'fragments',
+        max_items=tw_pages.get('fragment_cache_size', 500),
+        max_bytes=tw_pages.get('fragment_cache_bytes'),
+        ttl=tw_pages.get('fragment_cache_ttl'),
+        sizeof=lambda fragment: len(fragment[0]))
+
+
+def get_generations(config):
+    """
+    return where bag generations are kept,
+    creating it if necessary
+    """
+    try:
+        return config['tw_pages_generations']
+    except KeyError:
+        tw_pages = config['tw_pages']
+        if tw_pages.get('cache_backend') == 'sqlite':
+            generations = SQLiteGenerations(cache_path(config))
+        else:
+            generations = MemoryGenerations()
+        return config.setdefault('tw_pages_generations', generations)
+
+
+def bag_generation(config, bag_name):
+    """
+    return the current generation of the named bag
+    """
+    return get_generations(config).get(bag_name)
+
+
+def bag_changed(config, bag_name):
+    """
+    bump the generation of the named bag
+    """
+    get_generations(config).bump(bag_name)
+
+
+def _tiddler_hook(store, tiddler):
+    bag_changed(store.environ['tiddlyweb.config'], tiddler.bag)
+
+
+def _bag_hook(store, bag):
+    bag_changed(store.environ['tiddlyweb.config'], bag.name)
+
+
+def register_hooks():
+    """
+    ask the store to tell us whenever a bag or tiddler changes
+    """
+    if _hooks_registered:
+        return
+    HOOKS['tiddler']['put'].append(_tiddler_hook)
+    HOOKS['tiddler']['delete'].append(_tiddler_hook)
+    HOOKS['bag']['put'].append(_bag_hook)
+    HOOKS['bag']['delete'].append(_bag_hook)
+    _hooks_registered.append(True)
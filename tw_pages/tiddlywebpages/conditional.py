@@ -0,0 +1,77 @@
+"""
+Conditional GET (ETag and 304 Not Modified) for rendered pages
+
+The ETag of a page is made from the templates, the tiddlers the
+page was made from, and every recipe, bag and tiddler read while
+rendering it (including in sub-templates). Those reads are
+remembered for each page, so the next time it is requested the
+ETag can be worked out, and a 304 sent, without rendering it.
+"""
+from tiddlywebpages.cache import get_cache
+
+from tiddlyweb.util import sha
+
+
+def get_dependency_cache(config):
+    """
+    return the cache of what each page depends on,
+    creating it if necessary
+    """
+    return get_cache(config, 'dependencies',
+        max_items=config['tw_pages'].get('dependency_cache_size', 2000))
+
+
+def dependency_key(environ, plugin_name):
+    """
+    return the key to remember the dependencies
+    of the page being rendered under
+    """
+    usersign = environ.get('tiddlyweb.usersign', {}).get('name')
+    return (environ.get('SCRIPT_NAME', ''), environ.get('PATH_INFO', ''),
+        environ.get('QUERY_STRING', ''), plugin_name, usersign)
+
+
+def make_etag(environ, plugin_name, dependencies, base_tiddlers):
+    """
+    return the ETag for a page made from base_tiddlers with
+    plugin_name, that read dependencies (a dict of store cache
+    key: fingerprint) while it was being rendered.
+    """
+    base = [(tiddler.bag, tiddler.title,
+        getattr(tiddler, 'revision', None) or tiddler.modified)
+        for tiddler in base_tiddlers]
+    usersign = environ.get('tiddlyweb.usersign', {}).get('name')
+    digest = sha(repr((
+        plugin_name,
+        usersign,
+        environ['tiddlyweb.config'].get('tw_pages_fingerprint'),
+        sorted(dependencies.items()),
+        base)))
+    return '"%s"' % digest.hexdigest()
+
+
+def etag_matches(environ, etag):
+    """
+    return True if the browser already has the page with etag
+    """
+    incoming = environ.get('HTTP_IF_NONE_MATCH', '')
+    return etag in [value.strip() for value in incoming.split(',')]
+
+
+class ETagHeader(object):
+    """
+    WSGI middleware that sets the ETag header of
+    a response to the one worked out for the page
+    """
+    def __init__(self, application):
+        self.application = application
+
+    def __call__(self, environ, start_response):
+        def etag_start_response(status, headers, exc_info=None):
+            etag = environ.get('tw_pages.etag')
+            if etag:
+                headers = [(name, value) for name, value in headers
+                    if name.lower() != 'etag']
+                headers.append(('ETag', etag))
+            return start_response(status, headers, exc_info)
+        return self.application(environ, etag_start_response)
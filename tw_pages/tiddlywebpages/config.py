@@ -7,6 +7,30 @@ eg - the bag that templates belong in
 config={
     'tw_pages': {
         'template_bag': 'templates',
-        'filters': []
+        'filters': [],
+        'template_cache_size': 400,
+        'bytecode_cache': None,
+        'reload_interval': 10,
+        'fragment_cache': False,
+        'fragment_cache_size': 500,
+        'fragment_cache_bytes': 10 * 1024 * 1024,
+        'fragment_cache_ttl': 60,
+        'render_threads': 4,
+        'fragment_timeout': 10,
+        'stream': False,
+        'conditional_get': True,
+        'dependency_cache_size': 2000,
+        'wikify_cache_size': 1000,
+        'wikify_cache_bytes': 20 * 1024 * 1024,
+        'wikify_cache_dir': None,
+        'wikify_cache_dir_size': 10000,
+        'wikify_cache_dir_bytes': 100 * 1024 * 1024,
+        'metadata_cache': None,
+        'profile': False,
+        'profile_samples': 200,
+        'filter_index': False,
+        'filter_index_ttl': 60,
+        'cache_backend': 'memory',
+        'cache_path': None
     }
 }
\ No newline at end of file
@@ -0,0 +1,342 @@
+"""
+Export tw_pages sites as static files
+
+Adds a twanager command that renders every page of each bag and
+recipe in tw_pages_config to a directory, so that a web server can
+serve them without going through TiddlyWeb:
+
+    <directory>/recipes/<name>/tiddlers.html
+    <directory>/recipes/<name>/tiddlers/<title>.html
+    <directory>/bags/<name>/tiddlers.<extension>
+    ...
+
+Files are named with the (utf-8) name or title as it is, so that a
+web server finds them from the percent-encoded links in the pages,
+except that / is written as %2F.
+
+Pages are rendered in parallel across processes. What each page
+depended on is kept in <directory>/.twpexport, so exporting to the
+same directory again only re-renders pages that have changed.
+
+To use, add 'tiddlywebpages.export' to twanager_plugins in
+tiddlywebconfig.py.
+"""
+from tiddlywebpages import load_templates
+from tiddlywebpages.config import config as twp_config
+from tiddlywebpages.serialization import Serialization
+from tiddlywebpages.conditional import get_dependency_cache, dependency_key
+
+from tiddlyweb import control
+from tiddlyweb.manage import make_command
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.recipe import Recipe
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import NoBagError, NoRecipeError
+from tiddlyweb.util import merge_config
+from tiddlyweb.web.http import HTTP304
+
+from tiddlywebplugins.utils import get_store
+
+from multiprocessing import Pool, cpu_count
+import simplejson as json
+import urllib
+import logging
+import sys
+import os
+
+MANIFEST = '.twpexport'
+_worker = {}
+
+
+@make_command()
+def twpexport(args):
+    """render tw_pages sites to static files. <directory> [--processes=N] [--ext=<extension>,...] [--all-extensions] [--full] [<bag or recipe> ...]"""
+    options, names = _parse_args(args)
+    if not names:
+        print >> sys.stderr, ('usage: twanager twpexport <directory> '
+            '[--processes=N] [--ext=<extension>,...] [--all-extensions] '
+            '[--full] [<bag or recipe> ...]')
+        return
+    directory = names.pop(0)
+
+    _setup()
+    store = get_store(config)
+    if options['all_extensions']:
+        options['extensions'] = [name for name in config['tw_pages_serializers']
+            if name != 'Default']
+    manifest = {}
+    if not options['full']:
+        manifest = _read_manifest(directory)
+
+    jobs = []
+    for container in names or config.get('tw_pages_config', {}).keys():
+        for page in _container_pages(store, container):
+            for extension in [None] + options['extensions']:
+                path = _page_path(page, extension)
+                jobs.append((page, extension, path, manifest.get(path)))
+
+    pool = Pool(options['processes'], _init_worker)
+    new_manifest = {}
+    rendered = unchanged = failed = 0
+    for path, entry, error in pool.imap_unordered(_export_page, jobs, 10):
+        if error:
+            failed += 1
+            print >> sys.stderr, ('%s failed: %s' % (path.encode('utf-8'),
+                error))
+            #keep the page from the last export, rather than removing it
+            if path in manifest:
+                new_manifest[path] = manifest[path]
+            continue
+        if entry:
+            rendered += 1
+            _write_page(directory, path, entry.pop('content'))
+            new_manifest[path] = entry
+        else:
+            unchanged += 1
+            new_manifest[path] = manifest[path]
+    pool.close()
+    pool.join()
+
+    #remove pages for things that no longer exist
+    for path in set(manifest) - set(new_manifest):
+        try:
+            os.remove(os.path.join(directory, path.encode('utf-8')))
+        except OSError:
+            pass
+    _write_manifest(directory, new_manifest)
+    print >> sys.stderr, ('%d pages rendered, %d unchanged, %d failed' %
+        (rendered, unchanged, failed))
+
+
+def _parse_args(args):
+    """
+    split args into a dict of --options and a list of names
+    """
+    options = {'processes': cpu_count(), 'extensions': [],
+        'all_extensions': False, 'full': False}
+    names = []
+    for arg in args:
+        if arg.startswith('--processes='):
+            options['processes'] = int(arg.split('=', 1)[1])
+        elif arg.startswith('--ext='):
+            options['extensions'] = arg.split('=', 1)[1].split(',')
+        elif arg == '--all-extensions':
+            options['all_extensions'] = True
+        elif arg == '--full':
+            options['full'] = True
+        else:
+            names.append(arg)
+    return options, names
+
+
+def _setup():
+    """
+    load the templates, and make sure pages record
+    what they depend on
+    """
+    merge_config(config, twp_config)
+    config['tw_pages']['conditional_get'] = True
+    config['tw_pages']['stream'] = False
+    load_templates(config)
+
+
+def _container_pages(store, name):
+    """
+    yield a page for the list of tiddlers in the named recipe
+    (or bag), followed by one for each tiddler in it.
+
+    a page is (container type, container name, tiddler title)
+    """
+    environ = _make_environ(store)
+    try:
+        recipe = store.get(Recipe(name))
+        tiddlers = control.get_tiddlers_from_recipe(recipe, environ)
+        container_type = 'recipes'
+    except NoRecipeError:
+        try:
+            bag = store.get(Bag(name))
+        except NoBagError:
+            logging.warn('twpexport: %s is not a recipe or a bag', name)
+            return
+        tiddlers = control.get_tiddlers_from_bag(bag)
+        container_type = 'bags'
+    yield (container_type, name, None)
+    for tiddler in tiddlers:
+        yield (container_type, name, tiddler.title)
+
+
+def _page_path(page, extension):
+    """
+    return the path, relative to the export directory,
+    of a page rendered with extension, as unicode
+    """
+    container_type, name, title = page
+    suffix = u'.%s' % (extension or 'html')
+    if title is None:
+        filename = u'tiddlers%s' % suffix
+    else:
+        filename = u'tiddlers/%s%s' % (_filename(title), suffix)
+    return u'%s/%s/%s' % (container_type, _filename(name), filename)
+
+
+def _page_url(page, extension):
+    """
+    return the percent-encoded path, without a leading /,
+    that a page rendered with extension is linked to by
+    """
+    container_type, name, title = page
+    url = '%s/%s/tiddlers' % (container_type, _quote(name))
+    if title is not None:
+        url = '%s/%s' % (url, _quote(title))
+    if extension:
+        url = '%s.%s' % (url, extension)
+    return url
+
+
+def _filename(name):
+    """
+    make name safe to use as a single part of a path
+    """
+    if not isinstance(name, unicode):
+        name = name.decode('utf-8')
+    name = name.replace(u'/', u'%2F')
+    if name in (u'.', u'..'):
+        name = name.replace(u'.', u'%2E')
+    return name
+
+
+def _quote(name):
+    if isinstance(name, unicode):
+        name = name.encode('utf-8')
+    return urllib.quote(name, safe='')
+
+
+def _make_environ(store, path='', extension=None, page=None):
+    """
+    return the environ for rendering a page outside of a request,
+    with the routing a request for page would have had
+    """
+    recipe_template = {}
+    if page:
+        container_type, name, title = page
+        recipe_template[container_type[:-1]] = name
+        if title is not None:
+            recipe_template['tiddler'] = title
+    return {
+        'tiddlyweb.config': config,
+        'tiddlyweb.store': store,
+        'tiddlyweb.usersign': {'name': 'GUEST', 'roles': []},
+        'tiddlyweb.recipe_template': recipe_template,
+        'tiddlyweb.extension': extension,
+        'tiddlyweb.query': {},
+        'selector.matches': ['/%s' % path],
+        'PATH_INFO': '/%s' % path,
+        'SCRIPT_NAME': '',
+        'QUERY_STRING': ''
+    }
+
+
+def _init_worker():
+    """
+    give each process its own store
+    """
+    _worker['store'] = get_store(config)
+
+
+def _export_page(job):
+    """
+    render a page, unless it is unchanged since it was last
+    exported. returns (path, manifest entry, error), where the
+    entry is None if the page is unchanged.
+    """
+    page, extension, path, previous = job
+    container_type, name, title = page
+    store = _worker['store']
+    environ = _make_environ(store, _page_url(page, extension), extension, page)
+    if previous:
+        #ask for the page as if we already have it, and let the
+        #serializer decide whether it has changed
+        key = dependency_key(environ, previous['plugin'])
+        get_dependency_cache(config).set(key,
+            tuple(tuple(dependency) for dependency in previous['dependencies']))
+        environ['HTTP_IF_NONE_MATCH'] = previous['etag']
+    try:
+        serialization = Serialization(environ)
+        if title is None:
+            bag = Bag('tmpbag', tmpbag=True)
+            if container_type == 'recipes':
+                recipe = store.get(Recipe(name))
+                bag.add_tiddlers(control.get_tiddlers_from_recipe(recipe, environ))
+            else:
+                bag.add_tiddlers(control.get_tiddlers_from_bag(store.get(Bag(name))))
+            content = serialization.list_tiddlers(bag)
+        else:
+            tiddler = Tiddler(title)
+            if container_type == 'recipes':
+                recipe = store.get(Recipe(name))
+                tiddler.bag = control.determine_tiddler_bag_from_recipe(recipe,
+                    tiddler, environ).name
+                tiddler = store.get(tiddler)
+                tiddler.recipe = name
+            else:
+                tiddler.bag = name
+                tiddler = store.get(tiddler)
+            content = serialization.tiddler_as(tiddler)
+    except HTTP304:
+        return path, None, None
+    except Exception, exc:
+        logging.exception('twpexport: failed to render %s', path)
+        return path, None, str(exc)
+
+    if isinstance(content, unicode):
+        content = content.encode('utf-8')
+    elif not isinstance(content, str):
+        content = ''.join(content)
+    entry = {
+        'content': content,
+        'plugin': serialization.plugin_name,
+        'etag': environ.get('tw_pages.etag'),
+        'dependencies': list(serialization.store.dependencies)
+    }
+    return path, entry, None
+
+
+def _write_page(directory, path, content):
+    path = os.path.join(directory, path.encode('utf-8'))
+    try:
+        os.makedirs(os.path.dirname(path))
+    except OSError:
+        pass
+    page_file = open(path, 'w')
+    try:
+        page_file.write(content)
+    finally:
+        page_file.close()
+
+
+def _read_manifest(directory):
+    try:
+        manifest_file = open(os.path.join(directory, MANIFEST))
+    except IOError:
+        return {}
+    try:
+        return json.load(manifest_file)
+    finally:
+        manifest_file.close()
+
+
+def _write_manifest(directory, manifest):
+    try:
+        os.makedirs(directory)
+    except OSError:
+        pass
+    manifest_file = open(os.path.join(directory, MANIFEST), 'w')
+    try:
+        json.dump(manifest, manifest_file)
+    finally:
+        manifest_file.close()
+
+
+def init(config_in):
+    global config
+    config = config_in
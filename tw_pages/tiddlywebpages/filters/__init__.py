@@ -3,10 +3,23 @@ TiddlyWebPages
 
 by Ben Gillies
 """
-from shorten import shorten
-from wikifier import wikifier
+
+def lazy_filter(module_name, function_name):
+    """
+    return a filter that only imports module_name
+    (and looks up function_name in it) when it is
+    first used
+    """
+    loaded = []
+    def filter_func(*args, **kwargs):
+        if not loaded:
+            module = __import__(module_name, {}, {}, [function_name])
+            loaded.append(getattr(module, function_name))
+        return loaded[0](*args, **kwargs)
+    filter_func.__name__ = function_name
+    return filter_func
 
 TW_PAGES_FILTERS=[
-    ('wikified', wikifier),
-    ('shorten', shorten)
-    ]
\ No newline at end of file
+    ('wikified', lazy_filter('tiddlywebpages.filters.wikifier', 'wikifier')),
+    ('shorten', lazy_filter('tiddlywebpages.filters.shorten', 'shorten'))
+    ]
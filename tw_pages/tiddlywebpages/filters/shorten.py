@@ -1,6 +1,84 @@
-from BeautifulSoup import BeautifulSoup
+"""
+Shorten a piece of HTML to a number of visible characters
 
-def shorten(mystr, count):
-    shortened_str = mystr[0:count]
-    soup = BeautifulSoup(shortened_str)
-    return soup.prettify()
\ No newline at end of file
+Works through the string once, counting only text (an entity
+counts as one character) and keeping track of which tags are
+open, so that they can be closed where the string is cut.
+"""
+import re
+
+TOKEN_RE = re.compile(r'<!--.*?-->|<(/?)([a-zA-Z][\w:-]*)[^>]*>|&#?\w+;', re.DOTALL)
+WHITESPACE_RE = re.compile(r'\s')
+VOID_TAGS = set(['area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+    'link', 'meta', 'param', 'source', 'wbr'])
+
+def shorten(mystr, count, words=False, end=u''):
+    """
+    return mystr cut down to count visible characters, with
+    any tags that were open at that point closed.
+
+    if words is True, the string is cut at the end of the last
+    whole word. end (eg - an ellipsis) is added if anything was
+    cut off.
+    """
+    output = []
+    open_tags = []
+    remaining = count
+    position = 0
+    cut = False
+    for match in TOKEN_RE.finditer(mystr):
+        text = mystr[position:match.start()]
+        if len(text) > remaining or (text and remaining == 0):
+            output.append(_cut_text(text, remaining, words, remaining < count))
+            cut = True
+            break
+        output.append(text)
+        remaining -= len(text)
+        position = match.end()
+
+        token = match.group(0)
+        if token.startswith('&'):
+            if remaining == 0:
+                cut = True
+                break
+            remaining -= 1
+        elif match.group(2):
+            name = match.group(2).lower()
+            if match.group(1):
+                if name in open_tags:
+                    #close it, along with anything left open inside it
+                    del open_tags[len(open_tags) - 1 - open_tags[::-1].index(name):]
+            elif remaining == 0:
+                cut = True
+                break
+            elif name not in VOID_TAGS and not token.endswith('/>'):
+                open_tags.append(name)
+        output.append(token)
+    else:
+        text = mystr[position:]
+        if len(text) > remaining:
+            output.append(_cut_text(text, remaining, words, remaining < count))
+            cut = True
+        else:
+            output.append(text)
+
+    if cut:
+        output.append(end)
+    output.extend('</%s>' % name for name in reversed(open_tags))
+    return u''.join(output)
+
+def _cut_text(text, length, words, after_text):
+    """
+    return the first length characters of text. if words is True
+    and that splits a word, drop the partial word (unless there
+    is nothing before it to keep instead).
+    """
+    piece = text[:length]
+    if not words or WHITESPACE_RE.match(text[length:length + 1]):
+        return piece
+    boundary = max(piece.rfind(' '), piece.rfind('\n'), piece.rfind('\t'))
+    if boundary >= 0:
+        return piece[:boundary]
+    if after_text:
+        return u''
+    return piece
@@ -1,6 +1,34 @@
+"""
+Render wikitext to HTML in templates
+
+The same tiddler text is often wikified on every page view,
+so rendered HTML is cached, keyed by a hash of the text, the
+path and the wikitext renderer config. The cache is shared by
+every request in the process (or every process, with the sqlite
+cache_backend) and, if 'wikify_cache_dir' is set in the tw_pages
+config, kept on disk as well so it survives restarts. The files
+on disk are bounded by 'wikify_cache_dir_size' (the number of files)
+and 'wikify_cache_dir_bytes', with the least recently used removed
+first.
+"""
+from tiddlywebpages.cache import get_cache
+
 from tiddlyweb.wikitext import render_wikitext
 from tiddlyweb.config import config
 from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.util import sha
+
+import logging
+import time
+import os
+
+DISK_STATS = {'hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0}
+#how many files are written between checks of the size of the directory
+PRUNE_EVERY = 100
+#what the directory is pruned down to, as a fraction of its limits
+PRUNE_TO = 0.9
+#temporary files older than this (in seconds) were left by a crash
+STALE_TEMP_AGE = 3600
 
 def wikifier(mystr, path):
     """
@@ -8,8 +36,148 @@ def wikifier(mystr, path):
     string to HTML. This function taken and modified
     from wikklytextrender.py
     """
-    tiddler = Tiddler('tmp')
-    tiddler.text = mystr
-    tiddler.recipe = path
-    environ={'tiddlyweb.config': config}
-    return render_wikitext(tiddler, environ)
\ No newline at end of file
+    key = _cache_key(mystr, path)
+    cache = _get_cache()
+    html = cache.get(key)
+    if html is None:
+        html = _read_disk(key)
+        if html is None:
+            tiddler = Tiddler('tmp')
+            tiddler.text = mystr
+            tiddler.recipe = path
+            environ={'tiddlyweb.config': config}
+            html = render_wikitext(tiddler, environ)
+            _write_disk(key, html)
+        cache.set(key, html)
+    return html
+
+def wikify_stats():
+    """
+    return a dict of statistics about the wikified HTML cache
+    """
+    stats = _get_cache().stats()
+    stats['disk_hits'] = DISK_STATS['hits']
+    stats['disk_misses'] = DISK_STATS['misses']
+    stats['disk_evictions'] = DISK_STATS['evictions']
+    return stats
+
+def _cache_key(mystr, path):
+    """
+    return a hash of everything the rendered HTML depends on
+    """
+    renderers = (config.get('wikitext.default_renderer'),
+        config.get('wikitext.type_render_map'))
+    if isinstance(mystr, unicode):
+        mystr = mystr.encode('utf-8')
+    return sha(repr((sha(mystr).hexdigest(), path, renderers))).hexdigest()
+
+def _get_cache():
+    """
+    return the cache, creating it if necessary
+    """
+    tw_pages = config.get('tw_pages', {})
+    return get_cache(config, 'wikify',
+        max_items=tw_pages.get('wikify_cache_size', 1000),
+        max_bytes=tw_pages.get('wikify_cache_bytes'))
+
+def _disk_path(key):
+    directory = config.get('tw_pages', {}).get('wikify_cache_dir')
+    if directory:
+        return os.path.join(directory, '%s.html' % key)
+    return None
+
+def _read_disk(key):
+    """
+    return the HTML stored on disk for key, or None
+    """
+    path = _disk_path(key)
+    if not path:
+        return None
+    try:
+        disk_file = open(path)
+        try:
+            html = disk_file.read().decode('utf-8')
+        finally:
+            disk_file.close()
+        #mark it as recently used, so it is pruned last
+        os.utime(path, None)
+    except (IOError, OSError):
+        DISK_STATS['misses'] += 1
+        return None
+    DISK_STATS['hits'] += 1
+    return html
+
+def _write_disk(key, html):
+    """
+    store html on disk for key, if there is a directory to
+    store it in. written to a temporary file first, so other
+    processes never see half of it.
+    """
+    path = _disk_path(key)
+    if not path:
+        return
+    temp_path = '%s.%s.tmp' % (path, os.getpid())
+    try:
+        disk_file = open(temp_path, 'w')
+        try:
+            disk_file.write(html.encode('utf-8'))
+        finally:
+            disk_file.close()
+        os.rename(temp_path, path)
+    except (IOError, OSError):
+        return
+    DISK_STATS['writes'] += 1
+    if DISK_STATS['writes'] % PRUNE_EVERY == 0:
+        _prune_disk(os.path.dirname(path))
+
+def _prune_disk(directory):
+    """
+    remove the least recently used files from directory
+    until it is back within its limits
+    """
+    tw_pages = config.get('tw_pages', {})
+    max_files = tw_pages.get('wikify_cache_dir_size')
+    max_bytes = tw_pages.get('wikify_cache_dir_bytes')
+    now = time.time()
+    files = []
+    total = 0
+    try:
+        names = os.listdir(directory)
+    except OSError, exc:
+        logging.warn('tw_pages: unable to list %s: %s', directory, exc)
+        return
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            #removed by another process
+            continue
+        if name.endswith('.tmp'):
+            if now - stat.st_mtime > STALE_TEMP_AGE:
+                _remove(path)
+            continue
+        if name.endswith('.html'):
+            files.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+    if (not max_files or len(files) <= max_files) and \
+            (not max_bytes or total <= max_bytes):
+        return
+    files.sort()
+    count = len(files)
+    for used, size, path in files:
+        if (not max_files or count <= max_files * PRUNE_TO) and \
+                (not max_bytes or total <= max_bytes * PRUNE_TO):
+            break
+        if _remove(path):
+            DISK_STATS['evictions'] += 1
+        count -= 1
+        total -= size
+
+def _remove(path):
+    try:
+        os.remove(path)
+        return True
+    except OSError:
+        return False
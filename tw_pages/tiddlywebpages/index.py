@@ -0,0 +1,495 @@
+"""
+Answer sub-template queries from an index rather than the store
+
+A sub-template is given the tiddlers from recipe?filters, which
+normally means reading every tiddler in the recipe and filtering
+them afterwards. If 'filter_index' is set in the tw_pages config,
+everything but the text of every tiddler in each bag is kept
+in memory (an index) instead, and the filters at
+the start of the filter string that can be answered from them
+(select on an attribute or field, like, sort and limit) are run
+against the index, in the same way as tiddlyweb's filters. An attribute
+that a plugin has added to ATTRIBUTE_SELECTOR or ATTRIBUTE_SORT_KEY is
+left to the filters. Only the tiddlers that are left are read from the store, so
+"the latest 5 tiddlers tagged news" reads 5 tiddlers.
+
+Indexes are built the first time a bag is queried, kept up to date
+as tiddlers are changed in this process, and rebuilt after
+'filter_index_ttl' seconds to pick up changes made by others. Only
+one thread builds each index; while it is rebuilt, other requests
+use the old one.
+"""
+from tiddlywebpages.store_hooks import HOOKS
+
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.filters import FILTER_PARSERS, FilterError, \
+    parse_for_filters, recursive_filter
+from tiddlyweb.filters.select import ATTRIBUTE_SELECTOR, tag_in_tags, \
+    field_in_fields, default_func
+from tiddlyweb.filters.sort import ATTRIBUTE_SORT_KEY, date_to_canonical
+from tiddlyweb.store import NoTiddlerError
+from tiddlyweb.util import sha
+from tiddlyweb import control
+
+import threading
+import urllib
+import time
+import re
+
+INDEXES = {}
+#how tiddlyweb itself selects and sorts, which the index does too. an
+#attribute that a plugin has changed these for is left to the filters.
+NATIVE_SELECTORS = {'tag': tag_in_tags, 'field': field_in_fields}
+NATIVE_SORT_KEYS = {'modified': date_to_canonical,
+    'created': date_to_canonical}
+INDEXED_ATTRIBUTES = ('title', 'bag', 'tags', 'modified', 'created',
+    'modifier', 'creator', 'type', 'revision')
+#tiddler attributes that filters can't be answered from the index for
+UNINDEXED_ATTRIBUTES = tuple(attribute for attribute in Tiddler.slots
+    if attribute not in INDEXED_ATTRIBUTES)
+#attributes that aren't strings, so can't be sorted on or liked
+UNSORTED_ATTRIBUTES = ('tags', 'revision')
+
+_indexes_lock = threading.Lock()
+#indexes being built, by bag name, so that changes made meanwhile
+#reach them too
+_building = {}
+_build_locks = {}
+_hooks_registered = []
+
+
+class IndexEntry(object):
+    """
+    the indexed attributes of a tiddler
+    """
+    __slots__ = INDEXED_ATTRIBUTES + ('fields',)
+
+    def __init__(self, tiddler):
+        self.title = tiddler.title
+        self.bag = tiddler.bag
+        self.tags = list(tiddler.tags or [])
+        self.modified = tiddler.modified
+        self.created = getattr(tiddler, 'created', None)
+        self.modifier = tiddler.modifier
+        self.creator = getattr(tiddler, 'creator', None)
+        self.type = tiddler.type
+        self.fields = dict(tiddler.fields)
+        self.revision = tiddler.revision
+
+    def get(self, attribute):
+        """
+        return the value of an attribute or field, or
+        None if the tiddler doesn't have one
+        """
+        if attribute in INDEXED_ATTRIBUTES:
+            return getattr(self, attribute)
+        return self.fields.get(attribute)
+
+
+class BagIndex(object):
+    """
+    the IndexEntry of every tiddler in a bag, in the order
+    the store lists them
+    """
+    def __init__(self, bag_name, ttl=None):
+        self.bag_name = bag_name
+        self.ttl = ttl
+        self.built = time.time()
+        self.rebuilding = False
+        self._lock = threading.Lock()
+        self._fingerprint = None
+        self.entries = {}
+        self.order = []
+
+    def build(self, store):
+        """
+        index every tiddler in the bag. each is dropped (with
+        its text) as soon as it has been indexed.
+        """
+        bag = store.get(Bag(self.bag_name))
+        for tiddler in bag.list_tiddlers():
+            try:
+                tiddler = store.get(Tiddler(tiddler.title, self.bag_name))
+            except NoTiddlerError:
+                #deleted since the bag was listed
+                continue
+            self._lock.acquire()
+            try:
+                #anything changed meanwhile is newer than this
+                if tiddler.title not in self.entries:
+                    self.entries[tiddler.title] = IndexEntry(tiddler)
+                    self.order.append(tiddler.title)
+            finally:
+                self._lock.release()
+        self.built = time.time()
+
+    def expired(self):
+        return bool(self.ttl) and time.time() - self.built > self.ttl
+
+    def claim_rebuild(self):
+        """
+        return True if the calling thread should rebuild this
+        (expired) index, or False if another thread already is
+        """
+        self._lock.acquire()
+        try:
+            if self.rebuilding:
+                return False
+            self.rebuilding = True
+            return True
+        finally:
+            self._lock.release()
+
+    def list_entries(self):
+        """
+        return the entries in the order they were listed
+        """
+        self._lock.acquire()
+        try:
+            return [self.entries[title] for title in self.order]
+        finally:
+            self._lock.release()
+
+    def update(self, tiddler):
+        """
+        add or replace the entry for tiddler
+        """
+        self._lock.acquire()
+        try:
+            if tiddler.title not in self.entries:
+                self.order.append(tiddler.title)
+            self.entries[tiddler.title] = IndexEntry(tiddler)
+            self._fingerprint = None
+        finally:
+            self._lock.release()
+
+    def remove(self, title):
+        self._lock.acquire()
+        try:
+            if self.entries.pop(title, None) is not None:
+                self.order.remove(title)
+            self._fingerprint = None
+        finally:
+            self._lock.release()
+
+    def fingerprint(self):
+        """
+        return something that changes whenever any
+        tiddler in the bag does
+        """
+        if self._fingerprint is None:
+            entries = sorted((entry.title, entry.revision, entry.modified,
+                entry.tags, sorted(entry.fields.items()))
+                for entry in self.list_entries())
+            self._fingerprint = sha(repr(entries)).hexdigest()
+        return self._fingerprint
+
+
+def get_index(store, bag_name, ttl=None):
+    """
+    return the index of the named bag, building it if there
+    isn't one yet or the one there is has expired.
+
+    only one thread builds a bag's index. the first time, any
+    others wait for it; after that they use the expired index
+    until the new one is ready.
+    """
+    index = INDEXES.get(bag_name)
+    if index is None:
+        lock = _build_lock(bag_name)
+        lock.acquire()
+        try:
+            index = INDEXES.get(bag_name)
+            if index is None:
+                index = _build_index(store, bag_name, ttl)
+        finally:
+            lock.release()
+    elif index.expired() and index.claim_rebuild():
+        expired = index
+        try:
+            index = _build_index(store, bag_name, expired.ttl)
+        finally:
+            expired.rebuilding = False
+    return index
+
+
+def _build_lock(bag_name):
+    _indexes_lock.acquire()
+    try:
+        return _build_locks.setdefault(bag_name, threading.Lock())
+    finally:
+        _indexes_lock.release()
+
+
+def _build_index(store, bag_name, ttl):
+    """
+    build a new index of the named bag and put it in INDEXES
+    """
+    index = BagIndex(bag_name, ttl)
+    _indexes_lock.acquire()
+    try:
+        _building[bag_name] = index
+    finally:
+        _indexes_lock.release()
+    built = False
+    try:
+        index.build(store)
+        built = True
+    finally:
+        _indexes_lock.acquire()
+        try:
+            #unless the bag has changed meanwhile
+            if _building.get(bag_name) is index:
+                del _building[bag_name]
+                if built:
+                    INDEXES[bag_name] = index
+        finally:
+            _indexes_lock.release()
+    return index
+
+
+def index_fingerprint(store, bag_name):
+    """
+    return the fingerprint of the index of the named bag,
+    building it with the filter_index_ttl of the store's
+    config if there isn't one
+    """
+    config = getattr(store, 'environ', {}).get('tiddlyweb.config', {})
+    ttl = config.get('tw_pages', {}).get('filter_index_ttl')
+    return get_index(store, bag_name, ttl).fingerprint()
+
+
+def query_recipe(environ, recipe, filter_string=''):
+    """
+    return the tiddlers in recipe that match filter_string,
+    using the indexes for as much of it as possible
+    """
+    tw_pages = environ['tiddlyweb.config']['tw_pages']
+    if tw_pages.get('filter_index'):
+        steps, remaining = plan(filter_string)
+        bag_names = _recipe_bags(recipe)
+        if steps and bag_names is not None:
+            return _query_index(environ, recipe, bag_names, steps, remaining,
+                tw_pages.get('filter_index_ttl'))
+
+    tiddlers = control.get_tiddlers_from_recipe(recipe, environ)
+    if filter_string:
+        tiddlers = recursive_filter(parse_for_filters(filter_string)[0], tiddlers)
+    return tiddlers
+
+
+def plan(filter_string):
+    """
+    split filter_string into the steps that can be run against
+    the index, and the filter string for the rest of it.
+    """
+    filters = [part for part in re.split('[&;]', filter_string or '') if part]
+    steps = []
+    for position, part in enumerate(filters):
+        step = _plan_filter(part)
+        if step is None:
+            return steps, '&'.join(filters[position:])
+        steps.append(step)
+    return steps, ''
+
+
+def _plan_filter(part):
+    """
+    return the index step for a single name=value filter,
+    or None if it can't be run against the index.
+    """
+    if isinstance(part, unicode):
+        part = part.encode('utf-8')
+    try:
+        name, value = part.split('=', 1)
+        value = urllib.unquote(value).decode('utf-8')
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+    if name == 'limit':
+        try:
+            if ',' in value:
+                start, count = [int(number) for number in value.split(',', 1)]
+            else:
+                start, count = 0, int(value)
+        except ValueError:
+            return None
+        return ('limit', start, count)
+
+    if name == 'sort':
+        reverse = value.startswith('-')
+        attribute = value.lstrip('-')
+        if attribute in UNINDEXED_ATTRIBUTES + UNSORTED_ATTRIBUTES:
+            return None
+        if ATTRIBUTE_SORT_KEY.get(attribute) is not \
+                NATIVE_SORT_KEYS.get(attribute):
+            return None
+        return ('sort', attribute, reverse)
+
+    if name in ('select', 'like') and ':' in value:
+        attribute, match = value.split(':', 1)
+        if name == 'like' and 'like' not in FILTER_PARSERS:
+            return None
+        if attribute in UNINDEXED_ATTRIBUTES or match.startswith('<') or \
+                match.startswith('>'):
+            return None
+        if name == 'like' and attribute == 'revision':
+            return None
+        if name == 'select' and ATTRIBUTE_SELECTOR.get(attribute,
+                default_func) is not NATIVE_SELECTORS.get(attribute,
+                default_func):
+            return None
+        negate = match.startswith('!')
+        if negate:
+            match = match[1:]
+        limit = None
+        if name == 'like' and ',' in attribute:
+            attribute, limit = attribute.split(',', 1)
+            try:
+                limit = int(limit)
+            except ValueError:
+                return None
+        return (name, attribute, match, negate, limit)
+
+    return None
+
+
+def _recipe_bags(recipe):
+    """
+    return the names of the bags in recipe, or None if the
+    recipe can't be answered from the indexes (because it
+    filters its bags or uses variables in their names)
+    """
+    bag_names = []
+    for bag_name, bag_filter in recipe.get_recipe():
+        if bag_filter or '{{' in bag_name:
+            return None
+        bag_names.append(bag_name)
+    return bag_names
+
+
+def _query_index(environ, recipe, bag_names, steps, remaining, ttl):
+    store = environ['tiddlyweb.store']
+    #build indexes from the store itself, rather than through the request
+    raw_store = getattr(store, 'store', store)
+    entries = {}
+    order = []
+    for bag_name in bag_names:
+        index = get_index(raw_store, bag_name, ttl)
+        if hasattr(store, 'record'):
+            #the page depends on every tiddler that could have matched
+            store.record({('index', bag_name): index.fingerprint()})
+        for entry in index.list_entries():
+            if entry.title not in entries:
+                order.append(entry.title)
+            entries[entry.title] = entry
+
+    entries = [entries[title] for title in order]
+    for step in steps:
+        entries = STEPS[step[0]](entries, *step[1:])
+
+    tiddlers = []
+    for entry in entries:
+        tiddler = Tiddler(entry.title, entry.bag)
+        tiddler.recipe = recipe.name
+        tiddlers.append(tiddler)
+    if remaining:
+        #the rest of the filters need whole tiddlers
+        loaded = []
+        for tiddler in tiddlers:
+            tiddler = store.get(tiddler)
+            tiddler.recipe = recipe.name
+            loaded.append(tiddler)
+        return recursive_filter(parse_for_filters(remaining)[0], loaded)
+    return tiddlers
+
+
+def _select(entries, attribute, match, negate, limit):
+    if attribute == 'tag':
+        found = [entry for entry in entries if (match in entry.tags) != negate]
+    elif attribute == 'field':
+        found = [entry for entry in entries
+            if (match in entry.fields) != negate]
+    else:
+        found = [entry for entry in entries
+            if (entry.get(attribute) == match) != negate]
+    return found
+
+
+def _like(entries, attribute, match, negate, limit):
+    match = match.lower()
+    found = []
+    for entry in entries:
+        value = entry.get(attribute)
+        if attribute == 'tags':
+            matched = any(match in tag.lower() for tag in value)
+        else:
+            matched = isinstance(value, basestring) and match in value.lower()
+        if matched != negate:
+            found.append(entry)
+            if limit is not None and len(found) >= limit:
+                break
+    return found
+
+
+def _sort(entries, attribute, reverse):
+    #as tiddlyweb.filters.sort.sort_by_attribute
+    func = NATIVE_SORT_KEYS.get(attribute, lambda value: value.lower())
+    try:
+        return sorted(entries, key=lambda entry: func(entry.get(attribute)),
+            reverse=reverse)
+    except AttributeError, exc:
+        #a tiddler without the field, as recursive_filter reports it
+        raise FilterError('malformed filter: %s' % exc)
+
+
+def _limit(entries, start, count):
+    return entries[start:start + count]
+
+STEPS = {
+    'select': _select,
+    'like': _like,
+    'sort': _sort,
+    'limit': _limit
+}
+
+
+def _indexes_of(bag_name):
+    """
+    return the index of the named bag, and any being built
+    """
+    return [index for index in (INDEXES.get(bag_name),
+        _building.get(bag_name)) if index is not None]
+
+
+def _tiddler_put(store, tiddler):
+    for index in _indexes_of(tiddler.bag):
+        index.update(tiddler)
+
+
+def _tiddler_delete(store, tiddler):
+    for index in _indexes_of(tiddler.bag):
+        index.remove(tiddler.title)
+
+
+def _bag_changed(store, bag):
+    _indexes_lock.acquire()
+    try:
+        INDEXES.pop(bag.name, None)
+        _building.pop(bag.name, None)
+    finally:
+        _indexes_lock.release()
+
+
+def register_hooks():
+    """
+    keep the indexes up to date as tiddlers are changed
+    """
+    if _hooks_registered:
+        return
+    HOOKS['tiddler']['put'].append(_tiddler_put)
+    HOOKS['tiddler']['delete'].append(_tiddler_delete)
+    HOOKS['bag']['put'].append(_bag_changed)
+    HOOKS['bag']['delete'].append(_bag_changed)
+    _hooks_registered.append(True)
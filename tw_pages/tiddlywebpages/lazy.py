@@ -0,0 +1,146 @@
+"""
+Lazily loaded tiddlers for use in templates
+
+Templates are given a LazyTiddlers rather than a list of tiddlers.
+Tiddlers are only taken from the underlying listing as the template
+asks for them, so looping over (or slicing) the first few tiddlers
+of a large recipe doesn't read the rest of it.
+
+Each tiddler is wrapped in a LazyTiddler. Its title, bag and recipe
+come from the listing, and the rest of it (text, fields, tags, etc)
+is only read from the store when a template first uses it. Tiddlers
+read this way are remembered for the rest of the request.
+"""
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import NoTiddlerError
+
+LISTED_ATTRIBUTES = ('title', 'bag', 'recipe')
+
+
+def load_tiddler(environ, tiddler):
+    """
+    return the full tiddler from the store, reading it
+    at most once per request
+    """
+    memo = environ.setdefault('tw_pages.tiddlers', {})
+    key = (tiddler.bag, tiddler.title)
+    try:
+        return memo[key]
+    except KeyError:
+        pass
+    try:
+        loaded = environ['tiddlyweb.store'].get(Tiddler(tiddler.title, tiddler.bag))
+        if tiddler.recipe:
+            loaded.recipe = tiddler.recipe
+    except NoTiddlerError:
+        loaded = tiddler
+    memo[key] = loaded
+    return loaded
+
+
+def lazy_tiddlers(tiddlers, environ):
+    """
+    wrap tiddlers in a LazyTiddlers unless they already are
+    """
+    if isinstance(tiddlers, LazyTiddlers):
+        return tiddlers
+    return LazyTiddlers(tiddlers, environ)
+
+
+class LazyTiddler(object):
+    """
+    stands in for a tiddler, reading it from the store
+    the first time something not in the listing is used
+    """
+    def __init__(self, tiddler, environ):
+        self._tiddler = tiddler
+        self._environ = environ
+        self._loaded = bool(getattr(tiddler, 'store', None))
+
+    def __getattr__(self, name):
+        if name in LISTED_ATTRIBUTES:
+            return getattr(self._tiddler, name)
+        return getattr(self.load(), name)
+
+    def load(self):
+        """
+        return the full tiddler
+        """
+        if not self._loaded:
+            self._tiddler = load_tiddler(self._environ, self._tiddler)
+            self._loaded = True
+        return self._tiddler
+
+    def __repr__(self):
+        return '<LazyTiddler %s/%s>' % (self._tiddler.bag, self._tiddler.title)
+
+
+class LazyTiddlers(object):
+    """
+    a sequence of LazyTiddler, read from tiddlers as needed
+
+    supports iteration, indexing, slicing and len (which has
+    to read the whole listing).
+    """
+    def __init__(self, tiddlers, environ):
+        self._source = iter(tiddlers)
+        self._seen = []
+        self._environ = environ
+        self._exhausted = False
+
+    def _fill(self, count=None):
+        """
+        read from the listing until there are count tiddlers
+        (or all of them if count is None). returns False if
+        there aren't enough.
+        """
+        while not self._exhausted and (count is None or len(self._seen) < count):
+            try:
+                tiddler = self._source.next()
+            except StopIteration:
+                self._exhausted = True
+                break
+            self._seen.append(LazyTiddler(tiddler, self._environ))
+        return count is None or len(self._seen) >= count
+
+    def __iter__(self):
+        index = 0
+        while index < len(self._seen) or self._fill(index + 1):
+            yield self._seen[index]
+            index += 1
+
+    def __len__(self):
+        self._fill()
+        return len(self._seen)
+
+    def __nonzero__(self):
+        return self._fill(1)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            if (index.start or 0) < 0 or index.stop is None or index.stop < 0:
+                self._fill()
+            else:
+                self._fill(index.stop)
+            return self._seen[index]
+        if index < 0:
+            self._fill()
+        else:
+            self._fill(index + 1)
+        return self._seen[index]
+
+    def page(self, number, size=20):
+        """
+        return the tiddlers on page number (counting from 1)
+        when split into pages of size tiddlers
+        """
+        start = (max(1, int(number)) - 1) * size
+        return self[start:start + size]
+
+    def raw(self):
+        """
+        yield the underlying tiddlers, for passing
+        on to other serializers
+        """
+        for lazy in self:
+            yield lazy._tiddler
@@ -0,0 +1,246 @@
+"""
+Run independent jobs (eg - rendering sibling sub-templates)
+on a small pool of threads.
+
+Everything rendering a page takes its threads from the same
+semaphore (see request_slots), so however deeply sub-templates
+are nested, no more than render_threads of them are rendered
+at once. The threads themselves are shared by every request, so
+rendering a page doesn't start new ones. Jobs that can't get a
+thread are run one after another in the thread that asked for them.
+
+A job that times out is cancelled. It stops the next time it
+calls check_cancelled (as RequestStore does before every read),
+so that it doesn't go on using the request once it has been
+abandoned.
+"""
+from Queue import Queue, Empty
+import threading
+import logging
+import time
+import sys
+
+IDLE_TIMEOUT = 60
+
+_local = threading.local()
+
+
+class Cancelled(Exception):
+    """
+    the job running in this thread has been cancelled
+    """
+    pass
+
+
+class Deadline(object):
+    """
+    cancels the job running inline in this thread once
+    timeout seconds have passed (see check_cancelled)
+    """
+    def __init__(self, timeout=None):
+        self.expires = timeout and time.time() + timeout
+
+    def isSet(self):
+        return bool(self.expires) and time.time() > self.expires
+
+
+class WorkerPool(object):
+    """
+    threads that run jobs for every request. a thread is started
+    whenever there are none waiting, and ends once it has waited
+    idle_timeout seconds without being given anything to do.
+    """
+    def __init__(self, idle_timeout=IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self.idle = 0
+        self.threads = 0
+        self._tasks = Queue()
+        self._lock = threading.Lock()
+
+    def submit(self, func):
+        """
+        call func in one of the threads
+        """
+        self._lock.acquire()
+        try:
+            if self.idle:
+                #it is taken by a waiting thread
+                self.idle -= 1
+            else:
+                self.threads += 1
+                thread = threading.Thread(target=self._run)
+                thread.setDaemon(True)
+                thread.start()
+            self._tasks.put(func)
+        finally:
+            self._lock.release()
+
+    def _run(self):
+        while True:
+            try:
+                func = self._tasks.get(True, self.idle_timeout)
+            except Empty:
+                self._lock.acquire()
+                try:
+                    if self.idle and self._tasks.empty():
+                        self.idle -= 1
+                        self.threads -= 1
+                        return
+                    continue
+                finally:
+                    self._lock.release()
+            try:
+                func()
+            except Exception:
+                logging.exception('tw_pages: render thread failed')
+            self._lock.acquire()
+            self.idle += 1
+            self._lock.release()
+
+POOL = WorkerPool()
+
+
+def check_cancelled():
+    """
+    raise Cancelled if the job running in this thread,
+    or any job that started it, has been cancelled
+    """
+    for cancelled in getattr(_local, 'cancelled', ()):
+        if cancelled.isSet():
+            raise Cancelled()
+
+
+def request_slots(environ):
+    """
+    return the semaphore that limits the number of threads
+    used to render this request, putting it into environ
+    if it isn't there already
+    """
+    try:
+        return environ['tw_pages.render_slots']
+    except KeyError:
+        threads = environ['tiddlyweb.config']['tw_pages'].get('render_threads', 1)
+        if threads <= 1:
+            threads = 0
+        return environ.setdefault('tw_pages.render_slots',
+            threading.Semaphore(threads))
+
+
+def run_parallel(jobs, slots, timeout=None, default=''):
+    """
+    run each job in jobs, a list of (key, func, args), on as many
+    threads as can be taken from slots (a Semaphore) and return a
+    dict of key: result. If none can be taken the jobs are run in
+    this thread instead.
+
+    If a job takes longer than timeout seconds its result is
+    replaced with default and it is cancelled. Any other
+    exception raised by a job is raised again here.
+    """
+    workers = 0
+    if len(jobs) > 1:
+        while workers < len(jobs) and slots.acquire(False):
+            workers += 1
+    if not workers:
+        return _run_inline(jobs, timeout, default)
+
+    queue = Queue()
+    for job in jobs:
+        queue.put(job)
+    #jobs started by a job are cancelled along with it
+    parents = list(getattr(_local, 'cancelled', ()))
+    cancelled = dict((key, threading.Event()) for key, func, args in jobs)
+    results = {}
+    errors = []
+    started = {}
+    condition = threading.Condition()
+
+    def work():
+        try:
+            while True:
+                try:
+                    key, func, args = queue.get_nowait()
+                except Empty:
+                    return
+                if cancelled[key].isSet():
+                    continue
+                _local.cancelled = parents + [cancelled[key]]
+                condition.acquire()
+                started[key] = time.time()
+                condition.release()
+                try:
+                    result = func(*args)
+                except Cancelled:
+                    result = default
+                except Exception:
+                    result = default
+                    errors.append(sys.exc_info())
+                _local.cancelled = []
+                condition.acquire()
+                try:
+                    #a timed out job has already had its result set
+                    results.setdefault(key, result)
+                    condition.notify()
+                finally:
+                    condition.release()
+        finally:
+            slots.release()
+
+    for i in range(workers):
+        POOL.submit(work)
+
+    condition.acquire()
+    try:
+        while len(results) < len(jobs) and not errors:
+            condition.wait(timeout and min(timeout, 0.5) or 0.5)
+            check_cancelled()
+            if not timeout:
+                continue
+            now = time.time()
+            for key, job_started in started.items():
+                if key not in results and now - job_started > timeout:
+                    logging.warn('tw_pages: %s timed out after %ss', key, timeout)
+                    results[key] = default
+                    cancelled[key].set()
+                    #the stuck thread is abandoned, so replace it if possible
+                    if not queue.empty() and slots.acquire(False):
+                        POOL.submit(work)
+    finally:
+        condition.release()
+        #stop anything still running, or still to run
+        for event in cancelled.values():
+            event.set()
+
+    if errors:
+        exc_type, exc_value, exc_traceback = errors[0]
+        raise exc_type, exc_value, exc_traceback
+    return results
+
+
+def _run_inline(jobs, timeout, default):
+    """
+    run_parallel in this thread. a job that is still running
+    after timeout seconds stops the next time it calls
+    check_cancelled, and its result is replaced with default.
+    """
+    parents = list(getattr(_local, 'cancelled', ()))
+    results = {}
+    try:
+        for key, func, args in jobs:
+            check_cancelled()
+            deadline = Deadline(timeout)
+            _local.cancelled = parents + [deadline]
+            try:
+                result = func(*args)
+            except Cancelled:
+                if not deadline.isSet():
+                    #the job that started this one was cancelled
+                    raise
+            if deadline.isSet():
+                logging.warn('tw_pages: %s timed out after %ss', key, timeout)
+                result = default
+            results[key] = result
+            _local.cancelled = parents
+    finally:
+        _local.cancelled = parents
+    return results
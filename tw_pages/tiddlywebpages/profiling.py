@@ -0,0 +1,262 @@
+"""
+Time where rendering a page goes
+
+If 'profile' is set in the tw_pages config, each page records a tree
+of timings: every template and sub-template, the recipes fetched and
+filtered for them, store reads, Jinja rendering, the wrapper and any
+other serializers passed through to. The tree is sent with the page
+(in a header, or a comment at the end of it), and the time taken by
+each template is kept so that /tiddlywebpages/stats can list the
+slowest ones. The stats page is only added when 'profile' is set.
+"""
+from tiddlywebpages.cache import cache_stats
+
+from collections import deque
+import simplejson
+import threading
+import time
+
+PROFILE_HEADER = 'X-TW-Pages-Profile'
+MAX_HEADER_LENGTH = 4000
+#the kinds of timing that are listed by /tiddlywebpages/stats
+STATS_KINDS = ('page', 'template', 'wrapper', 'serializer')
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+class Timing(object):
+    """
+    the time taken by one part of rendering a
+    page, and by each of the parts inside it
+    """
+    def __init__(self, kind, name, parent=None):
+        self.kind = kind
+        self.name = name
+        self.parent = parent
+        self.children = []
+        self.start = time.time()
+        self.elapsed = None
+
+    def describe(self):
+        if self.name:
+            return '%s %s' % (self.kind, self.name)
+        return self.kind
+
+    def as_text(self, depth=0):
+        """
+        return the tree as indented lines, one per timing
+        """
+        lines = ['%s%8.2fms %s' % ('  ' * depth, _ms(self.elapsed),
+            self.describe())]
+        for child in self.children:
+            lines.append(child.as_text(depth + 1))
+        return '\n'.join(lines)
+
+    def as_header(self):
+        """
+        return the tree on a single line
+        """
+        text = '%s=%.2fms' % (self.describe(), _ms(self.elapsed))
+        if self.children:
+            text += '[%s]' % ', '.join(child.as_header()
+                for child in self.children)
+        return text
+
+    def walk(self):
+        yield self
+        for child in self.children:
+            for timing in child.walk():
+                yield timing
+
+
+class Profiler(object):
+    """
+    records the timings for one request. the timing being
+    recorded is kept for each thread, so sub-templates rendered
+    in other threads need to adopt the timing they belong to.
+    """
+    def __init__(self, max_samples=200):
+        self.root = Timing('page', '')
+        self.max_samples = max_samples
+        self._local = threading.local()
+
+    def current(self):
+        """
+        return the timing in progress in this thread
+        """
+        return getattr(self._local, 'timing', self.root)
+
+    def adopt(self, timing):
+        """
+        record what this thread does inside timing
+        """
+        self._local.timing = timing
+
+    def start(self, kind, name=''):
+        parent = self.current()
+        timing = Timing(kind, name, parent)
+        parent.children.append(timing)
+        self._local.timing = timing
+        return timing
+
+    def stop(self, timing):
+        timing.elapsed = time.time() - timing.start
+        self._local.timing = timing.parent
+
+    def timed(self, kind, name, function, *args, **kwargs):
+        """
+        call function, recording how long it took
+        """
+        timing = self.start(kind, name)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            self.stop(timing)
+
+    def finish(self, name=None):
+        """
+        stop timing the page, and add its timings to the stats
+        """
+        if name is not None:
+            self.root.name = name
+        self.root.elapsed = time.time() - self.root.start
+        _add_stats(self.root, self.max_samples)
+        return self.root
+
+
+class NullProfiler(object):
+    """
+    used in place of a Profiler when profiling is off
+    """
+    root = None
+
+    def current(self):
+        return None
+
+    def adopt(self, timing):
+        pass
+
+    def start(self, kind, name=''):
+        return None
+
+    def stop(self, timing):
+        pass
+
+    def timed(self, kind, name, function, *args, **kwargs):
+        return function(*args, **kwargs)
+
+    def finish(self, name=None):
+        return None
+
+NULL_PROFILER = NullProfiler()
+
+
+def request_profiler(environ):
+    """
+    return the Profiler for this request (or NULL_PROFILER if
+    profiling is off), putting it into environ if it isn't
+    there already
+    """
+    try:
+        return environ['tw_pages.profiler']
+    except KeyError:
+        tw_pages = environ['tiddlyweb.config']['tw_pages']
+        if tw_pages.get('profile'):
+            profiler = Profiler(tw_pages.get('profile_samples', 200))
+        else:
+            profiler = NULL_PROFILER
+        return environ.setdefault('tw_pages.profiler', profiler)
+
+
+def _ms(seconds):
+    return (seconds or 0) * 1000
+
+
+def _add_stats(root, max_samples):
+    """
+    keep the last max_samples times taken by each
+    template in the tree
+    """
+    _stats_lock.acquire()
+    try:
+        for timing in root.walk():
+            if timing.kind not in STATS_KINDS or timing.elapsed is None:
+                continue
+            key = (timing.kind, timing.name)
+            try:
+                samples = _stats[key]
+            except KeyError:
+                samples = _stats[key] = deque(maxlen=max_samples)
+            samples.append(timing.elapsed)
+    finally:
+        _stats_lock.release()
+
+
+def _percentile(ordered, percent):
+    index = int(round(percent / 100.0 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+def get_stats():
+    """
+    return a list of the timings kept for each template,
+    slowest (by 95th percentile) first
+    """
+    _stats_lock.acquire()
+    try:
+        samples = [(key, sorted(times)) for key, times in _stats.items()]
+    finally:
+        _stats_lock.release()
+    stats = []
+    for (kind, name), times in samples:
+        if not times:
+            continue
+        stats.append({
+            'kind': kind,
+            'name': name,
+            'count': len(times),
+            'mean': _ms(sum(times) / len(times)),
+            'p50': _ms(_percentile(times, 50)),
+            'p95': _ms(_percentile(times, 95)),
+            'max': _ms(times[-1])
+        })
+    stats.sort(key=lambda stat: stat['p95'], reverse=True)
+    return stats
+
+
+def profile_stats(environ, start_response):
+    """
+    list the slowest templates rendered by this process, and
+    how well each cache is doing, as JSON. Entry point for 
+    selector from /tiddlywebpages/stats
+    """
+    start_response('200 OK', [
+        ('Content-Type', 'application/json; charset=utf-8'),
+        ('Cache-Control', 'no-cache')
+        ])
+    return [simplejson.dumps({
+        'templates': get_stats(),
+        'caches': cache_stats(environ['tiddlyweb.config'])
+        })]
+
+
+class ProfileHeader(object):
+    """
+    WSGI middleware that sends the timings recorded
+    for a page in the X-TW-Pages-Profile header
+    """
+    def __init__(self, application):
+        self.application = application
+
+    def __call__(self, environ, start_response):
+        def profile_start_response(status, headers, exc_info=None):
+            timing = environ.get('tw_pages.profile')
+            if timing is not None:
+                header = timing.as_header()
+                if len(header) > MAX_HEADER_LENGTH:
+                    header = header[:MAX_HEADER_LENGTH - 3] + '...'
+                headers = list(headers) + [(PROFILE_HEADER,
+                    header.encode('utf-8'))]
+            return start_response(status, headers, exc_info)
+        return self.application(environ, profile_start_response)
@@ -3,13 +3,17 @@ TiddlyWebPages
 
 by Ben Gillies
 """
-from tiddlywebpages.url_handler import get_template
 
 from tiddlyweb.model.bag import Bag
 from tiddlyweb.model.tiddler import Tiddler
-from tiddlyweb.store import NoBagError
+from tiddlyweb.store import NoBagError, StoreMethodNotImplemented
+from tiddlyweb.util import sha
 
-from tiddlyweb import control
+import simplejson
+import threading
+import logging
+import time
+import os
 import re
 
 BAG_OF_TEMPLATES = "templates"
@@ -18,49 +22,213 @@ DEFAULT_TEMPLATES = [
     'application/twpages',
     'text/html'
     ]
+_check_lock = threading.Lock()
         
 def register_templates(config, store):
     """
     get the templates out of the store, register them as extensions-
     types and serializers with TiddlyWeb, and put them into environ 
     ready for use.
+    
+    Only the fields of each template are needed to register it. If
+    a metadata_cache file is configured, templates that haven't changed
+    since it was written are registered from it without being read from
+    the store, and the template itself is read when it is first used 
+    (see load_template_text).
     """
-    #get the templates out of the store
-    bag = Bag(BAG_OF_TEMPLATES)
-    bag = store.get(bag)
-    tiddlers = control.get_tiddlers_from_bag(bag)
+    bag = store.get(Bag(_template_bag(config)))
+    metadata = _read_metadata(config)
     
     #register them in config
     config['tw_pages_serializers'] = {}
-    for tiddler in tiddlers:
-        try:
-            extensionType = tiddler.fields.pop('mime_type')
-            if extensionType not in DEFAULT_TEMPLATES:
-                config['serializers'][extensionType] = ['tiddlywebpages.serialization','%s; charset=UTF-8' % extensionType]
-        except KeyError:
-            extensionType = 'application/twpages'
-        if tiddler.title != 'Default':
-            config['extension_types'][tiddler.title] = extensionType
-        try:
-            page_title = tiddler.fields.pop('page_title')
-        except KeyError:
-            page_title = None
-        try:
-            wrapper = tiddler.fields.pop('wrapper')
-        except KeyError:
-            wrapper = None    
-        
-        config['tw_pages_serializers'][tiddler.title] = {
-            'title': page_title,
-            'type': extensionType,
-            'plugins': tiddler.fields,
-            'template': tiddler.text,
-            'wrapper': wrapper
-        }
+    config['tw_pages_metadata'] = {}
+    for tiddler in bag.list_tiddlers():
+        cached = metadata.get(tiddler.title)
+        if cached and cached['revision'] == _get_revision(store, tiddler):
+            tiddler = Tiddler(tiddler.title, bag.name)
+            tiddler.revision = cached['revision']
+            tiddler.fields = dict(cached['fields'])
+            tiddler.text = None
+        else:
+            tiddler = store.get(Tiddler(tiddler.title, bag.name))
+        register_template(config, tiddler)
     
     #finally, set the serializers
     for mime_type in DEFAULT_TEMPLATES:
         config['serializers'][mime_type] = ['tiddlywebpages.serialization','text/html; charset=UTF-8']
+    
+    config['tw_pages_checked'] = time.time()
+    _templates_changed(config)
+
+def register_template(config, tiddler):
+    """
+    register a single template tiddler as an extension
+    type and serializer with TiddlyWeb.
+    
+    tiddler.text may be None, in which case it will be
+    read from the store when it is first used.
+    """
+    config.setdefault('tw_pages_metadata', {})[tiddler.title] = {
+        'revision': tiddler.revision,
+        'fields': dict(tiddler.fields)
+    }
+    try:
+        extensionType = tiddler.fields.pop('mime_type')
+        if extensionType not in DEFAULT_TEMPLATES:
+            config['serializers'][extensionType] = ['tiddlywebpages.serialization','%s; charset=UTF-8' % extensionType]
+    except KeyError:
+        extensionType = 'application/twpages'
+    if tiddler.title != 'Default':
+        config['extension_types'][tiddler.title] = extensionType
+    try:
+        page_title = tiddler.fields.pop('page_title')
+    except KeyError:
+        page_title = None
+    try:
+        wrapper = tiddler.fields.pop('wrapper')
+    except KeyError:
+        wrapper = None    
+    try:
+        cache = tiddler.fields.pop('fragment_cache').lower() in ('true', 'yes', 'on', '1')
+    except KeyError:
+        cache = None
+    cache_vary = [name.strip() for name in 
+        tiddler.fields.pop('fragment_cache_vary', '').split(',') if name.strip()]
+    
+    config['tw_pages_serializers'][tiddler.title] = {
+        'title': page_title,
+        'type': extensionType,
+        'plugins': tiddler.fields,
+        'template': tiddler.text,
+        'wrapper': wrapper,
+        'revision': tiddler.revision,
+        'cache': cache,
+        'cache_vary': cache_vary
+    }
+
+def unregister_template(config, title):
+    """
+    remove a template that is no longer in the store
+    """
+    config.get('tw_pages_metadata', {}).pop(title, None)
+    serializer = config['tw_pages_serializers'].pop(title, None)
+    if serializer and config['extension_types'].get(title) == serializer['type']:
+        del config['extension_types'][title]
+
+def check_templates(config, store):
+    """
+    reload any templates that have changed in the store since
+    they were registered.
+
+    This is done at most once every reload_interval seconds
+    per process, so that every process picks up changes to
+    the templates without needing to be restarted or refreshed.
+    Only the revision of each template is read, unless it has
+    changed.
+    """
+    interval = config['tw_pages'].get('reload_interval')
+    if not interval or time.time() - config.get('tw_pages_checked', 0) < interval:
+        return
+    #only one thread needs to check, the others carry on as they were
+    if not _check_lock.acquire(False):
+        return
+    try:
+        config['tw_pages_checked'] = time.time()
+        bag = store.get(Bag(_template_bag(config)))
+        registered = config['tw_pages_serializers']
+        current = set()
+        changed = False
+        for tiddler in bag.list_tiddlers():
+            current.add(tiddler.title)
+            revision = _get_revision(store, tiddler)
+            if tiddler.title in registered and \
+                    registered[tiddler.title]['revision'] == revision:
+                continue
+            logging.debug('tw_pages: reloading template %s', tiddler.title)
+            tiddler = store.get(Tiddler(tiddler.title, bag.name))
+            register_template(config, tiddler)
+            changed = True
+        for title in set(registered.keys()) - current:
+            logging.debug('tw_pages: removing template %s', title)
+            unregister_template(config, title)
+            changed = True
+        if changed:
+            _templates_changed(config)
+    finally:
+        _check_lock.release()
+
+def load_template_text(config, title):
+    """
+    read the text of a template that was registered without it
+    """
+    from tiddlywebplugins.utils import get_store
+    tiddler = get_store(config).get(Tiddler(title, _template_bag(config)))
+    return tiddler.text
+
+def _read_metadata(config):
+    """
+    return the template metadata saved by _write_metadata,
+    or an empty dict if there isn't any
+    """
+    path = config['tw_pages'].get('metadata_cache')
+    if not path:
+        return {}
+    try:
+        metadata_file = open(path)
+        try:
+            return simplejson.load(metadata_file)
+        finally:
+            metadata_file.close()
+    except (IOError, ValueError):
+        return {}
+
+def _write_metadata(config):
+    """
+    save the fields and revision of each template, so that the
+    next process to start doesn't need to read them from the store
+    """
+    path = config['tw_pages'].get('metadata_cache')
+    if not path:
+        return
+    temp_path = '%s.%s.tmp' % (path, os.getpid())
+    try:
+        metadata_file = open(temp_path, 'w')
+        try:
+            simplejson.dump(config['tw_pages_metadata'], metadata_file)
+        finally:
+            metadata_file.close()
+        os.rename(temp_path, path)
+    except (IOError, OSError), exc:
+        logging.warn('tw_pages: unable to save template metadata: %s', exc)
+
+def _templates_changed(config):
+    """
+    update everything that depends on the set of templates
+    """
+    _write_metadata(config)
+    #bump the revision so that cached fragments are thrown away
+    config['tw_pages_revision'] = config.get('tw_pages_revision', 0) + 1
+    #unlike the revision, this is the same in every process
+    revisions = sorted((title, serializer['revision']) for title, serializer 
+        in config['tw_pages_serializers'].iteritems())
+    config['tw_pages_fingerprint'] = sha(repr(revisions)).hexdigest()
+    build_dispatch(config)
+
+def _get_revision(store, tiddler):
+    """
+    return the latest revision of tiddler without
+    reading the whole tiddler if possible
+    """
+    try:
+        return max(store.list_tiddler_revisions(tiddler))
+    except (StoreMethodNotImplemented, ValueError):
+        return store.get(Tiddler(tiddler.title, tiddler.bag)).revision
+
+def _template_bag(config):
+    """
+    return the name of the bag that holds the templates
+    """
+    return config['tw_pages'].get('template_bag', BAG_OF_TEMPLATES)
 
 def register_config(config, store):
     """
@@ -85,12 +253,68 @@ def register_config(config, store):
                 curr_bag = value
             else:
                 config['tw_pages_config'][curr_bag][key] = value
+    
+    build_dispatch(config)
+
+def build_dispatch(config):
+    """
+    work out which template, wrapper and page title to use for
+    every combination of container (bag or recipe), extension and 
+    list_tiddlers/single_tiddler up front, so that each request
+    only needs to look them up (see resolve_dispatch).
+    
+    containers and extensions that aren't configured are stored
+    under None.
+    """
+    if 'tw_pages_serializers' not in config:
+        #the templates haven't been registered yet
+        return
+    serializers = config['tw_pages_serializers']
+    containers = config.get('tw_pages_config', {})
+    dispatch = {}
+    for container in containers.keys() + [None]:
+        container_config = containers.get(container, {})
+        for extension in serializers.keys() + [None]:
+            for default_name in ('list_tiddlers', 'single_tiddler'):
+                if extension is not None:
+                    template = extension
+                elif default_name in container_config:
+                    template = container_config[default_name]
+                else:
+                    try:
+                        template = serializers['Default']['plugins'][default_name]
+                    except KeyError:
+                        continue
+                if 'wrapper' in container_config:
+                    wrapper = container_config['wrapper']
+                else:
+                    wrapper = serializers.get(template, {}).get('wrapper')
+                title = serializers.get(template, {}).get('title')
+                dispatch[(container, extension, default_name)] = \
+                    (template, wrapper or 'Default', title)
+    #replace the whole table at once, so requests never see half of it
+    config['tw_pages_dispatch'] = dispatch
+
+def resolve_dispatch(config, container, extension, default_name):
+    """
+    return the (template, wrapper, page title) to use for container
+    and extension. raises KeyError if there isn't one.
+    """
+    if container not in config.get('tw_pages_config', {}):
+        container = None
+    if extension not in config['tw_pages_serializers']:
+        extension = None
+    return config['tw_pages_dispatch'][(container, extension, default_name)]
 
 def refresh(environ, start_response):
     """
     Provide a mechanism for somebody to update the URL list
     in selector without restarting apache. Entry point for
     selector from the url /admin/urls/refresh
+
+    nb - templates are also reloaded automatically (see
+    check_templates), this forces a full reload in the
+    process that serves the request.
     """
     start_response('200 OK', [
         ('Content-Type', 'text/html; charset=utf-8')
@@ -0,0 +1,227 @@
+"""
+A read-through cache around the store that lasts for one request
+
+A single page often loads the same recipes, bags and tiddlers
+several times over (eg - when more than one sub-template uses
+the system recipe). RequestStore is put into environ in place
+of the store so that everything rendering the page, including
+other serializers, only reads each of them once.
+
+It also records a fingerprint (eg - the revision) of everything read
+through it, which is used to tell whether a page has changed since it
+was last rendered.
+"""
+from tiddlywebpages.profiling import NULL_PROFILER
+from tiddlywebpages.parallel import check_cancelled
+from tiddlywebpages.index import index_fingerprint
+
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.recipe import Recipe
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import NoBagError, NoRecipeError, NoTiddlerError
+from tiddlyweb.util import sha
+
+import threading
+import logging
+import copy
+
+
+def request_store(environ):
+    """
+    return the RequestStore for this request, putting
+    it into environ if it isn't there already
+    """
+    store = environ['tiddlyweb.store']
+    if not isinstance(store, RequestStore):
+        store = RequestStore(store)
+        environ['tiddlyweb.store'] = store
+    return store
+
+
+def _cache_key(thing):
+    """
+    return the key to cache thing under, or None
+    if it shouldn't be cached
+    """
+    if isinstance(thing, Tiddler):
+        return ('tiddler', thing.bag, thing.title, thing.revision)
+    if isinstance(thing, Bag):
+        #a skinny bag has no tiddlers, so it can't stand in for a full one
+        return ('bag', thing.name, bool(getattr(thing, 'skinny', False)))
+    if isinstance(thing, Recipe):
+        return ('recipe', thing.name)
+    return None
+
+
+def fingerprint(thing):
+    """
+    return something that changes whenever thing does
+    """
+    if isinstance(thing, Tiddler):
+        return thing.revision or thing.modified
+    if isinstance(thing, Bag):
+        titles = sorted(tiddler.title for tiddler in thing.list_tiddlers())
+        return sha('\n'.join(titles).encode('utf-8')).hexdigest()
+    if isinstance(thing, Recipe):
+        return repr(thing.get_recipe())
+    return None
+
+
+def _describe(key):
+    """
+    return the name of what a cache key is for
+    """
+    if key[0] == 'tiddler':
+        return u'tiddler %s/%s' % (key[1], key[2])
+    return u'%s %s' % key[:2]
+
+
+def _make_thing(key):
+    """
+    turn a cache key back into an empty recipe, bag or tiddler
+    """
+    if key[0] == 'tiddler':
+        tiddler = Tiddler(key[2], key[1])
+        tiddler.revision = key[3]
+        return tiddler
+    if key[0] == 'bag':
+        bag = Bag(key[1])
+        bag.skinny = len(key) > 2 and key[2]
+        return bag
+    return Recipe(key[1])
+
+
+class RequestStore(object):
+    """
+    wraps a store, remembering every recipe, bag and tiddler
+    that is read through it. anything other than get, put and
+    delete is passed straight through to the store.
+    """
+    def __init__(self, store):
+        self.store = store
+        self.reads = 0
+        self.saved = 0
+        self.dependencies = {}
+        self.profiler = NULL_PROFILER
+        self._cache = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def get(self, thing):
+        """
+        return thing from the cache, or the store if this
+        is the first time it has been asked for
+        """
+        #a sub-template that has timed out stops here
+        check_cancelled()
+        key = _cache_key(thing)
+        if key is None:
+            return self.store.get(thing)
+
+        self._lock.acquire()
+        try:
+            cached, cached_fingerprint = self._cache.get(key, (None, None))
+            if cached is None:
+                self.reads += 1
+            else:
+                self.saved += 1
+        finally:
+            self._lock.release()
+
+        if cached is None:
+            cached = self.profiler.timed('store', _describe(key), 
+                self.store.get, thing)
+            #make sure anything loaded from it comes back here too
+            cached.store = self
+            cached_fingerprint = fingerprint(cached)
+            self._cache[key] = (cached, cached_fingerprint)
+        self.record({key: cached_fingerprint})
+        #callers may change what they are given, so give them a copy
+        return copy.copy(cached)
+
+    def record(self, dependencies):
+        """
+        add dependencies, a dict of cache key: fingerprint, to
+        those of the request and of any recordings in progress
+        in this thread
+        """
+        check_cancelled()
+        self._lock.acquire()
+        try:
+            self.dependencies.update(dependencies)
+            for recording in self._recordings():
+                recording.update(dependencies)
+        finally:
+            self._lock.release()
+
+    def start_recording(self):
+        """
+        start keeping a separate record of what is read in
+        this thread (eg - while rendering one sub-template)
+        """
+        self._recordings().append({})
+
+    def stop_recording(self):
+        """
+        stop the most recent recording and return what it read
+        """
+        return self._recordings().pop()
+
+    def get_recordings(self):
+        """
+        return the recordings in progress in this thread, to
+        be passed to adopt_recordings in another thread
+        """
+        return list(self._recordings())
+
+    def adopt_recordings(self, recordings):
+        """
+        record what this thread reads in recordings too
+        """
+        self._local.recordings = list(recordings)
+
+    def _recordings(self):
+        try:
+            return self._local.recordings
+        except AttributeError:
+            self._local.recordings = []
+            return self._local.recordings
+
+    def fingerprints(self, keys):
+        """
+        return a dict of the current fingerprint of each of the
+        cache keys in keys. anything that no longer exists has
+        a fingerprint of None.
+        """
+        current = {}
+        for key in keys:
+            if key[0] == 'index':
+                #see tiddlywebpages.index
+                current[key] = index_fingerprint(self.store, key[1])
+                self.dependencies[key] = current[key]
+                continue
+            try:
+                self.get(_make_thing(key))
+                current[key] = self.dependencies[key]
+            except (NoBagError, NoRecipeError, NoTiddlerError):
+                current[key] = None
+        return current
+
+    def put(self, thing):
+        self._cache.clear()
+        return self.store.put(thing)
+
+    def delete(self, thing):
+        self._cache.clear()
+        return self.store.delete(thing)
+
+    def log_savings(self, description=''):
+        """
+        log how many reads were saved by the cache
+        """
+        if self.saved:
+            logging.debug('tw_pages: %d store reads for %s, %d more saved '
+                'by the request cache', self.reads, description, self.saved)
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
@@ -4,20 +4,36 @@ TiddlyWebPages
 by Ben Gillies
 """
 from tiddlywebpages.template import Template
+from tiddlywebpages.register import check_templates, resolve_dispatch, \
+    DEFAULT_TEMPLATES
+from tiddlywebpages.cache import get_fragment_cache, bag_generation
+from tiddlywebpages.parallel import run_parallel, request_slots
+from tiddlywebpages.lazy import LazyTiddlers, lazy_tiddlers
+from tiddlywebpages.request_store import request_store
+from tiddlywebpages.conditional import get_dependency_cache, dependency_key, \
+    make_etag, etag_matches
+from tiddlywebpages.profiling import request_profiler
+from tiddlywebpages.index import query_recipe
 
 from tiddlyweb.model.bag import Bag
 from tiddlyweb.model.recipe import Recipe
 from tiddlyweb.model.tiddler import Tiddler
 
 from tiddlyweb.web.handler.recipe import get_tiddlers
-from tiddlyweb import control
-from tiddlyweb.filters import parse_for_filters, recursive_filter
 from tiddlyweb.serializations.html import Serialization as HTMLSerialization
 from tiddlyweb.serializer import Serializer
+from tiddlyweb.web.http import HTTP304
 
 
+from itertools import chain
+import threading
 import re
 
+CONTENT_MARKER = u'<!--tw_pages_content-->'
+EXTENSION_RE = re.compile(r'\.([^./]+)$')
+TITLE_VARIABLE_RE = re.compile(r'\{\{ ([^{} ]+) \}\}')
+STREAM_CHUNK_SIZE = 8192
+
 def _get_recipe(environ, recipe):
     """
     return the specified recipe from the store
@@ -28,6 +44,74 @@ def _get_recipe(environ, recipe):
     
     return myRecipe
 
+def _buffer_chunks(chunks, size=STREAM_CHUNK_SIZE):
+    """
+    join the (often tiny) pieces jinja generates into
+    utf-8 encoded chunks of about size bytes
+    """
+    buffered = []
+    length = 0
+    for chunk in chunks:
+        chunk = chunk.encode('utf-8')
+        buffered.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield ''.join(buffered)
+            buffered = []
+            length = 0
+    if buffered:
+        yield ''.join(buffered)
+
+def _as_text(content):
+    """
+    join up the output of a serializer that
+    sends its output a piece at a time
+    """
+    if isinstance(content, basestring):
+        return content
+    return u''.join(isinstance(chunk, unicode) and chunk or chunk.decode('utf-8')
+        for chunk in content)
+
+def _generations(config, dependencies):
+    """
+    return the current generation of every bag that
+    dependencies (see RequestStore.record) read from
+    """
+    bags = set(key[1] for key in dependencies
+        if key[0] in ('bag', 'tiddler', 'index'))
+    return tuple((bag, bag_generation(config, bag)) for bag in sorted(bags))
+
+def _unchanged(config, generations):
+    """
+    return True if none of the bags in generations
+    have changed since they were taken
+    """
+    for bag, generation in generations:
+        if bag_generation(config, bag) != generation:
+            return False
+    return True
+
+def _then(iterable, callback):
+    """
+    yield everything in iterable, then call callback
+    """
+    for item in iterable:
+        yield item
+    callback()
+
+class TiddlerListBag(Bag):
+    """
+    a tmpbag that hands its tiddlers to serializers as they
+    are, rather than copying every one of them into the bag
+    """
+    def __init__(self, tiddlers):
+        Bag.__init__(self, 'tmpBag', tmpbag=True)
+        if not isinstance(tiddlers, list):
+            #serializers may go through them more than once
+            tiddlers = list(tiddlers)
+        #used by list_tiddlers and gen_tiddlers alike
+        self._tiddlers = tiddlers
+
 class Serialization(HTMLSerialization):
     """
     generates HTML as specified depending on the extension 
@@ -37,11 +121,21 @@ class Serialization(HTMLSerialization):
     """
     def __init__(self, environ):
         self.environ = environ
+        check_templates(environ['tiddlyweb.config'], environ['tiddlyweb.store'])
+        #share reads between everything that renders this page
+        self.store = request_store(environ)
+        self.profiler = request_profiler(environ)
+        self.store.profiler = self.profiler
+        #threads for sub-templates come from here, however deeply they are nested
+        self.render_slots = request_slots(environ)
         if 'tw_pages_title' in self.environ:
             self.page_title = self.environ.pop('tw_pages_title')
         else:
             self.page_title = ''
         self.plugin_name = ''
+        self.dispatch = None
+        self._serializers = threading.local()
+        self.stream = environ['tiddlyweb.config']['tw_pages'].get('stream', False)
         if not self.environ.get('tiddlyweb.recipe_template'):
             self.environ['tiddlyweb.recipe_template'] = {}
         self.template = Template(self.environ)
@@ -74,8 +168,10 @@ class Serialization(HTMLSerialization):
             content = self.pass_through_external_serializer(self.plugin_name, tiddler)
             return content
             
-        self.page_title = self.environ['tiddlyweb.config']['tw_pages_serializers'][self.plugin_name]['title'] or tiddler.title
+        self.page_title = self.dispatch[2] or tiddler.title
         
+        #a single tiddler is small, so there is nothing to gain from streaming it
+        self.stream = False
         return self.list_tiddlers(bag)
 
     def list_tiddlers(self, bag):
@@ -84,10 +180,7 @@ class Serialization(HTMLSerialization):
         and turns it into HTML depending on the extension type
         supplied.
         """
-        base_tiddlers = bag.list_tiddlers()
-        
-        if type(base_tiddlers) != list:
-            base_tiddlers = [t for t in base_tiddlers]
+        base_tiddlers = LazyTiddlers(bag.list_tiddlers(), self.environ)
         try:   
             tiddler = base_tiddlers[0]
             if tiddler.recipe and 'recipe' not in self.environ['tiddlyweb.recipe_template']:
@@ -113,52 +206,217 @@ class Serialization(HTMLSerialization):
             return content
         
         if not self.page_title:
-            self.page_title = self.set_page_title(self.environ['tiddlyweb.config']['tw_pages_serializers'][self.plugin_name]['title'] or self.plugin_name)
+            self.page_title = self.set_page_title(self.dispatch[2] or self.plugin_name)
         else:
             self.page_title = self.set_page_title()
         
-        content = self.generate_html(self.plugin_name, self.plugins, base_tiddlers)
-        content = self.generate_index(content)
+        if not self.check_etag(base_tiddlers):
+            #a streamed page's headers (and so its ETag) are sent before it
+            #is rendered, so until its ETag is known it is sent all at once
+            self.stream = False
+        
+        if self.stream:
+            content = self.stream_index(self.plugin_name, self.plugins, base_tiddlers)
+            #the ETag has already been sent, but what the page depends on 
+            #isn't known until it has all been, so the next ETag uses that
+            content = _then(content, lambda: self.record_etag(base_tiddlers))
+            content = chain(content, self.stream_profile())
+        else:
+            content = self.generate_html(self.plugin_name, self.plugins, base_tiddlers)
+            content = self.generate_index(content)
+            self.record_etag(base_tiddlers)
+            content += self.finish_profile()
         
+        self.store.log_savings(self.plugin_name)
         return content 
     
+    def check_etag(self, base_tiddlers):
+        """
+        if this page has been rendered before, work out its ETag
+        from what it depended on last time, and send a 304 if the 
+        browser already has it.
+        
+        returns False if the page needs an ETag that can't be worked
+        out until it has been rendered.
+        """
+        config = self.environ['tiddlyweb.config']
+        if not config['tw_pages'].get('conditional_get'):
+            return True
+        key = dependency_key(self.environ, self.plugin_name)
+        dependencies = get_dependency_cache(config).get(key)
+        if dependencies is None:
+            return False
+        etag = make_etag(self.environ, self.plugin_name, 
+            self.store.fingerprints(dependencies), base_tiddlers.raw())
+        self.environ['tw_pages.etag'] = etag
+        if etag_matches(self.environ, etag):
+            raise HTTP304(etag)
+        #start afresh, so that anything no longer used is forgotten
+        self.store.dependencies = {}
+        return True
+    
+    def record_etag(self, base_tiddlers):
+        """
+        remember what this page depended on, and set its ETag
+        """
+        config = self.environ['tiddlyweb.config']
+        if not config['tw_pages'].get('conditional_get'):
+            return
+        dependencies = dict(self.store.dependencies)
+        key = dependency_key(self.environ, self.plugin_name)
+        get_dependency_cache(config).set(key, tuple(dependencies))
+        self.environ['tw_pages.etag'] = make_etag(self.environ, 
+            self.plugin_name, dependencies, base_tiddlers.raw())
+    
+    def finish_profile(self):
+        """
+        stop timing the page, and return the timings as an HTML
+        comment to add to the end of it if profile is 'comment'.
+        """
+        timing = self.profiler.finish(self.plugin_name)
+        if timing is None:
+            return u''
+        self.environ['tw_pages.profile'] = timing
+        config = self.environ['tiddlyweb.config']
+        page_type = config['tw_pages_serializers'][self.plugin_name]['type']
+        if config['tw_pages'].get('profile') == 'comment' and \
+                ('html' in page_type or page_type in DEFAULT_TEMPLATES):
+            return u'\n<!-- tw_pages profile\n%s\n-->\n' % timing.as_text().replace('--', '- -')
+        return u''
+    
+    def stream_profile(self):
+        """
+        as finish_profile, for the end of a streamed page
+        """
+        comment = self.finish_profile()
+        if comment:
+            yield comment.encode('utf-8')
+    
     def generate_html(self, plugin_name, plugins, base_tiddlers):
         """
         recurse through the template stack and generate the HTML on the way back out.
         """
+        timing = self.profiler.start('template', plugin_name)
+        try:
+            base_tiddlers = lazy_tiddlers(base_tiddlers, self.environ)
+            template_args = self.get_template_args(plugins, base_tiddlers)
+            try:
+                template = self.template.get_template(plugin_name)
+                content = self.profiler.timed('render', plugin_name, template.render, **template_args)
+            except KeyError:
+                content = _as_text(self.pass_through_external_serializer(plugin_name, base_tiddlers))
+        finally:
+            self.profiler.stop(timing)
+        return content
+    
+    def get_template_args(self, plugins, base_tiddlers):
+        """
+        render the sub-templates in plugins and return everything
+        a template needs to be rendered.
+        """
         plugin_html = {}
         if isinstance(plugins, dict):
-            for template in plugins:
-                recipe_data = plugins[template].split('?', 1)
-                recipe = _get_recipe(self.environ, recipe_data[0])
-                plugin_tiddlers = control.get_tiddlers_from_recipe(recipe, self.environ)
-                if len(recipe_data) == 2:
-                    filters = parse_for_filters(recipe_data[1])[0]
-                    plugin_tiddlers = recursive_filter(filters, plugin_tiddlers)
-                try:
-                    plugin_plugins = self.environ['tiddlyweb.config']['tw_pages_serializers'][template]['plugins']
-                    plugin_html[template] = self.generate_html(template, plugin_plugins, plugin_tiddlers)
-                except KeyError:
-                    #there is no plugin by that name, so try a (non TiddlyWebPages) serializer instead
-                    plugin_html[template] = self.pass_through_external_serializer(template, plugin_tiddlers)
+            #sibling sub-templates don't depend on each other, so render them side by side
+            tw_pages = self.environ['tiddlyweb.config']['tw_pages']
+            recordings = self.store.get_recordings()
+            timing = self.profiler.current()
+            jobs = [(template, self._render_plugin_job, (template, plugins[template], recordings, timing)) 
+                for template in sorted(plugins)]
+            plugin_html = run_parallel(jobs, self.render_slots, 
+                tw_pages.get('fragment_timeout'))
         server_prefix = self.get_server_prefix()
+        return dict(tiddlers=base_tiddlers, extra=plugin_html, prefix=server_prefix, query=self.query, root_vars=self.environ['tiddlyweb.recipe_template'])
+    
+    def render_plugin(self, template, plugin):
+        """
+        load the tiddlers for a single sub-template and render it,
+        using a cached copy if the template allows it and none of
+        the bags it was made from have changed.
+        """
+        timing = self.profiler.start('sub-template', template)
         try:
-            self.template.set_template(plugin_name)
-            content = self.template.render(tiddlers=base_tiddlers, extra=plugin_html, prefix=server_prefix, query=self.query, root_vars=self.environ['tiddlyweb.recipe_template'])
-        except KeyError:
-            content = self.pass_through_external_serializer(plugin_name, base_tiddlers)
-        return content
+            return self._render_plugin(template, plugin)
+        finally:
+            self.profiler.stop(timing)
     
-    def get_wrapper_name(self):
-        container = self.environ['tiddlyweb.recipe_template'].get('recipe', None) or self.environ['tiddlyweb.recipe_template'].get('bag')
+    def _render_plugin(self, template, plugin):
+        recipe_data = plugin.split('?', 1)
+        recipe = self.profiler.timed('recipe', recipe_data[0], _get_recipe, self.environ, recipe_data[0])
+        cache_key = self.fragment_key(template, recipe, recipe_data)
+        config = self.environ['tiddlyweb.config']
+        if cache_key:
+            fragment_cache = get_fragment_cache(config)
+            cached = fragment_cache.get(cache_key)
+            #(entries from before generations were kept have none, so are made again)
+            if cached is not None and len(cached) == 3 and _unchanged(config, cached[2]):
+                html, dependencies, generations = cached
+                #the page still depends on what the fragment was made from
+                self.store.record(dependencies)
+                return html
+            self.store.start_recording()
+        
+        filter_string = len(recipe_data) == 2 and recipe_data[1] or ''
+        plugin_tiddlers = self.profiler.timed('query', plugin, 
+            query_recipe, self.environ, recipe, filter_string)
         try:
-            name = self.environ['tiddlyweb.config']['tw_pages_config'][container]['wrapper']
-        except KeyError:
-            name = self.environ['tiddlyweb.config']['tw_pages_serializers'][self.plugin_name]['wrapper']
-        if not name:
-            name = 'Default'
-            
-        return name
+            try:
+                plugin_plugins = self.environ['tiddlyweb.config']['tw_pages_serializers'][template]['plugins']
+                html = self.generate_html(template, plugin_plugins, plugin_tiddlers)
+            except KeyError:
+                #there is no plugin by that name, so try a (non TiddlyWebPages) serializer instead
+                html = _as_text(self.pass_through_external_serializer(template, plugin_tiddlers))
+        finally:
+            if cache_key:
+                dependencies = self.store.stop_recording()
+        
+        if cache_key:
+            #sub-templates of this one may have read bags outside its recipe
+            fragment_cache.set(cache_key, (html, dependencies,
+                _generations(config, dependencies)))
+        return html
+    
+    def _render_plugin_job(self, template, plugin, recordings, timing):
+        """
+        render_plugin in another thread, recording what it 
+        reads (and how long it takes) along with the thread 
+        that started it
+        """
+        self.store.adopt_recordings(recordings)
+        self.profiler.adopt(timing)
+        return self.render_plugin(template, plugin)
+    
+    def fragment_key(self, template, recipe, recipe_data):
+        """
+        return the key to cache the rendered template under, or
+        None if the template should not be cached.
+        
+        The key includes the generation of each bag in the recipe,
+        so it changes whenever any of their tiddlers do. (Other bags
+        read while rendering it are checked when it is used.) Query string
+        parameters and root_vars only form part of the key if they are
+        listed in the template's fragment_cache_vary field.
+        """
+        config = self.environ['tiddlyweb.config']
+        serializer = config['tw_pages_serializers'].get(template, {})
+        cache = serializer.get('cache')
+        if cache is None:
+            cache = config['tw_pages'].get('fragment_cache')
+        if not cache:
+            return None
+        
+        vary = []
+        for name in serializer.get('cache_vary', []):
+            value = self.query.get(name, self.environ['tiddlyweb.recipe_template'].get(name))
+            vary.append((name, value))
+        bags = tuple((bag, bag_filter, bag_generation(config, bag)) 
+            for bag, bag_filter in recipe.get_recipe())
+        filter_string = len(recipe_data) == 2 and recipe_data[1] or ''
+        
+        return (template, recipe.name, filter_string, tuple(vary), bags,
+            config.get('tw_pages_fingerprint'))
+    
+    def get_wrapper_name(self):
+        return self.dispatch[1]
     
     def generate_index(self, content):
         """
@@ -168,7 +426,35 @@ class Serialization(HTMLSerialization):
         """
         server_prefix = self.get_server_prefix()
         self.template.set_template(self.get_wrapper_name())
-        return self.template.render(content=content, title=self.page_title, prefix=server_prefix)
+        return self.profiler.timed('wrapper', self.get_wrapper_name(), self.template.render, 
+            content=content, title=self.page_title, prefix=server_prefix)
+    
+    def stream_index(self, plugin_name, plugins, base_tiddlers):
+        """
+        as generate_html and generate_index, but return a generator
+        that yields the page a piece at a time, starting with the
+        part of the wrapper that comes before the content.
+        
+        Sub-templates and the wrapper are rendered before anything
+        is yielded, so any errors are raised straight away.
+        """
+        base_tiddlers = lazy_tiddlers(base_tiddlers, self.environ)
+        template_args = self.get_template_args(plugins, base_tiddlers)
+        try:
+            template = self.template.get_template(plugin_name)
+        except KeyError:
+            return self.generate_index(_as_text(self.pass_through_external_serializer(plugin_name, base_tiddlers)))
+        content = template.generate(**template_args)
+        
+        wrapper = self.template.get_template(self.get_wrapper_name())
+        page = self.profiler.timed('wrapper', self.get_wrapper_name(), wrapper.render, 
+            content=CONTENT_MARKER, title=self.page_title, prefix=self.get_server_prefix())
+        if page.count(CONTENT_MARKER) != 1:
+            #the wrapper does more than just output the content, so it can't be split around it
+            return self.generate_index(u''.join(content))
+        head, tail = page.split(CONTENT_MARKER)
+        
+        return chain([head.encode('utf-8')], _buffer_chunks(content), [tail.encode('utf-8')])
     
     def get_server_prefix(self):
         """
@@ -191,17 +477,35 @@ class Serialization(HTMLSerialization):
         so that it is rendered by the correct serializer and 
         returns the output.
         """
-        serializer_module = self.environ['tiddlyweb.config']['serializers'].get(self.environ['tiddlyweb.config']['extension_types'].get(name))[0]
-        serializer = Serializer(serializer_module, self.environ)
-        
-        if (type(tiddlers) != Tiddler):
-            bag = Bag('tmpBag', tmpbag=True)
-            bag.add_tiddlers(tiddlers)
+        timing = self.profiler.start('serializer', name)
         try:
+            return self._pass_through_external_serializer(name, tiddlers)
+        finally:
+            self.profiler.stop(timing)
+    
+    def _pass_through_external_serializer(self, name, tiddlers):
+        serializer = self.get_serializer(name)
+        if isinstance(tiddlers, LazyTiddlers):
+            tiddlers = tiddlers.raw()
+        if isinstance(tiddlers, Tiddler):
             serializer.object = tiddlers
             return serializer.to_string()
-        except AttributeError:
-            return serializer.list_tiddlers(bag)
+        if not isinstance(tiddlers, Bag):
+            tiddlers = TiddlerListBag(tiddlers)
+        return serializer.list_tiddlers(tiddlers)
+    
+    def get_serializer(self, name):
+        """
+        return the Serializer for the named extension, making it
+        the first time it is used in this thread for this request
+        """
+        serializers = self._serializers.__dict__
+        try:
+            return serializers[name]
+        except KeyError:
+            config = self.environ['tiddlyweb.config']
+            serializer_module = config['serializers'].get(config['extension_types'].get(name))[0]
+            return serializers.setdefault(name, Serializer(serializer_module, self.environ))
     
     def set_page_title(self, title=None):
         """
@@ -211,10 +515,8 @@ class Serialization(HTMLSerialization):
             new_title = title
         else:
             new_title = self.page_title
-        for key, value in self.environ['tiddlyweb.recipe_template'].items():
-            if key and value:
-                new_title = new_title.replace('{{ ' + key + ' }}', value)
-        return new_title
+        recipe_template = self.environ['tiddlyweb.recipe_template']
+        return TITLE_VARIABLE_RE.sub(lambda match: recipe_template.get(match.group(1)) or match.group(0), new_title)
     
     def set_plugin_name(self, default_name):
         """
@@ -224,14 +526,11 @@ class Serialization(HTMLSerialization):
         nb - does nothing if plugin_name is already set
         """
         if not self.plugin_name:
-            try:
-                name = self.environ.get('tiddlyweb.extension') or self.environ['selector.matches'][0].rsplit('/',1)[1].rsplit('.',1)[1]
-                if name not in self.environ['tiddlyweb.config']['tw_pages_serializers']:
-                    raise IndexError
-            except IndexError:
-                try:
-                    name = self.environ['tiddlyweb.config']['tw_pages_config'][self.environ['tiddlyweb.recipe_template'].get('recipe') or self.environ['tiddlyweb.recipe_template'].get('bag')][default_name]
-                except KeyError:
-                    name = self.environ['tiddlyweb.config']['tw_pages_serializers']['Default']['plugins'][default_name]
-            return name
-        return self.plugin_name
\ No newline at end of file
+            extension = self.environ.get('tiddlyweb.extension')
+            if not extension:
+                match = EXTENSION_RE.search(self.environ.get('selector.matches', [''])[0])
+                extension = match and match.group(1)
+            container = self.environ['tiddlyweb.recipe_template'].get('recipe') or self.environ['tiddlyweb.recipe_template'].get('bag')
+            self.dispatch = resolve_dispatch(self.environ['tiddlyweb.config'], container, extension, default_name)
+            return self.dispatch[0]
+        return self.plugin_name
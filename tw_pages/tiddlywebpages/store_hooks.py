@@ -0,0 +1,112 @@
+"""
+Find out when bags and tiddlers are changed
+
+tiddlyweb 1.2 calls the functions in tiddlyweb.store.HOOKS after
+every put and delete. Earlier versions have no hooks, so HOOKS here
+is a dict of the same shape instead, which is called by HookedStore,
+a wrapper that StoreHooks (server_request_filters middleware) puts
+around the store of every request.
+
+Changes made outside of the web server (eg - by twanager) are not
+seen without tiddlyweb's own hooks.
+"""
+try:
+    from tiddlyweb.store import HOOKS
+    NATIVE_HOOKS = True
+except ImportError:
+    HOOKS = {
+        'tiddler': {'put': [], 'delete': []},
+        'bag': {'put': [], 'delete': []},
+        'recipe': {'put': [], 'delete': []},
+        'user': {'put': [], 'delete': []}
+    }
+    NATIVE_HOOKS = False
+
+from tiddlyweb.web.wsgi import StoreSet
+
+import logging
+
+
+class HookedStore(object):
+    """
+    wraps a store, calling HOOKS after every put and delete.
+    anything else is passed straight through to the store.
+    """
+    def __init__(self, store):
+        self.store = store
+
+    def get(self, thing):
+        thing = self.store.get(thing)
+        #so that anything put through it comes back here too
+        thing.store = self
+        return thing
+
+    def put(self, thing):
+        result = self.store.put(thing)
+        self._run_hooks('put', thing)
+        return result
+
+    def delete(self, thing):
+        result = self.store.delete(thing)
+        self._run_hooks('delete', thing)
+        return result
+
+    def _run_hooks(self, activity, thing):
+        hooks = HOOKS.get(thing.__class__.__name__.lower(), {})
+        for hook in hooks.get(activity, []):
+            try:
+                hook(self.store, thing)
+            except Exception:
+                logging.exception('tw_pages: store hook %s failed', hook)
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+
+def hooked_store(store):
+    """
+    return store, wrapped in a HookedStore if tiddlyweb
+    doesn't call HOOKS itself
+    """
+    if NATIVE_HOOKS or _is_hooked(store):
+        return store
+    return HookedStore(store)
+
+
+def _is_hooked(store):
+    while store is not None:
+        if isinstance(store, HookedStore):
+            return True
+        store = store.__dict__.get('store')
+    return False
+
+
+class StoreHooks(object):
+    """
+    WSGI middleware that wraps the store of each
+    request in a HookedStore, if need be
+    """
+    def __init__(self, application):
+        self.application = application
+
+    def __call__(self, environ, start_response):
+        if 'tiddlyweb.store' in environ:
+            environ['tiddlyweb.store'] = hooked_store(environ['tiddlyweb.store'])
+        return self.application(environ, start_response)
+
+
+def install(config):
+    """
+    put StoreHooks into server_request_filters, straight
+    after the store is set, if tiddlyweb has no hooks
+    """
+    if NATIVE_HOOKS:
+        return
+    filters = config['server_request_filters']
+    if StoreHooks in filters:
+        return
+    try:
+        position = filters.index(StoreSet) + 1
+    except ValueError:
+        position = len(filters)
+    filters.insert(position, StoreHooks)
@@ -2,30 +2,94 @@
 Define a class suitable for wrapping up a templating engine
 
 (in this case, jinja)
+
+The jinja Environment is shared by every request in the process,
+so templates are only compiled once rather than on every page view.
+Each compiled template is checked against the revision of its
+tiddler, so only templates that have changed are recompiled.
 """
 from tiddlywebpages.filters import TW_PAGES_FILTERS
+from tiddlywebpages.register import load_template_text
+
+from jinja2 import Environment, FunctionLoader, FileSystemBytecodeCache
+
+import threading
+
+_environment_lock = threading.Lock()
+
+def get_environment(config):
+    """
+    return the jinja Environment for this process,
+    creating it if necessary.
+    """
+    try:
+        return config['tw_pages_environment']
+    except KeyError:
+        pass
+
+    _environment_lock.acquire()
+    try:
+        if 'tw_pages_environment' not in config:
+            config['tw_pages_environment'] = _make_environment(config)
+        return config['tw_pages_environment']
+    finally:
+        _environment_lock.release()
+
+def _make_environment(config):
+    """
+    create a jinja Environment that loads templates from config,
+    with the TW_PAGES_FILTERS registered and a bytecode cache if
+    one has been configured.
+    """
+    tw_pages = config.get('tw_pages', {})
+    bytecode_cache = None
+    if tw_pages.get('bytecode_cache'):
+        bytecode_cache = FileSystemBytecodeCache(tw_pages['bytecode_cache'])
+
+    template_env = Environment(
+        loader=FunctionLoader(lambda name: _get_template(config, name)),
+        cache_size=tw_pages.get('template_cache_size', 400),
+        auto_reload=True,
+        bytecode_cache=bytecode_cache)
+    for filter_name, filter_func in TW_PAGES_FILTERS:
+        template_env.filters[filter_name] = filter_func
+    return template_env
 
-from jinja2 import Environment, FunctionLoader, Template
+def _get_template(config, template_name):
+    """
+    Returns the template as a string, along with a function
+    that tells jinja whether it is still the current revision.
+    used to pass into jinja
+    """
+    try:
+        serializer = config['tw_pages_serializers'][template_name]
+    except KeyError:
+        return None
+    revision = serializer.get('revision')
+    if serializer['template'] is None:
+        serializer['template'] = load_template_text(config, template_name)
 
-class Template():            
+    def uptodate():
+        current = config['tw_pages_serializers'].get(template_name, {})
+        return current.get('revision') == revision
+
+    return serializer['template'], None, uptodate
+
+class Template():
     def __init__(self, environ):
         self.environ = environ
         self.template = None
-        self.template_env = Environment(loader=FunctionLoader(self._get_template))
-        for filter_name, filter_func in TW_PAGES_FILTERS:
-            self.template_env.filters[filter_name] = filter_func
-            
+        self.template_env = get_environment(environ['tiddlyweb.config'])
+
     def set_template(self, template_name):
-        self.template = self.template_env.get_template(template_name)
+        self.template = self.get_template(template_name)
         
+    def get_template(self, template_name):
+        """
+        return the named jinja template without changing
+        the current one, so it can be used from other threads
+        """
+        return self.template_env.get_template(template_name)
+
     def render(self, **kwargs):
         return self.template.render(**kwargs)
-        
-    def _get_template(self, template_name):
-        """
-        Returns the template as a string. used to pass into jinja
-        """ 
-        try:
-            return self.environ['tiddlyweb.config']['tw_pages_serializers'][template_name]['template']
-        except KeyError:
-            return None
\ No newline at end of file
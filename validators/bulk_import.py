@@ -0,0 +1,323 @@
+"""
+import a large number of tiddlers, validating them in parallel
+
+Adds a twanager command that reads the tiddlers in a TiddlyWiki file,
+or a directory of .tid files, and puts them into a bag:
+
+    twanager bulkimport <bag> <file or directory> [--processes=N]
+        [--batch=N] [--validators=<module>,...] [--skip=<validator>,...]
+
+Tiddlers are read from the source a batch at a time and sent through
+TIDDLER_VALIDATORS (eg - html_validator and tiddlywiki_validator) by a
+pool of processes, one per core by default, so that slow validators
+aren't limited to a single core. Valid tiddlers are then written to
+the store a batch at a time, while the next batch is being validated.
+TiddlyWiki files are read a piece at a time, so only a couple of
+batches are held in memory at once. Progress, and the number of
+tiddlers each validator rejected, are reported on stderr.
+
+The validators are the ones in 'bulk_import_validators' in
+tiddlywebconfig.py (defaulting to html_validator and tiddlywiki_validator),
+or those given with --validators. Validators can be left out with --skip
+(eg - --skip=recaptcha).
+
+To use, add 'bulk_import' to twanager_plugins in tiddlywebconfig.py.
+"""
+from tiddlyweb.manage import make_command
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler, string_to_tags_list
+from tiddlyweb.serializer import Serializer
+from tiddlyweb.store import NoBagError
+from tiddlyweb.web.validator import TIDDLER_VALIDATORS, InvalidTiddlerError
+
+from tiddlywebplugins.utils import get_store
+
+from multiprocessing import Pool, cpu_count
+from itertools import islice
+import logging
+import codecs
+import urllib
+import time
+import sys
+import os
+import re
+
+DEFAULT_BATCH = 200
+DEFAULT_VALIDATORS = ['html_validator', 'tiddlywiki_validator']
+READ_SIZE = 64 * 1024
+STORE_AREA_START = 'id="storeArea"'
+STORE_AREA_END = '<!--POST-STOREAREA-->'
+#the title is in tiddler="..." in files from before TiddlyWiki 2.2
+TIDDLER_DIV_RE = re.compile(r'<div\s([^>]*\b(?:title|tiddler)="[^"]*"[^>]*)>(.*?)</div>',
+    re.DOTALL)
+ATTRIBUTE_RE = re.compile(r'([\w.-]+)="([^"]*)"')
+ENTITIES = [('&lt;', '<'), ('&gt;', '>'), ('&quot;', '"'), ('&#039;', "'"),
+    ('&amp;', '&')]
+
+_worker = {}
+
+
+@make_command()
+def bulkimport(args):
+    """import tiddlers, validating them in parallel. <bag> <file or directory> [--processes=N] [--batch=N] [--validators=<module>,...] [--skip=<validator>,...]"""
+    options, names = _parse_args(args)
+    if len(names) != 2:
+        print >> sys.stderr, ('usage: twanager bulkimport <bag> <file or '
+            'directory> [--processes=N] [--batch=N] [--validators=<module>,...] '
+            '[--skip=<validator>,...]')
+        return
+    bag_name, source = names
+
+    store = get_store(config)
+    try:
+        store.get(Bag(bag_name))
+    except NoBagError:
+        print >> sys.stderr, ('bag %s does not exist' % bag_name)
+        return
+    _load_validators(options['validators'])
+    validators = [validator for validator in TIDDLER_VALIDATORS
+        if _validator_name(validator) not in options['skip']]
+
+    tiddlers = read_tiddlers(source)
+    pool = Pool(options['processes'], _init_worker, (validators,))
+    imported = 0
+    rejected = {}
+    started = time.time()
+    validating = None
+    while True:
+        batch = list(islice(tiddlers, options['batch']))
+        #validate this batch while the last one is written
+        if batch:
+            next_validating = pool.map_async(_validate, batch,
+                max(1, len(batch) / (options['processes'] * 4)))
+        else:
+            next_validating = None
+        if validating is not None:
+            imported += _put_valid(store, bag_name, validating.get(), rejected)
+            _report(imported, rejected, started)
+        if next_validating is None:
+            break
+        validating = next_validating
+    pool.close()
+    pool.join()
+
+    for validator, count in sorted(rejected.items()):
+        print >> sys.stderr, ('%s rejected %d' % (validator, count))
+
+
+def _put_valid(store, bag_name, results, rejected):
+    """
+    put the tiddlers that passed validation into the bag, counting
+    those that didn't in rejected. returns the number put.
+    """
+    count = 0
+    for tiddler, validator, error in results:
+        if tiddler is None:
+            rejected[validator] = rejected.get(validator, 0) + 1
+            logging.info('bulkimport: %s rejected by %s: %s',
+                error[0], validator, error[1])
+            continue
+        tiddler.bag = bag_name
+        store.put(tiddler)
+        count += 1
+    return count
+
+
+def _parse_args(args):
+    """
+    split args into a dict of --options and a list of names
+    """
+    options = {'processes': cpu_count(), 'batch': DEFAULT_BATCH,
+        'validators': None, 'skip': []}
+    names = []
+    for arg in args:
+        if arg.startswith('--processes='):
+            options['processes'] = max(1, int(arg.split('=', 1)[1]))
+        elif arg.startswith('--batch='):
+            options['batch'] = max(1, int(arg.split('=', 1)[1]))
+        elif arg.startswith('--validators='):
+            options['validators'] = arg.split('=', 1)[1].split(',')
+        elif arg.startswith('--skip='):
+            options['skip'] = arg.split('=', 1)[1].split(',')
+        else:
+            names.append(arg)
+    return options, names
+
+
+def _load_validators(modules):
+    """
+    import and init the validator modules, so that they add
+    themselves to TIDDLER_VALIDATORS (twanager doesn't load
+    system_plugins, where they are usually listed)
+    """
+    if modules is None:
+        modules = config.get('bulk_import_validators', DEFAULT_VALIDATORS)
+    for module_name in modules:
+        module = __import__(module_name, {}, {}, ['init'])
+        before = len(TIDDLER_VALIDATORS)
+        if not [validator for validator in TIDDLER_VALIDATORS
+                if validator.__module__ == module.__name__]:
+            module.init(config)
+        logging.debug('bulkimport: %s added %d validators', module_name,
+            len(TIDDLER_VALIDATORS) - before)
+
+
+def _validator_name(validator):
+    return '%s.%s' % (validator.__module__.split('.')[-1], validator.__name__)
+
+
+def _report(imported, rejected, started, stream=sys.stderr):
+    elapsed = time.time() - started
+    rate = elapsed and (imported + sum(rejected.values())) / elapsed or 0
+    print >> stream, ('%d tiddlers imported, %d rejected (%.1f/s)' % (imported,
+        sum(rejected.values()), rate))
+
+
+def _init_worker(validators):
+    """
+    give each process its own store and the validators to run
+    """
+    _worker['store'] = get_store(config)
+    _worker['validators'] = validators
+
+
+def _validate(tiddler):
+    """
+    run tiddler through each validator in turn. returns (tiddler,
+    None, None), or (None, validator name, (title, message)) if a
+    validator rejected it.
+    """
+    environ = {
+        'tiddlyweb.config': config,
+        'tiddlyweb.store': _worker['store'],
+        'tiddlyweb.usersign': {'name': 'GUEST', 'roles': []}
+    }
+    title = tiddler.title
+    for validator in _worker['validators']:
+        try:
+            validator(tiddler, environ)
+        except InvalidTiddlerError, exc:
+            return None, _validator_name(validator), (title, str(exc))
+        except Exception, exc:
+            logging.exception('bulkimport: %s failed on %s',
+                _validator_name(validator), title)
+            return None, _validator_name(validator), (title, str(exc))
+    return tiddler, None, None
+
+
+def read_tiddlers(source):
+    """
+    yield the tiddlers in source, a TiddlyWiki file
+    or a directory of .tid files
+    """
+    if os.path.isdir(source):
+        return _read_directory(source)
+    return _read_tiddlywiki(source)
+
+
+def _read_directory(directory):
+    serializer = Serializer('text')
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith('.tid'):
+            continue
+        title = urllib.unquote(filename[:-len('.tid')]).decode('utf-8')
+        tid_file = open(os.path.join(directory, filename))
+        try:
+            content = tid_file.read().decode('utf-8')
+        finally:
+            tid_file.close()
+        tiddler = Tiddler(title)
+        serializer.object = tiddler
+        serializer.from_string(content)
+        yield tiddler
+
+
+def _read_tiddlywiki(filename):
+    wiki_file = codecs.open(filename, encoding='utf-8')
+    try:
+        found = False
+        for tiddler in _store_area_tiddlers(iter(
+                lambda: wiki_file.read(READ_SIZE), u'')):
+            found = True
+            yield tiddler
+    finally:
+        wiki_file.close()
+    if not found:
+        logging.warn('bulkimport: %s has no tiddlers in a storeArea', filename)
+
+
+def _store_area_tiddlers(chunks):
+    """
+    yield the tiddlers in the storeArea of a TiddlyWiki
+    read as chunks of text, as each is complete
+    """
+    text = u''
+    in_store_area = False
+    for chunk in chunks:
+        text += chunk
+        if not in_store_area:
+            start = text.find(STORE_AREA_START)
+            if start == -1:
+                #in case it is split between chunks
+                text = text[-len(STORE_AREA_START):]
+                continue
+            start = text.find('>', start)
+            if start == -1:
+                continue
+            text = text[start + 1:]
+            in_store_area = True
+        end = text.find(STORE_AREA_END)
+        if end != -1:
+            text = text[:end]
+        position = 0
+        for match in TIDDLER_DIV_RE.finditer(text):
+            yield _div_to_tiddler(match.group(1), match.group(2))
+            position = match.end()
+        if end != -1:
+            return
+        #keep whatever may be the start of the next one
+        text = text[position:]
+
+
+def _div_to_tiddler(attributes, body):
+    """
+    make a tiddler from a TiddlyWiki storeArea div
+    """
+    fields = dict((name, _unescape(value))
+        for name, value in ATTRIBUTE_RE.findall(attributes))
+    body = body.strip()
+    if body.startswith('<pre>'):
+        text = _unescape(body[len('<pre>'):-len('</pre>')])
+    else:
+        #the format used before TiddlyWiki 2.2
+        text = _unescape(body).replace('\\n', '\n').replace('\\s', '\\')
+    if 'title' in fields:
+        title = fields.pop('title')
+    else:
+        title = fields.pop('tiddler')
+    tiddler = Tiddler(title)
+    tiddler.text = text
+    tiddler.tags = string_to_tags_list(fields.pop('tags', ''))
+    tiddler.modifier = fields.pop('modifier', None)
+    #TiddlyWiki leaves out modified when it is the same as created,
+    #and very old ones leave out both, so keep the defaults for those
+    created = fields.pop('created', None)
+    modified = fields.pop('modified', None) or created
+    if modified:
+        tiddler.modified = modified
+    if created:
+        tiddler.created = created
+    fields.pop('changecount', None)
+    tiddler.fields = fields
+    return tiddler
+
+
+def _unescape(text):
+    for entity, character in ENTITIES:
+        text = text.replace(entity, character)
+    return text
+
+
+def init(config_in):
+    global config
+    config = config_in
@@ -0,0 +1,170 @@
+"""
+test reading and importing tiddlers with bulkimport
+"""
+import sys
+sys.path.insert(0, '.')
+
+import os
+import shutil
+import tempfile
+from StringIO import StringIO
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import Store
+from tiddlyweb.web.serve import load_app
+
+import bulk_import
+from bulk_import import read_tiddlers, _store_area_tiddlers
+
+TEST_DIR = os.path.join(tempfile.gettempdir(), 'validators_test_bulk_import')
+STORE_DIR = os.path.join(TEST_DIR, 'store')
+WIKI = os.path.join(TEST_DIR, 'wiki.html')
+
+#a tiddler that has never been edited
+UNEDITED_DIV = u'<div title="%s" created="200801010000">\n<pre>%s</pre>\n</div>\n'
+NEW_DIV = (u'<div title="%s" modifier="bob" modified="200901010000" '
+    u'tags="one [[two words]]" colour="red">\n<pre>%s</pre>\n</div>\n')
+#the format used before TiddlyWiki 2.2
+OLD_DIV = (u'<div tiddler="%s" modifier="alice" modified="200601010000" '
+    u'tags="old">%s</div>\n')
+
+
+def _wiki(divs):
+    return (u'<html><head><title>wiki</title></head><body>\n'
+        u'<div id="storeArea">\n%s</div>\n%s\n'
+        u'<div title="not a tiddler">after the storeArea</div>'
+        u'</body></html>' % (u''.join(divs), bulk_import.STORE_AREA_END))
+
+
+def _divs(count):
+    divs = []
+    for number in range(count):
+        if number % 2:
+            divs.append(OLD_DIV % (u'old %d' % number,
+                u'line one\\nline \\s &lt;two&gt;'))
+        else:
+            divs.append(NEW_DIV % (u'new %d \xe9' % number,
+                u'line one\nline &lt;two&gt;'))
+    return divs
+
+
+def _chunks(text, size):
+    return (text[start:start + size] for start in range(0, len(text), size))
+
+
+def setup_function(function):
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    os.mkdir(TEST_DIR)
+
+
+def test_old_and_new_formats():
+    tiddlers = list(_store_area_tiddlers([_wiki(_divs(2))]))
+    assert [tiddler.title for tiddler in tiddlers] == [u'new 0 \xe9', u'old 1']
+
+    new, old = tiddlers
+    assert new.text == u'line one\nline <two>'
+    assert new.tags == [u'one', u'two words']
+    assert new.modifier == u'bob'
+    assert new.fields == {u'colour': u'red'}
+
+    assert old.text == u'line one\nline \\ <two>'
+    assert old.tags == [u'old']
+    assert old.modifier == u'alice'
+    assert old.fields == {}
+
+
+def test_any_chunk_size():
+    wiki = _wiki(_divs(6))
+    whole = [(tiddler.title, tiddler.text) for tiddler in
+        _store_area_tiddlers([wiki])]
+    assert len(whole) == 6
+    for size in (1, 7, 50, 1000):
+        assert [(tiddler.title, tiddler.text) for tiddler in
+            _store_area_tiddlers(_chunks(wiki, size))] == whole
+
+
+def test_reads_file():
+    wiki_file = open(WIKI, 'w')
+    wiki_file.write(_wiki(_divs(5)).encode('utf-8'))
+    wiki_file.close()
+    bulk_import.READ_SIZE = 16
+    assert len(list(read_tiddlers(WIKI))) == 5
+
+
+def test_no_store_area():
+    wiki_file = open(WIKI, 'w')
+    wiki_file.write('<html><div title="x">x</div></html>')
+    wiki_file.close()
+    assert list(read_tiddlers(WIKI)) == []
+
+
+def test_bulkimport():
+    wiki_file = open(WIKI, 'w')
+    wiki_file.write(_wiki(_divs(7)).encode('utf-8'))
+    wiki_file.close()
+    config['server_store'] = ['text', {'store_root': STORE_DIR}]
+    store = Store('text', {'store_root': STORE_DIR}, {'tiddlyweb.config': config})
+    store.put(Bag('imported'))
+    bulk_import.init(config)
+
+    bulk_import.bulkimport(['imported', WIKI, '--processes=2', '--batch=2',
+        '--validators=tiddlywiki_validator'])
+    titles = sorted(tiddler.title for tiddler in
+        store.get(Bag('imported')).list_tiddlers())
+    assert len(titles) == 7
+    assert store.get(Tiddler(u'old 3', 'imported')).modifier == u'alice'
+
+
+def _get(app, path):
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'SCRIPT_NAME': '',
+        'PATH_INFO': path,
+        'QUERY_STRING': '',
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '8080',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': 'localhost:8080',
+        'HTTP_ACCEPT': 'text/plain',
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': StringIO(''),
+        'wsgi.errors': sys.stderr,
+    }
+    response = {}
+    def start_response(status, headers, exc_info=None):
+        response['status'] = status
+    body = ''.join(app(environ, start_response))
+    return response['status'], body
+
+
+def test_missing_dates():
+    tiddlers = list(_store_area_tiddlers([_wiki([
+        UNEDITED_DIV % (u'unedited', u'text'),
+        u'<div title="undated">\n<pre>text</pre>\n</div>\n'])]))
+    unedited, undated = tiddlers
+    assert unedited.created == u'200801010000'
+    assert unedited.modified == u'200801010000'
+    assert undated.modified
+    assert undated.modified != u'None'
+
+    wiki_file = open(WIKI, 'w')
+    wiki_file.write(_wiki([UNEDITED_DIV % (u'unedited', u'text')]).encode('utf-8'))
+    wiki_file.close()
+    config['server_store'] = ['text', {'store_root': STORE_DIR}]
+    config['system_plugins'] = []
+    config['log_file'] = os.devnull
+    store = Store('text', {'store_root': STORE_DIR}, {'tiddlyweb.config': config})
+    store.put(Bag('imported'))
+    bulk_import.init(config)
+    bulk_import.bulkimport(['imported', WIKI, '--processes=1'])
+
+    app = load_app()
+    status, body = _get(app, '/bags/imported/tiddlers/unedited')
+    assert status.startswith('200')
+    assert 'text' in body
+    status, body = _get(app, '/bags/imported/tiddlers')
+    assert status.startswith('200')
+    assert 'unedited' in body